@@ -31,6 +31,18 @@ async def admin_install_suna_for_user(
             detail=f"Failed to install Helium agent for user {account_id}"
         )
 
+@router.get("/agent-runs/scheduler")
+async def get_agent_run_scheduler_stats(_: bool = Depends(verify_admin_api_key)):
+    """Queue depth per lane and recent admission wait times of the agent run scheduler."""
+    from agent.run_scheduler import run_scheduler
+    return await run_scheduler.stats()
+
+@router.get("/sandbox-pool")
+async def get_sandbox_pool_stats(_: bool = Depends(verify_admin_api_key)):
+    """Ready sandboxes and claim/refill counters of this process's sandbox pool."""
+    from sandbox.sandbox_pool import sandbox_pool
+    return await sandbox_pool.stats()
+
 @router.get("/env-vars")
 def get_env_vars() -> Dict[str, str]:
     """Get environment variables (local mode only)."""
@@ -0,0 +1,191 @@
+"""
+Registry of running agent runs.
+
+Runs used to be tracked as ``active_run:{instance_id}:{agent_run_id}`` keys,
+which could only be found with KEYS, a scan of the whole keyspace that blocks
+Redis for every client. The registry keeps the same facts in indexed
+structures instead:
+
+- ``active_runs:owner`` hash: agent_run_id -> instance_id that owns the run
+- ``active_runs:instance:{instance_id}`` set: the runs an instance owns
+- ``active_runs:expiry`` sorted set: agent_run_id -> time (ms) after which the
+  run counts as abandoned
+
+Every change to all three is one Lua script. Finding a run's owner is O(1) and
+listing an instance's runs is O(k).
+
+A run is registered when it is started, with an expiry as long as the old
+key TTL. The worker executing it registers it again and then renews its
+expiry every few seconds. If a worker dies, its runs stop being renewed.
+``start_reaper`` then removes each such run after ``ACTIVE_RUN_LEASE_SECONDS``
+and hands it to a callback that marks it failed. Instances left with no runs
+have no set.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+OWNER_KEY = "active_runs:owner"
+EXPIRY_KEY = "active_runs:expiry"
+INSTANCE_PREFIX = "active_runs:instance:"
+
+# Abandoned runs handled per reaper pass
+REAP_BATCH_SIZE = 100
+
+_REGISTER_SCRIPT = """
+local previous = redis.call('hget', KEYS[1], ARGV[1])
+if previous and previous ~= ARGV[2] then
+    redis.call('srem', ARGV[4] .. previous, ARGV[1])
+end
+redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+redis.call('sadd', ARGV[4] .. ARGV[2], ARGV[1])
+redis.call('zadd', KEYS[2], ARGV[3], ARGV[1])
+return 1
+"""
+
+_FINISH_SCRIPT = """
+local instance = redis.call('hget', KEYS[1], ARGV[1])
+if instance then
+    redis.call('srem', ARGV[2] .. instance, ARGV[1])
+end
+redis.call('hdel', KEYS[1], ARGV[1])
+redis.call('zrem', KEYS[2], ARGV[1])
+return instance
+"""
+
+_REAP_SCRIPT = """
+local stale = redis.call('zrangebyscore', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+local reaped = {}
+for _, run_id in ipairs(stale) do
+    local instance = redis.call('hget', KEYS[1], run_id)
+    if instance then
+        redis.call('srem', ARGV[2] .. instance, run_id)
+    end
+    redis.call('hdel', KEYS[1], run_id)
+    redis.call('zrem', KEYS[2], run_id)
+    table.insert(reaped, run_id)
+    table.insert(reaped, instance or '')
+end
+return reaped
+"""
+
+
+def instance_key(instance_id: str) -> str:
+    return f"{INSTANCE_PREFIX}{instance_id}"
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class ActiveRunRegistry:
+    """Which instance owns each running agent run, with leases renewed by the executing worker."""
+
+    def __init__(self, lease_seconds: Optional[int] = None, reap_interval: Optional[int] = None):
+        self.lease_seconds = max(10, config.ACTIVE_RUN_LEASE_SECONDS if lease_seconds is None else lease_seconds)
+        self.reap_interval = config.ACTIVE_RUN_REAP_INTERVAL_SECONDS if reap_interval is None else reap_interval
+        # Runs this process is executing and renewing
+        self._local: set = set()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._reaper_task: Optional[asyncio.Task] = None
+        self.reaped = 0
+
+    async def _eval(self, script: str, *args):
+        redis_client = await redis.get_client()
+        return await redis_client.eval(script, 2, OWNER_KEY, EXPIRY_KEY, *args)
+
+    async def register(self, agent_run_id: str, instance_id: str, ttl: Optional[int] = None) -> None:
+        """Record that an instance owns a run, expiring after ``ttl`` seconds unless renewed."""
+        expires_at = _now_ms() + (redis.REDIS_KEY_TTL if ttl is None else ttl) * 1000
+        await self._eval(_REGISTER_SCRIPT, agent_run_id, instance_id, expires_at, INSTANCE_PREFIX)
+
+    async def start(self, agent_run_id: str, instance_id: str) -> None:
+        """Register a run this process is executing and keep its lease renewed until ``finish``."""
+        await self.register(agent_run_id, instance_id, ttl=self.lease_seconds)
+        self._local.add(agent_run_id)
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def finish(self, agent_run_id: str) -> Optional[str]:
+        """Drop a run from the registry. Returns the instance that owned it, if any."""
+        self._local.discard(agent_run_id)
+        return await self._eval(_FINISH_SCRIPT, agent_run_id, INSTANCE_PREFIX)
+
+    async def owner(self, agent_run_id: str) -> Optional[str]:
+        redis_client = await redis.get_client()
+        return await redis_client.hget(OWNER_KEY, agent_run_id)
+
+    async def runs_for_instance(self, instance_id: str) -> List[str]:
+        redis_client = await redis.get_client()
+        return list(await redis_client.smembers(instance_key(instance_id)))
+
+    async def count(self) -> int:
+        redis_client = await redis.get_client()
+        return await redis_client.hlen(OWNER_KEY)
+
+    async def _heartbeat(self) -> None:
+        interval = self.lease_seconds / 3
+        while self._local:
+            try:
+                expires_at = _now_ms() + self.lease_seconds * 1000
+                redis_client = await redis.get_client()
+                # XX: a run finished by someone else (e.g. the reaper) is not brought back
+                await redis_client.zadd(EXPIRY_KEY, {run_id: expires_at for run_id in self._local}, xx=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to renew active run leases: {str(e)}")
+            await asyncio.sleep(interval)
+
+    async def reap(self, on_abandoned: Callable[[str, str], Awaitable[None]]) -> int:
+        """Remove runs whose lease ran out and pass each (agent_run_id, instance_id) to ``on_abandoned``."""
+        reaped = 0
+        while True:
+            flat = await self._eval(_REAP_SCRIPT, _now_ms(), INSTANCE_PREFIX, REAP_BATCH_SIZE)
+            pairs = list(zip(flat[::2], flat[1::2]))
+            for agent_run_id, instance_id in pairs:
+                logger.warning(f"Agent run {agent_run_id} of instance {instance_id or 'unknown'} stopped renewing its lease")
+                try:
+                    await on_abandoned(agent_run_id, instance_id)
+                except Exception as e:
+                    logger.error(f"Failed to clean up abandoned agent run {agent_run_id}: {str(e)}")
+            reaped += len(pairs)
+            if len(pairs) < REAP_BATCH_SIZE:
+                break
+        self.reaped += reaped
+        return reaped
+
+    async def _reap_forever(self, on_abandoned: Callable[[str, str], Awaitable[None]]) -> None:
+        while True:
+            try:
+                await self.reap(on_abandoned)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Active run reaper failed: {str(e)}")
+            await asyncio.sleep(self.reap_interval)
+
+    def start_reaper(self, on_abandoned: Callable[[str, str], Awaitable[None]]) -> None:
+        """Periodically reap abandoned runs in this process (0 s interval disables)."""
+        if self.reap_interval <= 0 or (self._reaper_task is not None and not self._reaper_task.done()):
+            return
+        self._reaper_task = asyncio.create_task(self._reap_forever(on_abandoned))
+
+    async def stop(self) -> None:
+        for task in (self._reaper_task, self._heartbeat_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._reaper_task = None
+        self._heartbeat_task = None
+
+
+active_run_registry = ActiveRunRegistry()
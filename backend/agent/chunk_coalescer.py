@@ -0,0 +1,127 @@
+"""
+Coalescing of streamed assistant deltas before they are fanned out.
+
+The response processor yields one message per LLM delta, often only a few
+characters long. ``ChunkCoalescer`` sits between the agent generator and the
+response writer: consecutive assistant content chunks of the same run are merged
+into one frame that is flushed every ``flush_interval_ms`` or once it holds
+``max_bytes`` of text. Everything else (status, tool and complete messages)
+flushes the pending frame and passes straight through, so ordering is kept.
+"""
+
+import asyncio
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.config import config
+from utils.json_helpers import to_json_string, fast_json_dumps
+from utils.logger import logger
+
+
+def _is_content_chunk(response: Dict[str, Any]) -> bool:
+    if response.get('type') != 'assistant':
+        return False
+    metadata = response.get('metadata')
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except json.JSONDecodeError:
+            return False
+    return isinstance(metadata, dict) and metadata.get('stream_status') == 'chunk'
+
+
+def _chunk_text(response: Dict[str, Any]) -> Optional[str]:
+    content = response.get('content')
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except json.JSONDecodeError:
+            return None
+    if isinstance(content, dict) and isinstance(content.get('content'), str):
+        return content['content']
+    return None
+
+
+class ChunkCoalescer:
+    """Merges assistant content chunks into time/size-bounded frames.
+
+    Args:
+        sink: Called with every frame or passed-through response, in order
+        flush_interval_ms: Longest a chunk waits before its frame is flushed; 0 disables coalescing
+        max_bytes: Frame text size that triggers an immediate flush
+    """
+
+    def __init__(self, sink: Callable[[Dict[str, Any]], None], flush_interval_ms: Optional[int] = None, max_bytes: Optional[int] = None):
+        self._sink = sink
+        self._interval = (config.AGENT_STREAM_COALESCE_INTERVAL_MS if flush_interval_ms is None else flush_interval_ms) / 1000
+        self._max_bytes = config.AGENT_STREAM_COALESCE_MAX_BYTES if max_bytes is None else max_bytes
+        self._frame: Optional[Dict[str, Any]] = None
+        self._parts: List[str] = []
+        self._frame_bytes = 0
+        self._frame_chunks = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.chunks_in = 0
+        self.frames_out = 0
+        self.bytes_saved = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._interval > 0
+
+    def add(self, response: Dict[str, Any]) -> None:
+        """Accept the next response from the agent generator."""
+        if not self.enabled or not _is_content_chunk(response):
+            self.flush()
+            self._sink(response)
+            return
+
+        text = _chunk_text(response)
+        if text is None:
+            self.flush()
+            self._sink(response)
+            return
+
+        self.chunks_in += 1
+        if self._frame is not None and response.get('metadata') != self._frame.get('metadata'):
+            # A different run's chunks must not end up in the same frame
+            self.flush()
+
+        if self._frame is None:
+            # The frame keeps the first chunk's sequence, so clients still order frames correctly
+            self._frame = response
+            self._timer = asyncio.get_running_loop().call_later(self._interval, self.flush)
+
+        self._parts.append(text)
+        self._frame_bytes += len(text.encode('utf-8'))
+        self._frame_chunks += 1
+
+        if self._frame_bytes >= self._max_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        """Emit the pending frame, if any."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._frame is None:
+            return
+
+        frame, parts, chunks = self._frame, self._parts, self._frame_chunks
+        self._frame, self._parts, self._frame_bytes, self._frame_chunks = None, [], 0, 0
+
+        if chunks > 1:
+            frame = {**frame, 'content': to_json_string({"role": "assistant", "content": "".join(parts)})}
+            # Every merged chunk would have carried the same envelope around its text
+            envelope_bytes = len(fast_json_dumps(frame)) - len(fast_json_dumps("".join(parts)))
+            self.bytes_saved += envelope_bytes * (chunks - 1)
+        self.frames_out += 1
+        self._sink(frame)
+
+    def close(self) -> None:
+        """Flush the pending frame and log what coalescing saved."""
+        self.flush()
+        if self.chunks_in:
+            logger.info(
+                f"Coalesced {self.chunks_in} content chunks into {self.frames_out} frames "
+                f"({self.chunks_in - self.frames_out} frames, ~{self.bytes_saved} bytes saved)"
+            )
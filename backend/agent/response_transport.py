@@ -0,0 +1,223 @@
+"""
+Transport for agent run responses between the background worker and SSE streams.
+
+Two modes, selected with ``AGENT_RESPONSE_TRANSPORT``:
+
+- ``list``: responses are RPUSHed to ``agent_run:{id}:responses`` and every write
+  is announced with ``PUBLISH agent_run:{id}:new_response new``. Consumers
+  LRANGE from the last index they have seen.
+- ``stream``: responses are XADDed to ``agent_run:{id}:response_stream``.
+  Consumers read batches with a single ``XREAD BLOCK`` from the last stream ID
+  they have seen, which also lets a reconnecting client resume where it left off.
+  Run-ending control signals are appended to the stream as well, so a viewer
+  needs neither pub/sub connection.
+
+Each response is serialized once, by the worker, into its ready SSE frame
+(``data: {json}\n\n``) next to a small type/status header: list entries are
+``\x1e{type}\x1f{status}\x1f{frame}``, stream entries carry ``frame``, ``type``
+and ``status`` fields. Consumers look only at the header and relay the frame
+as is. Bare-JSON entries written before this format are still read.
+
+The API and the worker must be deployed with the same mode.
+"""
+
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from services import redis
+from utils.config import config
+from utils.json_helpers import fast_json_dumps
+from utils.logger import logger
+
+TRANSPORT_LIST = "list"
+TRANSPORT_STREAM = "stream"
+
+# How long a consumer blocks on XREAD before looping
+RESPONSE_STREAM_BLOCK_MS = 5000
+# Maximum entries returned by one XREAD
+RESPONSE_STREAM_READ_COUNT = 500
+
+# List entry layout: FRAME_MARKER type HEADER_SEPARATOR status HEADER_SEPARATOR frame
+FRAME_MARKER = "\x1e"
+HEADER_SEPARATOR = "\x1f"
+SSE_DATA_PREFIX = "data: "
+
+
+def transport_mode() -> str:
+    mode = (config.AGENT_RESPONSE_TRANSPORT or TRANSPORT_LIST).lower()
+    return TRANSPORT_STREAM if mode == TRANSPORT_STREAM else TRANSPORT_LIST
+
+
+def response_list_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:responses"
+
+
+def response_channel(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:new_response"
+
+
+def response_stream_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:response_stream"
+
+
+def control_channel(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:control"
+
+
+def frame_body(response: Dict[str, Any]) -> str:
+    """The SSE frame for a response, without its ``id:`` line."""
+    return f"{SSE_DATA_PREFIX}{fast_json_dumps(response)}\n\n"
+
+
+def decode_frame(body: str) -> Dict[str, Any]:
+    """The response inside an SSE frame."""
+    return json.loads(body[len(SSE_DATA_PREFIX):])
+
+
+def parse_entry(entry: str) -> Tuple[str, str, str]:
+    """Split a list entry into (type, status, SSE frame) reading only its header."""
+    if entry.startswith(FRAME_MARKER):
+        response_type, status, body = entry[1:].split(HEADER_SEPARATOR, 2)
+        return response_type, status, body
+    # Entries written before framing are bare JSON
+    response = json.loads(entry)
+    return str(response.get('type') or ''), str(response.get('status') or ''), f"{SSE_DATA_PREFIX}{entry}\n\n"
+
+
+def stream_entry_body(fields: Dict[str, str]) -> str:
+    """The SSE frame of a stream entry."""
+    if 'frame' in fields:
+        return fields['frame']
+    return f"{SSE_DATA_PREFIX}{fields['data']}\n\n"
+
+
+def _stream_fields(response_type: str, status: str, body: str) -> Dict[str, str]:
+    # type/status ride along so consumers can spot the end of a run without parsing the frame
+    fields = {'frame': body}
+    if response_type:
+        fields['type'] = response_type
+    if status:
+        fields['status'] = status
+    return fields
+
+
+class ResponseWriter:
+    """Ordered writer for one run's responses.
+
+    ``append`` never waits on Redis. A single background task writes whatever
+    has queued up since its last round trip in one pipeline, so responses keep
+    their order and bursts of small deltas cost one round trip instead of one each.
+    """
+
+    def __init__(self, agent_run_id: str, mode: Optional[str] = None):
+        self.agent_run_id = agent_run_id
+        self.mode = mode or transport_mode()
+        self._pending: List[Tuple[str, str, str]] = []
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._task: Optional[asyncio.Task] = None
+        self.entries_written = 0
+        self.round_trips = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def append(self, response: Dict[str, Any]) -> None:
+        """Queue a response for writing."""
+        if self._closed:
+            raise RuntimeError(f"Response writer for {self.agent_run_id} is closed")
+        self._pending.append((str(response.get('type') or ''), str(response.get('status') or ''), frame_body(response)))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def close(self) -> None:
+        """Write everything queued so far and stop the background task."""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+        logger.debug(f"Response writer for {self.agent_run_id} wrote {self.entries_written} entries in {self.round_trips} round trips")
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    await self._write(batch)
+                except Exception as e:
+                    logger.error(f"Failed to write {len(batch)} responses for agent run {self.agent_run_id}: {str(e)}")
+            if self._closed:
+                return
+
+    async def _write(self, batch: List[Tuple[str, str, str]]) -> None:
+        redis_client = await redis.get_client()
+        pipe = redis_client.pipeline(transaction=False)
+        if self.mode == TRANSPORT_STREAM:
+            key = response_stream_key(self.agent_run_id)
+            for response_type, status, body in batch:
+                pipe.xadd(key, _stream_fields(response_type, status, body))
+        else:
+            entries = [f"{FRAME_MARKER}{response_type}{HEADER_SEPARATOR}{status}{HEADER_SEPARATOR}{body}" for response_type, status, body in batch]
+            pipe.rpush(response_list_key(self.agent_run_id), *entries)
+            pipe.publish(response_channel(self.agent_run_id), "new")
+        await pipe.execute()
+        self.entries_written += len(batch)
+        self.round_trips += 1
+
+
+async def publish_control(agent_run_id: str, signal: str) -> None:
+    """Send a control signal (STOP, END_STREAM, ERROR) for a run.
+
+    The signal always goes to the control channel the worker listens on; in
+    stream mode it is also appended to the response stream for viewers.
+    """
+    await redis.publish(control_channel(agent_run_id), signal)
+    if transport_mode() == TRANSPORT_STREAM:
+        await redis.xadd(response_stream_key(agent_run_id), {'control': signal})
+
+
+async def read_all(agent_run_id: str) -> List[Dict[str, Any]]:
+    """Get every response written for a run so far."""
+    if transport_mode() == TRANSPORT_STREAM:
+        return [decode_frame(body) for body in await read_frames(agent_run_id)]
+    return [decode_frame(parse_entry(entry)[2]) for entry in await redis.lrange(response_list_key(agent_run_id), 0, -1)]
+
+
+async def read_frames(agent_run_id: str, start: int = 0, end: int = -1) -> List[str]:
+    """Get the SSE frames of responses ``start`` to ``end`` (inclusive; -1 is the last) without decoding them."""
+    if transport_mode() == TRANSPORT_STREAM:
+        entries = await redis.xrange(response_stream_key(agent_run_id))
+        bodies = [stream_entry_body(fields) for _, fields in entries if 'control' not in fields]
+        return bodies[start:] if end == -1 else bodies[start:end + 1]
+    return [parse_entry(entry)[2] for entry in await redis.lrange(response_list_key(agent_run_id), start, end)]
+
+
+async def read_stream(agent_run_id: str, last_id: str, block_ms: Optional[int] = None) -> List[Tuple[str, Dict[str, str]]]:
+    """Read stream entries after ``last_id``, waiting up to ``block_ms`` if there are none yet.
+
+    Returns:
+        List of (entry_id, fields); fields hold either ``frame`` (plus ``type``/``status``) or ``control``.
+    """
+    key = response_stream_key(agent_run_id)
+    result = await redis.xread({key: last_id}, count=RESPONSE_STREAM_READ_COUNT, block=block_ms)
+    if not result:
+        return []
+    # [[key, [(id, fields), ...]]]
+    return list(result[0][1])
+
+
+async def expire(agent_run_id: str, ttl: int) -> None:
+    """Set a TTL on the run's stored responses."""
+    key = response_stream_key(agent_run_id) if transport_mode() == TRANSPORT_STREAM else response_list_key(agent_run_id)
+    await redis.expire(key, ttl)
+
+
+async def delete(agent_run_id: str) -> None:
+    """Delete the run's stored responses."""
+    key = response_stream_key(agent_run_id) if transport_mode() == TRANSPORT_STREAM else response_list_key(agent_run_id)
+    await redis.delete(key)
@@ -36,6 +36,7 @@ from utils.knowledge_base_manager import global_kb_manager
 from agent.tools.sb_sheets_tool import SandboxSheetsTool
 from agent.tools.task_list_tool import TaskListTool
 from agent.tools.sb_web_dev_tool import SandboxWebDevTool
+from sandbox.handle_registry import sandbox_registry
 from agentpress.tool import SchemaType
 
 load_dotenv()
@@ -185,12 +186,7 @@ class MCPManager:
             await mcp_wrapper_instance.initialize_and_register_tools()
             
             updated_schemas = mcp_wrapper_instance.get_schemas()
-            for method_name, schema_list in updated_schemas.items():
-                for schema in schema_list:
-                    self.thread_manager.tool_registry.tools[method_name] = {
-                        "instance": mcp_wrapper_instance,
-                        "schema": schema
-                    }
+            self.thread_manager.tool_registry.register_tool_instance(mcp_wrapper_instance, updated_schemas)
             
             return mcp_wrapper_instance
         except Exception as e:
@@ -417,6 +413,8 @@ class MessageManager:
                 browser_state_text = browser_content.copy()
                 browser_state_text.pop('screenshot_base64', None)
                 browser_state_text.pop('image_url', None)
+                # Already summarized as elements_changed in the tool result
+                browser_state_text.pop('elements_diff', None)
 
                 if browser_state_text:
                     temp_message_content_list.append({
@@ -493,14 +491,8 @@ class AgentRunner:
         if not self.account_id:
             raise ValueError("Could not determine account ID for thread")
 
-        project = await self.client.table('projects').select('*').eq('project_id', self.config.project_id).execute()
-        if not project.data or len(project.data) == 0:
-            raise ValueError(f"Project {self.config.project_id} not found")
-
-        project_data = project.data[0]
-        sandbox_info = project_data.get('sandbox', {})
-        if not sandbox_info.get('id'):
-            raise ValueError(f"No sandbox found for project {self.config.project_id}")
+        # Resolves the project's sandbox once for the whole run; the sandbox tools reuse the handle
+        await sandbox_registry.get_project_sandbox(self.client, self.config.project_id)
     
     async def setup_tools(self):
         tool_manager = ToolManager(self.thread_manager, self.config.project_id, self.config.thread_id)
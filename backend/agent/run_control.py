@@ -0,0 +1,123 @@
+"""
+Shared listener for agent run control signals.
+
+Each run used to hold its own pub/sub connection and poll it every 0.1 s for
+STOP. Instead, every worker process keeps one pattern subscription to
+``agent_run:*:control*`` (the global and the instance-specific control
+channels) and hands STOP to the run it names through an ``asyncio.Event``.
+
+A run calls ``register`` before it starts and checks or awaits the returned
+event; ``unregister`` when it ends. Signals for runs this process does not
+hold are ignored. If the subscription drops, the listener reconnects with
+backoff and registered runs keep their events.
+"""
+
+import asyncio
+from typing import Dict, Optional
+
+from services import redis
+from utils.logger import logger
+
+CONTROL_PATTERN = "agent_run:*:control*"
+# How long one read blocks; the only wakeups of an idle listener
+LISTEN_TIMEOUT_SECONDS = 5.0
+MAX_RECONNECT_DELAY_SECONDS = 10.0
+SUBSCRIBE_TIMEOUT_SECONDS = 10.0
+
+
+def _run_id_from_channel(channel: str) -> Optional[str]:
+    # agent_run:{id}:control or agent_run:{id}:control:{instance_id}
+    parts = channel.split(":")
+    if len(parts) in (3, 4) and parts[0] == "agent_run" and parts[2] == "control":
+        return parts[1]
+    return None
+
+
+class RunControlListener:
+    """One control-channel subscription per process, dispatching STOP to registered runs."""
+
+    def __init__(self):
+        self._events: Dict[str, asyncio.Event] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._subscribed: Optional[asyncio.Event] = None
+        self.signals_dispatched = 0
+
+    async def register(self, agent_run_id: str) -> asyncio.Event:
+        """Track a run and return the event set when it is told to stop.
+
+        Waits until the subscription is active, so a STOP sent after this returns is not missed.
+
+        Raises:
+            asyncio.TimeoutError: if the subscription cannot be set up
+        """
+        event = self._events.setdefault(agent_run_id, asyncio.Event())
+        self._ensure_started()
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=SUBSCRIBE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            self.unregister(agent_run_id)
+            raise
+        return event
+
+    def unregister(self, agent_run_id: str) -> None:
+        self._events.pop(agent_run_id, None)
+
+    def _ensure_started(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._subscribed = asyncio.Event()
+        self._task = asyncio.create_task(self._listen())
+
+    def _dispatch(self, channel: str, data: str) -> None:
+        if data != "STOP":
+            return
+        agent_run_id = _run_id_from_channel(channel)
+        event = self._events.get(agent_run_id) if agent_run_id else None
+        if event is not None and not event.is_set():
+            logger.info(f"Received STOP signal for agent run {agent_run_id} on {channel}")
+            event.set()
+            self.signals_dispatched += 1
+
+    async def _listen(self) -> None:
+        delay = 0.5
+        while True:
+            pubsub = None
+            try:
+                pubsub = await redis.create_pubsub()
+                await pubsub.psubscribe(CONTROL_PATTERN)
+                self._subscribed.set()
+                logger.debug(f"Listening for agent run control signals on {CONTROL_PATTERN}")
+                delay = 0.5
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=LISTEN_TIMEOUT_SECONDS)
+                    if not message or message.get("type") != "pmessage":
+                        continue
+                    channel, data = message.get("channel"), message.get("data")
+                    if isinstance(channel, bytes): channel = channel.decode('utf-8')
+                    if isinstance(data, bytes): data = data.decode('utf-8')
+                    self._dispatch(channel, data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._subscribed.clear()
+                logger.error(f"Agent run control listener failed, reconnecting in {delay:.1f}s: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY_SECONDS)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+run_control_listener = RunControlListener()
@@ -0,0 +1,356 @@
+"""
+Admission control for agent runs.
+
+Without it every ``run_agent_background`` message is picked up as soon as a
+dramatiq thread is free, so one account can fill every worker with trigger
+runs and interactive starts wait behind them. With
+``AGENT_RUN_WORKER_CONCURRENCY`` set, runs go through a queue in Redis instead:
+
+- ``submit`` (API side) stores the run under ``agent_run_queue:entries`` and
+  adds it to one of two lanes, ``interactive`` (user starts) or ``background``
+  (triggers and workflows), ordered by enqueue time. It returns the run's
+  position, and refuses the run when its account already has
+  ``AGENT_RUN_ACCOUNT_MAX_QUEUED`` runs waiting.
+- ``drain`` (worker side) admits runs while this worker process has fewer than
+  ``AGENT_RUN_WORKER_CONCURRENCY`` running, and starts each one as its own
+  task, so admitted runs execute concurrently and the dispatch message returns
+  right away. Admission takes the oldest interactive run, then the oldest
+  background run, whose account has fewer than ``AGENT_RUN_ACCOUNT_CONCURRENCY``
+  runs in flight across all workers. A finished run's slot is refilled in
+  process.
+- Accounts hold one lease per running run in ``agent_run_queue:running:{account}``.
+  Workers renew leases every few seconds and expired ones are dropped, so a
+  crashed worker frees its account's slots after ``AGENT_RUN_LEASE_SECONDS``.
+
+Enqueue, admission and cancellation are single Lua scripts, so two processes
+never admit the same run. The API and the workers must be deployed with the
+same settings.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+LANE_INTERACTIVE = "interactive"
+LANE_BACKGROUND = "background"
+LANES = (LANE_INTERACTIVE, LANE_BACKGROUND)
+
+QUEUE_PREFIX = "agent_run_queue"
+ENTRIES_KEY = f"{QUEUE_PREFIX}:entries"
+QUEUED_PER_ACCOUNT_KEY = f"{QUEUE_PREFIX}:queued"
+RUNNING_PREFIX = f"{QUEUE_PREFIX}:running:"
+WAIT_SAMPLES_KEY = f"{QUEUE_PREFIX}:wait_ms"
+
+# Queued runs looked at per lane when the oldest ones belong to accounts at their limit
+ADMIT_SCAN_LIMIT = 50
+# Recent admission wait times kept for the stats endpoint
+WAIT_SAMPLES_KEPT = 500
+
+_ENQUEUE_SCRIPT = """
+local queued = tonumber(redis.call('hget', KEYS[3], ARGV[2]) or '0')
+if queued >= tonumber(ARGV[5]) then
+    return -1
+end
+if redis.call('hsetnx', KEYS[2], ARGV[1], ARGV[4]) == 0 then
+    return -2
+end
+redis.call('hincrby', KEYS[3], ARGV[2], 1)
+redis.call('zadd', KEYS[1], ARGV[3], ARGV[1])
+local position = redis.call('zrank', KEYS[1], ARGV[1])
+if KEYS[1] ~= KEYS[4] then
+    position = position + redis.call('zcard', KEYS[4])
+end
+return position
+"""
+
+_ADMIT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local account_limit = tonumber(ARGV[2])
+local lease_ms = tonumber(ARGV[3])
+for lane = 1, 2 do
+    local at_limit = {}
+    for _, run_id in ipairs(redis.call('zrange', KEYS[lane], 0, tonumber(ARGV[5]) - 1)) do
+        local raw = redis.call('hget', KEYS[3], run_id)
+        if not raw then
+            redis.call('zrem', KEYS[lane], run_id)
+        else
+            local account = cjson.decode(raw)['account_id']
+            if not at_limit[account] then
+                local running = ARGV[4] .. account
+                redis.call('zremrangebyscore', running, '-inf', now)
+                if redis.call('zcard', running) < account_limit then
+                    redis.call('zrem', KEYS[lane], run_id)
+                    redis.call('hdel', KEYS[3], run_id)
+                    if redis.call('hincrby', KEYS[4], account, -1) <= 0 then
+                        redis.call('hdel', KEYS[4], account)
+                    end
+                    redis.call('zadd', running, now + lease_ms, run_id)
+                    redis.call('pexpire', running, lease_ms)
+                    return raw
+                end
+                at_limit[account] = true
+            end
+        end
+    end
+end
+return false
+"""
+
+_CANCEL_SCRIPT = """
+local raw = redis.call('hget', KEYS[3], ARGV[1])
+if not raw then
+    return 0
+end
+redis.call('zrem', KEYS[1], ARGV[1])
+redis.call('zrem', KEYS[2], ARGV[1])
+redis.call('hdel', KEYS[3], ARGV[1])
+local account = cjson.decode(raw)['account_id']
+if redis.call('hincrby', KEYS[4], account, -1) <= 0 then
+    redis.call('hdel', KEYS[4], account)
+end
+return 1
+"""
+
+
+class RunQueueFull(Exception):
+    """The account already has as many runs waiting as it may queue."""
+
+
+def lane_key(lane: str) -> str:
+    return f"{QUEUE_PREFIX}:{lane}"
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _percentile(samples: List[int], fraction: float) -> Optional[int]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class RunScheduler:
+    """Per-worker and per-account concurrency limits in front of the agent run actor."""
+
+    def __init__(
+        self,
+        worker_concurrency: Optional[int] = None,
+        account_concurrency: Optional[int] = None,
+        account_max_queued: Optional[int] = None,
+        lease_seconds: Optional[int] = None,
+    ):
+        self.worker_concurrency = config.AGENT_RUN_WORKER_CONCURRENCY if worker_concurrency is None else worker_concurrency
+        self.account_concurrency = max(1, config.AGENT_RUN_ACCOUNT_CONCURRENCY if account_concurrency is None else account_concurrency)
+        self.account_max_queued = config.AGENT_RUN_ACCOUNT_MAX_QUEUED if account_max_queued is None else account_max_queued
+        self.lease_seconds = max(10, config.AGENT_RUN_LEASE_SECONDS if lease_seconds is None else lease_seconds)
+        self._active = 0
+        # agent_run_id -> account_id for runs admitted by this process
+        self._leases: Dict[str, str] = {}
+        # Admitted runs executing in this process
+        self._runs: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.admitted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.worker_concurrency > 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    async def submit(self, agent_run_id: str, account_id: str, lane: str, run_kwargs: Dict[str, Any]) -> int:
+        """Queue a run for admission.
+
+        Returns:
+            Number of runs ahead of it across both lanes
+
+        Raises:
+            RunQueueFull: if the account may not queue more runs
+        """
+        if lane not in LANES:
+            raise ValueError(f"Unknown run lane: {lane}")
+        enqueued_at = _now_ms()
+        entry = {
+            'account_id': account_id or "unknown",
+            'lane': lane,
+            'enqueued_at': enqueued_at,
+            'kwargs': run_kwargs,
+        }
+        redis_client = await redis.get_client()
+        position = await redis_client.eval(
+            _ENQUEUE_SCRIPT, 4,
+            lane_key(lane), ENTRIES_KEY, QUEUED_PER_ACCOUNT_KEY, lane_key(LANE_INTERACTIVE),
+            agent_run_id, entry['account_id'], enqueued_at, json.dumps(entry), self.account_max_queued,
+        )
+        position = int(position)
+        if position == -1:
+            raise RunQueueFull(f"Account {account_id} already has {self.account_max_queued} agent runs waiting")
+        if position == -2:
+            logger.warning(f"Agent run {agent_run_id} is already queued")
+            return 0
+        logger.info(f"Queued agent run {agent_run_id} in the {lane} lane at position {position}")
+        return position
+
+    async def cancel(self, agent_run_id: str) -> bool:
+        """Drop a run that has not been admitted yet. Returns True if it was still queued."""
+        redis_client = await redis.get_client()
+        removed = await redis_client.eval(
+            _CANCEL_SCRIPT, 4,
+            lane_key(LANE_INTERACTIVE), lane_key(LANE_BACKGROUND), ENTRIES_KEY, QUEUED_PER_ACCOUNT_KEY,
+            agent_run_id,
+        )
+        if removed:
+            logger.info(f"Removed queued agent run {agent_run_id} before admission")
+        return bool(removed)
+
+    async def _admit(self) -> Optional[Dict[str, Any]]:
+        redis_client = await redis.get_client()
+        raw = await redis_client.eval(
+            _ADMIT_SCRIPT, 4,
+            lane_key(LANE_INTERACTIVE), lane_key(LANE_BACKGROUND), ENTRIES_KEY, QUEUED_PER_ACCOUNT_KEY,
+            _now_ms(), self.account_concurrency, self.lease_seconds * 1000, RUNNING_PREFIX, ADMIT_SCAN_LIMIT,
+        )
+        if not raw:
+            return None
+        entry = json.loads(raw)
+        wait_ms = max(0, _now_ms() - entry['enqueued_at'])
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.lpush(WAIT_SAMPLES_KEY, wait_ms)
+        pipe.ltrim(WAIT_SAMPLES_KEY, 0, WAIT_SAMPLES_KEPT - 1)
+        await pipe.execute()
+        self.admitted += 1
+        logger.info(f"Admitted agent run {entry['kwargs']['agent_run_id']} from the {entry['lane']} lane after {wait_ms} ms")
+        return entry
+
+    async def _release(self, agent_run_id: str, account_id: str) -> None:
+        try:
+            await (await redis.get_client()).zrem(f"{RUNNING_PREFIX}{account_id}", agent_run_id)
+        except Exception as e:
+            logger.warning(f"Failed to release account slot of agent run {agent_run_id}: {str(e)}")
+
+    async def drain(self, execute: Callable[[Dict[str, Any]], Awaitable[None]]) -> int:
+        """Admit queued runs while this worker has a free slot, starting each as its own task.
+
+        ``execute`` gets the keyword arguments the run was submitted with.
+
+        Returns:
+            Number of runs admitted
+        """
+        admitted = 0
+        while self._active < self.worker_concurrency:
+            # Take the slot before the round trip so concurrent drains cannot overshoot
+            self._active += 1
+            try:
+                entry = await self._admit()
+            except Exception:
+                self._active -= 1
+                raise
+            if entry is None:
+                self._active -= 1
+                break
+
+            self._leases[entry['kwargs']['agent_run_id']] = entry['account_id']
+            task = asyncio.create_task(self._execute(entry, execute))
+            self._runs.add(task)
+            task.add_done_callback(self._runs.discard)
+            admitted += 1
+        return admitted
+
+    async def _execute(self, entry: Dict[str, Any], execute: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        agent_run_id = entry['kwargs']['agent_run_id']
+        try:
+            await execute(entry['kwargs'])
+        except Exception as e:
+            logger.error(f"Scheduled agent run {agent_run_id} failed: {str(e)}", exc_info=True)
+        finally:
+            self._active -= 1
+            self._leases.pop(agent_run_id, None)
+            await self._release(agent_run_id, entry['account_id'])
+        # Hand the freed slot to the next queued run
+        try:
+            await self.drain(execute)
+        except Exception as e:
+            logger.error(f"Failed to admit queued agent runs: {str(e)}")
+
+    async def _renew_leases(self) -> None:
+        if not self._leases:
+            return
+        expires_at = _now_ms() + self.lease_seconds * 1000
+        pipe = (await redis.get_client()).pipeline(transaction=False)
+        for agent_run_id, account_id in list(self._leases.items()):
+            running = f"{RUNNING_PREFIX}{account_id}"
+            pipe.zadd(running, {agent_run_id: expires_at}, xx=True)
+            pipe.pexpire(running, self.lease_seconds * 1000)
+        await pipe.execute()
+
+    async def _maintain(self, wake: Callable[[], None]) -> None:
+        interval = self.lease_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._renew_leases()
+                # Runs left waiting (e.g. behind an expired lease) get picked up without a new submit
+                if self._active < self.worker_concurrency and await self.queue_depth() > 0:
+                    wake()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Agent run scheduler maintenance failed: {str(e)}")
+
+    def start(self, wake: Callable[[], None]) -> None:
+        """Start lease renewal in this worker process; ``wake`` asks some worker to drain the queue."""
+        if not self.enabled or (self._task is not None and not self._task.done()):
+            return
+        self._task = asyncio.create_task(self._maintain(wake))
+        logger.info(f"Agent run scheduler started ({self.worker_concurrency} runs per worker, {self.account_concurrency} per account)")
+
+    async def queue_depth(self) -> int:
+        redis_client = await redis.get_client()
+        pipe = redis_client.pipeline(transaction=False)
+        for lane in LANES:
+            pipe.zcard(lane_key(lane))
+        return sum(await pipe.execute())
+
+    async def stats(self) -> Dict[str, Any]:
+        redis_client = await redis.get_client()
+        now = _now_ms()
+        pipe = redis_client.pipeline(transaction=False)
+        for lane in LANES:
+            pipe.zcard(lane_key(lane))
+            pipe.zrange(lane_key(lane), 0, 0, withscores=True)
+        pipe.lrange(WAIT_SAMPLES_KEY, 0, -1)
+        results = await pipe.execute()
+
+        lanes = {}
+        for i, lane in enumerate(LANES):
+            depth, oldest = results[2 * i], results[2 * i + 1]
+            lanes[lane] = {
+                'depth': depth,
+                'oldest_wait_ms': int(now - oldest[0][1]) if oldest else 0,
+            }
+        samples = [int(s) for s in results[-1]]
+        return {
+            'enabled': self.enabled,
+            'worker_concurrency': self.worker_concurrency,
+            'account_concurrency': self.account_concurrency,
+            'account_max_queued': self.account_max_queued,
+            'lanes': lanes,
+            'wait_ms': {
+                'samples': len(samples),
+                'p50': _percentile(samples, 0.5),
+                'p95': _percentile(samples, 0.95),
+                'p99': _percentile(samples, 0.99),
+                'max': max(samples) if samples else None,
+            },
+        }
+
+
+run_scheduler = RunScheduler()
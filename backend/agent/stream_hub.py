@@ -0,0 +1,298 @@
+"""
+In-process fan-out of agent run responses to SSE viewers.
+
+Every viewer of ``/agent-run/{id}/stream`` used to open its own pub/sub
+connections, LRANGE the whole response list on connect and after every
+notification, and decode and re-encode each entry. ``RunStreamHub`` keeps one
+``RunFeed`` per run in each API process instead:
+
+- The feed holds the only Redis subscription for the run (pub/sub plus LRANGE
+  of just the new entries in list mode, one blocking XREAD in stream mode; see
+  agent/response_transport.py). Entries arrive as ready SSE frames; the feed
+  reads only their type/status header, adds the ``id:`` line and encodes the
+  frame once, so viewers relay bytes without any JSON decoding.
+- Frames are kept in a ring of the last ``AGENT_STREAM_HUB_BUFFER_FRAMES``.
+  Each viewer only holds a cursor into it, so any number of local viewers cost
+  one upstream read. Frames older than the ring are read back from Redis for
+  the viewer that needs them.
+- Frames are numbered from 0 in run order (``id:`` in the SSE frame), so a
+  reconnecting EventSource resumes after its ``Last-Event-ID``.
+- A feed without viewers is closed after ``AGENT_STREAM_HUB_IDLE_SECONDS``;
+  a finished run's frames stay available to late viewers until then.
+"""
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from agent import response_transport
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+TERMINAL_STATUSES = ('completed', 'failed', 'stopped')
+CONTROL_SIGNALS = ('STOP', 'END_STREAM', 'ERROR')
+# How long one pub/sub read blocks before looping
+LISTEN_TIMEOUT_SECONDS = 5.0
+
+
+def _status_frame(status: str, message: Optional[str] = None) -> str:
+    data = {'type': 'status', 'status': status}
+    if message is not None:
+        data['message'] = message
+    return response_transport.frame_body(data)
+
+
+def _is_terminal(response_type: str, status: str) -> bool:
+    return response_type == 'status' and status in TERMINAL_STATUSES
+
+
+class RunFeed:
+    """One run's responses as numbered SSE frames, read from Redis once per process."""
+
+    def __init__(
+        self,
+        hub: 'RunStreamHub',
+        agent_run_id: str,
+        is_running: Callable[[], Awaitable[bool]],
+        buffer_frames: int,
+    ):
+        self.hub = hub
+        self.agent_run_id = agent_run_id
+        self.mode = response_transport.transport_mode()
+        self._is_running = is_running
+        self._buffer_frames = max(1, buffer_frames)
+        self._frames: List[bytes] = []
+        self._base_seq = 0
+        self._next_seq = 0
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._linger: Optional[asyncio.Task] = None
+        self.finished = False
+        self.viewers = 0
+        self.total_viewers = 0
+        self.redis_reads = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._follow())
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _append(self, body: str) -> None:
+        self._frames.append(f"id: {self._next_seq}\n{body}".encode('utf-8'))
+        self._next_seq += 1
+        # Trim in bulk so appends stay O(1)
+        if len(self._frames) > 2 * self._buffer_frames:
+            drop = len(self._frames) - self._buffer_frames
+            del self._frames[:drop]
+            self._base_seq += drop
+
+    def _finish(self, body: Optional[str] = None) -> None:
+        if body is not None:
+            self._append(body)
+        self.finished = True
+        self._notify()
+
+    def _ingest(self, entries: List[str]) -> bool:
+        """Buffer newly read list entries; True once the run has ended."""
+        for entry in entries:
+            response_type, status, body = response_transport.parse_entry(entry)
+            self._append(body)
+            if _is_terminal(response_type, status):
+                logger.info(f"Detected run completion via status message in stream for {self.agent_run_id}")
+                self._finish()
+                return True
+        if entries:
+            self._notify()
+        return False
+
+    async def _read_list(self) -> bool:
+        self.redis_reads += 1
+        return self._ingest(await redis.lrange(response_transport.response_list_key(self.agent_run_id), self._next_seq, -1))
+
+    async def _still_running(self, catch_up: Callable[[], Awaitable[bool]]) -> bool:
+        """Check the run's status once the backlog is buffered; ends the feed if it is over."""
+        if await self._is_running():
+            return True
+        # Whatever the run wrote before its status changed is in Redis by now
+        if not await catch_up():
+            logger.info(f"Agent run {self.agent_run_id} is not running. Ending stream.")
+            self._finish(_status_frame('completed'))
+        return False
+
+    async def _follow_list(self) -> None:
+        response_channel = response_transport.response_channel(self.agent_run_id)
+        control_channel = response_transport.control_channel(self.agent_run_id)
+        pubsub = await redis.create_pubsub()
+        try:
+            # Subscribe before the first read so no notification falls in between
+            await pubsub.subscribe(response_channel, control_channel)
+            if await self._read_list() or not await self._still_running(self._read_list):
+                return
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=LISTEN_TIMEOUT_SECONDS)
+                if not message or message.get("type") != "message":
+                    continue
+                channel, data = message.get("channel"), message.get("data")
+                if isinstance(channel, bytes): channel = channel.decode('utf-8')
+                if isinstance(data, bytes): data = data.decode('utf-8')
+                if channel == control_channel and data in CONTROL_SIGNALS:
+                    logger.info(f"Received control signal '{data}' for {self.agent_run_id}")
+                    if not await self._read_list():
+                        self._finish(_status_frame(data))
+                    return
+                if channel == response_channel and data == "new" and await self._read_list():
+                    return
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception as e:
+                logger.debug(f"Error closing pubsub for {self.agent_run_id}: {e}")
+
+    async def _follow_stream(self) -> None:
+        last_id = "0-0"
+
+        async def read(block_ms: Optional[int] = None) -> bool:
+            nonlocal last_id
+            self.redis_reads += 1
+            entries = await response_transport.read_stream(self.agent_run_id, last_id, block_ms=block_ms)
+            for entry_id, fields in entries:
+                last_id = entry_id
+                if 'control' in fields:
+                    logger.info(f"Received control signal '{fields['control']}' for {self.agent_run_id}")
+                    self._finish(_status_frame(fields['control']))
+                    return True
+                self._append(response_transport.stream_entry_body(fields))
+                if _is_terminal(fields.get('type', ''), fields.get('status', '')):
+                    logger.info(f"Detected run completion via status message in stream for {self.agent_run_id}")
+                    self._finish()
+                    return True
+            if entries:
+                self._notify()
+            return False
+
+        async def catch_up() -> bool:
+            while True:
+                before = self._next_seq
+                if await read():
+                    return True
+                if self._next_seq - before < response_transport.RESPONSE_STREAM_READ_COUNT:
+                    return False
+
+        if await catch_up() or not await self._still_running(catch_up):
+            return
+        while not await read(response_transport.RESPONSE_STREAM_BLOCK_MS):
+            pass
+
+    async def _follow(self) -> None:
+        try:
+            if self.mode == response_transport.TRANSPORT_STREAM:
+                await self._follow_stream()
+            else:
+                await self._follow_list()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming agent run {self.agent_run_id}: {e}", exc_info=True)
+            self._finish(_status_frame('error', f'Stream failed: {e}'))
+            # The next viewer gets a fresh feed instead of this error
+            self.hub._discard(self)
+
+    async def _history(self, start: int, end: int) -> List[bytes]:
+        """Frames ``start`` to ``end`` (exclusive) that have left the ring, read back from Redis."""
+        bodies = await response_transport.read_frames(self.agent_run_id, start, end - 1)
+        return [f"id: {start + i}\n{body}".encode('utf-8') for i, body in enumerate(bodies)]
+
+    async def frames(self, after: int = -1) -> AsyncIterator[bytes]:
+        """Yield every frame numbered above ``after``, then new ones until the run ends."""
+        cursor = after + 1
+        while True:
+            changed = self._changed
+            if cursor < self._base_seq:
+                older = await self._history(cursor, self._base_seq)
+                if not older:
+                    cursor = self._base_seq
+                for frame in older:
+                    yield frame
+                cursor += len(older)
+                continue
+            if cursor < self._next_seq:
+                batch = self._frames[cursor - self._base_seq:]
+                cursor += len(batch)
+                for frame in batch:
+                    yield frame
+                continue
+            if self.finished:
+                return
+            await changed.wait()
+
+    async def close(self) -> None:
+        for task in (self._task, self._linger):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        logger.debug(f"Closed stream feed for {self.agent_run_id}: {self.total_viewers} viewers, {self._next_seq} frames, {self.redis_reads} Redis reads")
+
+
+class RunStreamHub:
+    """The feeds of one API process, keyed by agent run."""
+
+    def __init__(self, buffer_frames: Optional[int] = None, idle_seconds: Optional[int] = None):
+        self.buffer_frames = config.AGENT_STREAM_HUB_BUFFER_FRAMES if buffer_frames is None else buffer_frames
+        self.idle_seconds = config.AGENT_STREAM_HUB_IDLE_SECONDS if idle_seconds is None else idle_seconds
+        self._feeds: Dict[str, RunFeed] = {}
+
+    async def frames(
+        self,
+        agent_run_id: str,
+        is_running: Callable[[], Awaitable[bool]],
+        after: int = -1,
+    ) -> AsyncIterator[bytes]:
+        """Stream a run's encoded SSE frames numbered above ``after``.
+
+        ``is_running`` is only called when this process has no feed for the run yet.
+        """
+        feed = self._feeds.get(agent_run_id)
+        if feed is None:
+            feed = RunFeed(self, agent_run_id, is_running, self.buffer_frames)
+            self._feeds[agent_run_id] = feed
+            feed.start()
+        if feed._linger is not None:
+            feed._linger.cancel()
+            feed._linger = None
+
+        feed.viewers += 1
+        feed.total_viewers += 1
+        try:
+            async for frame in feed.frames(after):
+                yield frame
+        finally:
+            feed.viewers -= 1
+            if feed.viewers == 0 and self._feeds.get(agent_run_id) is feed:
+                feed._linger = asyncio.create_task(self._expire(feed))
+
+    async def _expire(self, feed: RunFeed) -> None:
+        await asyncio.sleep(self.idle_seconds)
+        if feed.viewers == 0:
+            feed._linger = None
+            self._discard(feed)
+            await feed.close()
+
+    def _discard(self, feed: RunFeed) -> None:
+        if self._feeds.get(feed.agent_run_id) is feed:
+            del self._feeds[feed.agent_run_id]
+
+    def stats(self) -> Dict[str, int]:
+        feeds = list(self._feeds.values())
+        return {
+            'feeds': len(feeds),
+            'viewers': sum(feed.viewers for feed in feeds),
+            'redis_reads': sum(feed.redis_reads for feed in feeds),
+        }
+
+
+stream_hub = RunStreamHub()
@@ -41,7 +41,7 @@ class WorkflowTool(AgentBuilderBaseTool):
             
             tool_mapping = {
                 'sb_shell_tool': ['execute_command'],
-                'sb_files_tool': ['create_file', 'edit_file', 'str_replace', 'full_file_rewrite', 'delete_file'],
+                'sb_files_tool': ['create_file', 'edit_file', 'str_replace', 'full_file_rewrite', 'delete_file', 'create_files', 'rewrite_files', 'delete_files'],
                 'sb_browser_tool': ['browser_navigate_to', 'browser_take_screenshot'],
                 'sb_vision_tool': ['see_image'],
                 'sb_deploy_tool': ['deploy'],
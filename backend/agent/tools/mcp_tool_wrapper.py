@@ -1,7 +1,9 @@
+import asyncio
 from typing import Any, Dict, List, Optional
 from agentpress.tool import Tool, ToolResult, ToolSchema, SchemaType
 from mcp_module import mcp_service
 from utils.logger import logger
+from utils.config import config
 import inspect
 from agent.tools.utils.mcp_connection_manager import MCPConnectionManager
 from agent.tools.utils.custom_mcp_handler import CustomMCPHandler
@@ -35,20 +37,39 @@ class MCPToolWrapper(Tool):
         standard_configs = [cfg for cfg in self.mcp_configs if not cfg.get('isCustom', False)]
         custom_configs = [cfg for cfg in self.mcp_configs if cfg.get('isCustom', False)]
         
+        # All servers connect concurrently under one budget; slow ones are dropped
+        # instead of each adding its own timeout to the agent's start-up time
+        tasks = []
         if standard_configs:
-            await self._initialize_standard_servers(standard_configs)
+            tasks.append(asyncio.create_task(self._initialize_standard_servers(standard_configs)))
         
         if custom_configs:
-            await self.custom_handler.initialize_custom_mcps(custom_configs)
+            tasks.append(asyncio.create_task(self.custom_handler.initialize_custom_mcps(custom_configs)))
+        
+        if not tasks:
+            return
+        
+        budget = config.MCP_DISCOVERY_TIMEOUT_SECONDS
+        _, pending = await asyncio.wait(tasks, timeout=budget)
+        if pending:
+            logger.warning(f"MCP discovery exceeded its {budget}s budget; continuing without the servers that had not answered")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
             
     async def _initialize_standard_servers(self, standard_configs: List[Dict[str, Any]]):
-        for config in standard_configs:
-            try:
-                logger.info(f"Attempting to connect to MCP server: {config['qualifiedName']}")
-                await self.mcp_manager.connect_server(config)
-                logger.info(f"Successfully connected to MCP server: {config['qualifiedName']}")
-            except Exception as e:
-                logger.error(f"Failed to connect to MCP server {config['qualifiedName']}: {e}")
+        await asyncio.gather(*[self._initialize_standard_server(cfg) for cfg in standard_configs])
+    
+    async def _initialize_standard_server(self, mcp_config: Dict[str, Any]):
+        try:
+            logger.info(f"Attempting to connect to MCP server: {mcp_config['qualifiedName']}")
+            await self.mcp_manager.connect_server(mcp_config)
+            logger.info(f"Successfully connected to MCP server: {mcp_config['qualifiedName']}")
+        except asyncio.CancelledError:
+            logger.warning(f"Gave up connecting to MCP server {mcp_config['qualifiedName']}: discovery budget exceeded")
+            raise
+        except Exception as e:
+            logger.error(f"Failed to connect to MCP server {mcp_config['qualifiedName']}: {e}")
     
     async def _create_dynamic_tools(self):
         try:
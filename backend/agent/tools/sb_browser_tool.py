@@ -8,7 +8,8 @@ from agentpress.tool import ToolResult, openapi_schema, usage_example
 from agentpress.thread_manager import ThreadManager
 from sandbox.tool_base import SandboxToolsBase
 from utils.logger import logger
-from utils.s3_upload_utils import upload_base64_image
+from utils.s3_upload_utils import upload_base64_image, upload_image_bytes
+from sandbox.browser_channel import browser_channel, BrowserChannelUnavailable, ScreenshotValidationError
 
 
 class SandboxBrowserTool(SandboxToolsBase):
@@ -17,6 +18,7 @@ class SandboxBrowserTool(SandboxToolsBase):
     def __init__(self, project_id: str, thread_id: str, thread_manager: ThreadManager):
         super().__init__(project_id, thread_manager)
         self.thread_id = thread_id
+        self._screenshot_urls = {}  # screenshot hash -> uploaded image URL
 
     def _validate_base64_image(self, base64_string: str, max_size_mb: int = 10) -> tuple[bool, str]:
         """
@@ -103,6 +105,81 @@ class SandboxBrowserTool(SandboxToolsBase):
             logger.error(f"Unexpected error during base64 image validation: {e}")
             return False, f"Validation error: {str(e)}"
 
+    def _summarize_elements_diff(self, diff: dict) -> dict | None:
+        """Compact description of elements added, removed or changed by an action (None after a full reload)"""
+        if not diff or diff.get("full"):
+            return None
+
+        def describe(element: dict) -> str:
+            text = (element.get("text") or "").strip().replace("\n", " ")
+            return f"[{element.get('index')}]<{element.get('tag_name')}> {text[:60]}".rstrip()
+
+        summary = {
+            kind: [describe(element) for element in diff.get(kind) or []]
+            for kind in ("added", "removed", "changed")
+            if diff.get(kind)
+        }
+        return summary or None
+
+    async def _request_via_exec(self, endpoint: str, params: dict = None, method: str = "POST") -> dict:
+        """Call the browser API with curl inside the sandbox (fallback when the preview link is unreachable)"""
+        url = f"http://localhost:8003/api/automation/{endpoint}"
+        
+        if method == "GET" and params:
+            query_params = "&".join([f"{k}={v}" for k, v in params.items()])
+            url = f"{url}?{query_params}"
+            curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
+        else:
+            curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
+            if params:
+                json_data = json.dumps(params)
+                curl_cmd += f" -d '{json_data}'"
+        
+        logger.debug("\033[95mExecuting curl command:\033[0m")
+        logger.debug(f"{curl_cmd}")
+        
+        response = await self.sandbox.process.exec(curl_cmd, timeout=30)
+        if response.exit_code != 0:
+            raise RuntimeError(f"Browser automation request failed: {response}")
+        try:
+            return json.loads(response.result)
+        except json.JSONDecodeError as e:
+            raise RuntimeError(f"Failed to parse response JSON: {response.result} {e}")
+
+    async def _upload_screenshot(self, result: dict) -> None:
+        """Replace the screenshot in a browser API result with an uploaded image URL"""
+        screenshot_data = result.pop("screenshot_base64", None)
+        screenshot_hash = result.get("screenshot_hash")
+        try:
+            if screenshot_data:
+                # Inline screenshot (exec fallback): validate the base64 data before uploading
+                is_valid, validation_message = self._validate_base64_image(screenshot_data)
+                if not is_valid:
+                    logger.warning(f"Screenshot validation failed: {validation_message}")
+                    result["image_validation_error"] = validation_message
+                    return
+                logger.debug(f"Screenshot validation passed: {validation_message}")
+                image_url = await upload_base64_image(screenshot_data)
+            elif screenshot_hash:
+                # Unchanged pages report the same screenshot again; upload it once
+                image_url = self._screenshot_urls.get(screenshot_hash)
+                if image_url is None:
+                    image_bytes = await browser_channel.fetch_screenshot(self.sandbox, screenshot_hash)
+                    image_url = await upload_image_bytes(image_bytes, "image/jpeg")
+                    if len(self._screenshot_urls) >= 64:
+                        self._screenshot_urls.clear()
+                    self._screenshot_urls[screenshot_hash] = image_url
+            else:
+                return
+            result["image_url"] = image_url
+            logger.debug(f"Uploaded screenshot to {image_url}")
+        except ScreenshotValidationError as e:
+            logger.warning(f"Screenshot validation failed: {e}")
+            result["image_validation_error"] = str(e)
+        except Exception as e:
+            logger.error(f"Failed to process screenshot: {e}")
+            result["image_upload_error"] = str(e)
+
     async def _execute_browser_action(self, endpoint: str, params: dict = None, method: str = "POST") -> ToolResult:
         """Execute a browser automation action through the API
         
@@ -118,100 +195,61 @@ class SandboxBrowserTool(SandboxToolsBase):
             # Ensure sandbox is initialized
             await self._ensure_sandbox()
             
-            # Build the curl command
-            url = f"http://localhost:8003/api/automation/{endpoint}"
-            
-            if method == "GET" and params:
-                query_params = "&".join([f"{k}={v}" for k, v in params.items()])
-                url = f"{url}?{query_params}"
-                curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
-            else:
-                curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
-                if params:
-                    json_data = json.dumps(params)
-                    curl_cmd += f" -d '{json_data}'"
-            
-            logger.debug("\033[95mExecuting curl command:\033[0m")
-            logger.debug(f"{curl_cmd}")
+            # Direct HTTP through the preview link; screenshots come back as raw bytes
+            try:
+                result = await browser_channel.call(self.sandbox, endpoint, params, method)
+            except BrowserChannelUnavailable as e:
+                logger.warning(f"Direct browser API call failed, falling back to exec: {e}")
+                result = await self._request_via_exec(endpoint, params, method)
             
-            response = await self.sandbox.process.exec(curl_cmd, timeout=30)
+            if not "content" in result:
+                result["content"] = ""
             
-            if response.exit_code == 0:
-                try:
-                    result = json.loads(response.result)
+            if not "role" in result:
+                result["role"] = "assistant"
 
-                    if not "content" in result:
-                        result["content"] = ""
-                    
-                    if not "role" in result:
-                        result["role"] = "assistant"
-
-                    logger.info("Browser automation request completed successfully")
-
-                    if "screenshot_base64" in result:
-                        try:
-                            # Comprehensive validation of the base64 image data
-                            screenshot_data = result["screenshot_base64"]
-                            is_valid, validation_message = self._validate_base64_image(screenshot_data)
-                            
-                            if is_valid:
-                                logger.debug(f"Screenshot validation passed: {validation_message}")
-                                image_url = await upload_base64_image(screenshot_data)
-                                result["image_url"] = image_url
-                                logger.debug(f"Uploaded screenshot to {image_url}")
-                            else:
-                                logger.warning(f"Screenshot validation failed: {validation_message}")
-                                result["image_validation_error"] = validation_message
-                                
-                            # Remove base64 data from result to keep it clean
-                            del result["screenshot_base64"]
-                            
-                        except Exception as e:
-                            logger.error(f"Failed to process screenshot: {e}")
-                            result["image_upload_error"] = str(e)
-
-                    added_message = await self.thread_manager.add_message(
-                        thread_id=self.thread_id,
-                        type="browser_state",
-                        content=result,
-                        is_llm_message=False
-                    )
-
-                    success_response = {}
-
-                    if result.get("success"):
-                        success_response["success"] = result["success"]
-                        success_response["message"] = result.get("message", "Browser action completed successfully")
-                    else:
-                        success_response["success"] = False
-                        success_response["message"] = result.get("message", "Browser action failed")
-
-                    if added_message and 'message_id' in added_message:
-                        success_response['message_id'] = added_message['message_id']
-                    if result.get("url"):
-                        success_response["url"] = result["url"]
-                    if result.get("title"):
-                        success_response["title"] = result["title"]
-                    if result.get("element_count"):
-                        success_response["elements_found"] = result["element_count"]
-                    if result.get("pixels_below"):
-                        success_response["scrollable_content"] = result["pixels_below"] > 0
-                    if result.get("ocr_text"):
-                        success_response["ocr_text"] = result["ocr_text"]
-                    if result.get("image_url"):
-                        success_response["image_url"] = result["image_url"]
-
-                    if success_response.get("success"):
-                        return self.success_response(success_response)
-                    else:
-                        return self.fail_response(success_response)
-
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to parse response JSON: {response.result} {e}")
-                    return self.fail_response(f"Failed to parse response JSON: {response.result} {e}")
+            logger.info("Browser automation request completed successfully")
+
+            await self._upload_screenshot(result)
+
+            added_message = await self.thread_manager.add_message(
+                thread_id=self.thread_id,
+                type="browser_state",
+                content=result,
+                is_llm_message=False
+            )
+
+            success_response = {}
+
+            if result.get("success"):
+                success_response["success"] = result["success"]
+                success_response["message"] = result.get("message", "Browser action completed successfully")
+            else:
+                success_response["success"] = False
+                success_response["message"] = result.get("message", "Browser action failed")
+
+            if added_message and 'message_id' in added_message:
+                success_response['message_id'] = added_message['message_id']
+            if result.get("url"):
+                success_response["url"] = result["url"]
+            if result.get("title"):
+                success_response["title"] = result["title"]
+            if result.get("element_count"):
+                success_response["elements_found"] = result["element_count"]
+            if result.get("pixels_below"):
+                success_response["scrollable_content"] = result["pixels_below"] > 0
+            if result.get("ocr_text"):
+                success_response["ocr_text"] = result["ocr_text"]
+            elements_changed = self._summarize_elements_diff(result.get("elements_diff"))
+            if elements_changed:
+                success_response["elements_changed"] = elements_changed
+            if result.get("image_url"):
+                success_response["image_url"] = result["image_url"]
+
+            if success_response.get("success"):
+                return self.success_response(success_response)
             else:
-                logger.error(f"Browser automation request failed 2: {response}")
-                return self.fail_response(f"Browser automation request failed 2: {response}")
+                return self.fail_response(success_response)
 
         except Exception as e:
             logger.error(f"Error executing browser action: {e}")
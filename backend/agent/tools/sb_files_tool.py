@@ -2,13 +2,19 @@ from agentpress.tool import ToolResult, openapi_schema, usage_example
 from sandbox.tool_base import SandboxToolsBase
 from utils.files_utils import should_exclude_file, clean_path
 from agentpress.thread_manager import ThreadManager
+from sandbox import batch_fs
+from sandbox.file_cache import SandboxFileCache
 from utils.logger import logger
 from utils.config import config
 import os
 import json
 import litellm
 import asyncio
-from typing import Optional
+from typing import Any, Dict, List, Optional
+
+# get_workspace_state skips larger files and stops once this much has been read
+WORKSPACE_STATE_MAX_FILE_BYTES = 256 * 1024
+WORKSPACE_STATE_MAX_TOTAL_BYTES = 4 * 1024 * 1024
 
 class SandboxFilesTool(SandboxToolsBase):
     """Tool for executing file system operations in a Daytona sandbox. All operations are performed relative to the /workspace directory."""
@@ -17,6 +23,7 @@ class SandboxFilesTool(SandboxToolsBase):
         super().__init__(project_id, thread_manager)
         self.SNIPPET_LINES = 4  # Number of context lines to show around edits
         self.workspace_path = "/workspace"  # Ensure we're always operating in /workspace
+        self._file_cache = SandboxFileCache()  # Per-run file contents, validated by hash before use
 
     def clean_path(self, path: str) -> str:
         """Clean and normalize a path to be relative to /workspace"""
@@ -34,6 +41,19 @@ class SandboxFilesTool(SandboxToolsBase):
         except Exception:
             return False
 
+    async def _index_html_note(self) -> str:
+        """Preview server hint appended when index.html is written at the workspace root"""
+        try:
+            website_link = await self.sandbox.get_preview_link(8080)
+            website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
+            return (
+                f"\n\n[Auto-detected index.html - HTTP server available at: {website_url}]"
+                "\n[Note: Use the provided HTTP server URL above instead of starting a new server]"
+            )
+        except Exception as e:
+            logger.warning(f"Failed to get website URL for index.html: {str(e)}")
+            return ""
+
     async def get_workspace_state(self) -> dict:
         """Get the current workspace state by reading all files"""
         files_state = {}
@@ -42,24 +62,35 @@ class SandboxFilesTool(SandboxToolsBase):
             await self._ensure_sandbox()
             
             files = await self.sandbox.fs.list_files(self.workspace_path)
+            selected = {}
+            total_bytes = 0
             for file_info in files:
                 rel_path = file_info.name
                 
                 # Skip excluded files and directories
                 if self._should_exclude_file(rel_path) or file_info.is_dir:
                     continue
-
+                
+                if file_info.size > WORKSPACE_STATE_MAX_FILE_BYTES:
+                    logger.debug(f"Skipping large file in workspace state: {rel_path} ({file_info.size} bytes)")
+                    continue
+                if total_bytes + file_info.size > WORKSPACE_STATE_MAX_TOTAL_BYTES:
+                    logger.warning(f"Workspace state truncated at {total_bytes} bytes")
+                    break
+                total_bytes += file_info.size
+                selected[f"{self.workspace_path}/{rel_path}"] = (rel_path, file_info)
+            
+            # Download the selected files concurrently instead of one by one
+            contents = await batch_fs.download_files(self.sandbox, selected.keys())
+            for full_path, data in contents.items():
+                rel_path, file_info = selected[full_path]
                 try:
-                    full_path = f"{self.workspace_path}/{rel_path}"
-                    content = (await self.sandbox.fs.download_file(full_path)).decode()
                     files_state[rel_path] = {
-                        "content": content,
+                        "content": data.decode(),
                         "is_dir": file_info.is_dir,
                         "size": file_info.size,
                         "modified": file_info.mod_time
                     }
-                except Exception as e:
-                    print(f"Error reading file {rel_path}: {e}")
                 except UnicodeDecodeError:
                     print(f"Skipping binary file: {rel_path}")
 
@@ -138,19 +169,14 @@ class SandboxFilesTool(SandboxToolsBase):
             
             # Write the file content
             await self.sandbox.fs.upload_file(file_contents.encode(), full_path)
+            self._file_cache.remember(full_path, file_contents.encode())
             await self.sandbox.fs.set_file_permissions(full_path, permissions)
             
             message = f"File '{file_path}' created successfully."
             
             # Check if index.html was created and add 8080 server info (only in root workspace)
             if file_path.lower() == 'index.html':
-                try:
-                    website_link = await self.sandbox.get_preview_link(8080)
-                    website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
-                    message += f"\n\n[Auto-detected index.html - HTTP server available at: {website_url}]"
-                    message += "\n[Note: Use the provided HTTP server URL above instead of starting a new server]"
-                except Exception as e:
-                    logger.warning(f"Failed to get website URL for index.html: {str(e)}")
+                message += await self._index_html_note()
             
             return self.success_response(message)
         except Exception as e:
@@ -197,10 +223,11 @@ class SandboxFilesTool(SandboxToolsBase):
             
             file_path = self.clean_path(file_path)
             full_path = f"{self.workspace_path}/{file_path}"
-            if not await self._file_exists(full_path):
+            cached = await self._file_cache.read(self.sandbox, full_path)
+            if cached is None:
                 return self.fail_response(f"File '{file_path}' does not exist")
             
-            content = (await self.sandbox.fs.download_file(full_path)).decode()
+            content = cached.decode()
             old_str = old_str.expandtabs()
             new_str = new_str.expandtabs()
             
@@ -213,7 +240,7 @@ class SandboxFilesTool(SandboxToolsBase):
             
             # Perform replacement
             new_content = content.replace(old_str, new_str)
-            await self.sandbox.fs.upload_file(new_content.encode(), full_path)
+            await self._file_cache.write(self.sandbox, full_path, new_content.encode())
             
             # Show snippet around the edit
             replacement_line = content.split(old_str)[0].count('\n')
@@ -282,19 +309,14 @@ class SandboxFilesTool(SandboxToolsBase):
                 return self.fail_response(f"File '{file_path}' does not exist. Use create_file to create a new file.")
             
             await self.sandbox.fs.upload_file(file_contents.encode(), full_path)
+            self._file_cache.remember(full_path, file_contents.encode())
             await self.sandbox.fs.set_file_permissions(full_path, permissions)
             
             message = f"File '{file_path}' completely rewritten successfully."
             
             # Check if index.html was rewritten and add 8080 server info (only in root workspace)
             if file_path.lower() == 'index.html':
-                try:
-                    website_link = await self.sandbox.get_preview_link(8080)
-                    website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
-                    message += f"\n\n[Auto-detected index.html - HTTP server available at: {website_url}]"
-                    message += "\n[Note: Use the provided HTTP server URL above instead of starting a new server]"
-                except Exception as e:
-                    logger.warning(f"Failed to get website URL for index.html: {str(e)}")
+                message += await self._index_html_note()
             
             return self.success_response(message)
         except Exception as e:
@@ -335,10 +357,221 @@ class SandboxFilesTool(SandboxToolsBase):
                 return self.fail_response(f"File '{file_path}' does not exist")
             
             await self.sandbox.fs.delete_file(full_path)
+            self._file_cache.invalidate(full_path)
             return self.success_response(f"File '{file_path}' deleted successfully.")
         except Exception as e:
             return self.fail_response(f"Error deleting file: {str(e)}")
 
+    def _batch_paths(self, files: List[Dict[str, Any]]) -> Dict[str, str]:
+        """Map cleaned relative paths to file contents for a batch request"""
+        batch = {}
+        for entry in files:
+            file_contents = entry.get("file_contents", "")
+            # convert to json string if file_contents is a dict
+            if isinstance(file_contents, dict):
+                file_contents = json.dumps(file_contents, indent=4)
+            batch[self.clean_path(entry["file_path"])] = file_contents
+        return batch
+
+    @openapi_schema({
+        "type": "function",
+        "function": {
+            "name": "create_files",
+            "description": "Create several new files in one step. Much faster than calling create_file repeatedly when scaffolding a project. Paths must be relative to /workspace. Fails without writing anything if any of the files already exists.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "files": {
+                        "type": "array",
+                        "description": "Files to create",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "file_path": {
+                                    "type": "string",
+                                    "description": "Path to the file, relative to /workspace (e.g., 'src/main.py')"
+                                },
+                                "file_contents": {
+                                    "type": "string",
+                                    "description": "The content to write to the file"
+                                }
+                            },
+                            "required": ["file_path", "file_contents"]
+                        }
+                    },
+                    "permissions": {
+                        "type": "string",
+                        "description": "File permissions in octal format applied to every file (e.g., '644')",
+                        "default": "644"
+                    }
+                },
+                "required": ["files"]
+            }
+        }
+    })
+    @usage_example('''
+        <function_calls>
+        <invoke name="create_files">
+        <parameter name="files">[
+            {"file_path": "index.html", "file_contents": "<!DOCTYPE html><html><head><link rel='stylesheet' href='css/style.css'></head><body><script src='js/app.js'></script></body></html>"},
+            {"file_path": "css/style.css", "file_contents": "body { margin: 0; }"},
+            {"file_path": "js/app.js", "file_contents": "console.log('ready');"}
+        ]</parameter>
+        </invoke>
+        </function_calls>
+        ''')
+    async def create_files(self, files: List[Dict[str, Any]], permissions: str = "644") -> ToolResult:
+        try:
+            # Ensure sandbox is initialized
+            await self._ensure_sandbox()
+            
+            if not files:
+                return self.fail_response("No files provided.")
+            batch = self._batch_paths(files)
+            
+            # One stat for the whole batch instead of one existence check per file
+            stats = await batch_fs.stat_files(self.sandbox, [f"{self.workspace_path}/{path}" for path in batch])
+            existing = [path for path in batch if stats.get(f"{self.workspace_path}/{path}")]
+            if existing:
+                return self.fail_response(f"Files already exist: {', '.join(existing)}. Use full_file_rewrite or rewrite_files to modify existing files.")
+            
+            await batch_fs.write_files(
+                self.sandbox,
+                {f"{self.workspace_path}/{path}": contents for path, contents in batch.items()},
+                permissions
+            )
+            
+            message = f"Created {len(batch)} files: {', '.join(batch)}."
+            if any(path.lower() == 'index.html' for path in batch):
+                message += await self._index_html_note()
+            return self.success_response(message)
+        except Exception as e:
+            return self.fail_response(f"Error creating files: {str(e)}")
+
+    @openapi_schema({
+        "type": "function",
+        "function": {
+            "name": "rewrite_files",
+            "description": "Completely rewrite several existing files in one step. Paths must be relative to /workspace. Fails without writing anything if any of the files does not exist. Prefer edit_file for small changes.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "files": {
+                        "type": "array",
+                        "description": "Files to rewrite",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "file_path": {
+                                    "type": "string",
+                                    "description": "Path to the file, relative to /workspace (e.g., 'src/main.py')"
+                                },
+                                "file_contents": {
+                                    "type": "string",
+                                    "description": "The new content of the file, replacing all existing content"
+                                }
+                            },
+                            "required": ["file_path", "file_contents"]
+                        }
+                    },
+                    "permissions": {
+                        "type": "string",
+                        "description": "File permissions in octal format applied to every file (e.g., '644')",
+                        "default": "644"
+                    }
+                },
+                "required": ["files"]
+            }
+        }
+    })
+    @usage_example('''
+        <function_calls>
+        <invoke name="rewrite_files">
+        <parameter name="files">[
+            {"file_path": "css/style.css", "file_contents": "body { margin: 0; font-family: sans-serif; }"},
+            {"file_path": "js/app.js", "file_contents": "document.body.classList.add('loaded');"}
+        ]</parameter>
+        </invoke>
+        </function_calls>
+        ''')
+    async def rewrite_files(self, files: List[Dict[str, Any]], permissions: str = "644") -> ToolResult:
+        try:
+            # Ensure sandbox is initialized
+            await self._ensure_sandbox()
+            
+            if not files:
+                return self.fail_response("No files provided.")
+            batch = self._batch_paths(files)
+            
+            stats = await batch_fs.stat_files(self.sandbox, [f"{self.workspace_path}/{path}" for path in batch])
+            missing = [path for path in batch if not stats.get(f"{self.workspace_path}/{path}")]
+            if missing:
+                return self.fail_response(f"Files do not exist: {', '.join(missing)}. Use create_files to create new files.")
+            
+            await batch_fs.write_files(
+                self.sandbox,
+                {f"{self.workspace_path}/{path}": contents for path, contents in batch.items()},
+                permissions
+            )
+            for path in batch:
+                self._file_cache.invalidate(f"{self.workspace_path}/{path}")
+            
+            message = f"Rewrote {len(batch)} files: {', '.join(batch)}."
+            if any(path.lower() == 'index.html' for path in batch):
+                message += await self._index_html_note()
+            return self.success_response(message)
+        except Exception as e:
+            return self.fail_response(f"Error rewriting files: {str(e)}")
+
+    @openapi_schema({
+        "type": "function",
+        "function": {
+            "name": "delete_files",
+            "description": "Delete several files in one step. Paths must be relative to /workspace.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "file_paths": {
+                        "type": "array",
+                        "description": "Paths of the files to delete, relative to /workspace",
+                        "items": {"type": "string"}
+                    }
+                },
+                "required": ["file_paths"]
+            }
+        }
+    })
+    @usage_example('''
+        <function_calls>
+        <invoke name="delete_files">
+        <parameter name="file_paths">["tmp/notes.txt", "tmp/draft.md"]</parameter>
+        </invoke>
+        </function_calls>
+        ''')
+    async def delete_files(self, file_paths: List[str]) -> ToolResult:
+        try:
+            # Ensure sandbox is initialized
+            await self._ensure_sandbox()
+            
+            if not file_paths:
+                return self.fail_response("No files provided.")
+            paths = [self.clean_path(path) for path in file_paths]
+            
+            stats = await batch_fs.stat_files(self.sandbox, [f"{self.workspace_path}/{path}" for path in paths])
+            missing = [path for path in paths if not stats.get(f"{self.workspace_path}/{path}")]
+            existing = [path for path in paths if path not in missing]
+            
+            await batch_fs.delete_files(self.sandbox, [f"{self.workspace_path}/{path}" for path in existing])
+            for path in existing:
+                self._file_cache.invalidate(f"{self.workspace_path}/{path}")
+            
+            message = f"Deleted {len(existing)} files."
+            if missing:
+                message += f" Not found: {', '.join(missing)}."
+            return self.success_response(message)
+        except Exception as e:
+            return self.fail_response(f"Error deleting files: {str(e)}")
+
     async def _call_ai_edit_api(self, file_content: str, code_edit: str, instructions: str, file_path: str) -> tuple[Optional[str], Optional[str]]:
         """
         Call OpenRouter API to apply edits to file content using free models.
@@ -489,17 +722,18 @@ def authenticate_user(username, password):
         ''')
     async def edit_file(self, target_file: str, instructions: str, code_edit: str) -> ToolResult:
         """Edit a file using AI-powered intelligent editing with fallback to string replacement"""
+        original_content = None
         try:
             # Ensure sandbox is initialized
             await self._ensure_sandbox()
             
             target_file = self.clean_path(target_file)
             full_path = f"{self.workspace_path}/{target_file}"
-            if not await self._file_exists(full_path):
+            # Read current content (served from the cache when the file is unchanged)
+            cached = await self._file_cache.read(self.sandbox, full_path)
+            if cached is None:
                 return self.fail_response(f"File '{target_file}' does not exist")
-            
-            # Read current content
-            original_content = (await self.sandbox.fs.download_file(full_path)).decode()
+            original_content = cached.decode()
             
             # Try AI editing first
             logger.info(f"Attempting AI-powered edit for file '{target_file}' with instructions: {instructions[:100]}...")
@@ -530,7 +764,7 @@ def authenticate_user(username, password):
                 }))
 
             # AI editing successful
-            await self.sandbox.fs.upload_file(new_content.encode(), full_path)
+            await self._file_cache.write(self.sandbox, full_path, new_content.encode())
             
             # Return rich data for frontend diff view
             return ToolResult(success=True, output=json.dumps({
@@ -542,14 +776,16 @@ def authenticate_user(username, password):
                     
         except Exception as e:
             logger.error(f"Unhandled error in edit_file: {str(e)}", exc_info=True)
-            # Try to get original_content if possible
-            original_content_on_error = None
-            try:
-                full_path_on_error = f"{self.workspace_path}/{self.clean_path(target_file)}"
-                if await self._file_exists(full_path_on_error):
-                    original_content_on_error = (await self.sandbox.fs.download_file(full_path_on_error)).decode()
-            except:
-                pass
+            # Try to get original_content if possible; it was usually read before the error
+            original_content_on_error = original_content
+            if original_content_on_error is None:
+                try:
+                    full_path_on_error = f"{self.workspace_path}/{self.clean_path(target_file)}"
+                    cached = await self._file_cache.read(self.sandbox, full_path_on_error)
+                    if cached is not None:
+                        original_content_on_error = cached.decode()
+                except:
+                    pass
             
             return ToolResult(success=False, output=json.dumps({
                 "message": f"Error editing file: {str(e)}",
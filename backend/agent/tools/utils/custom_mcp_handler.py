@@ -1,10 +1,8 @@
 import json
 import asyncio
 from typing import Dict, Any, List
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.sse import sse_client
-from mcp.client.stdio import stdio_client
-from mcp.client.streamable_http import streamablehttp_client
+from mcp_module.session_pool import MCPServerSpec
+from mcp_module.tool_cache import mcp_tool_cache
 from utils.logger import logger
 from .mcp_connection_manager import MCPConnectionManager
 
@@ -15,15 +13,18 @@ class CustomMCPHandler:
         self.custom_tools: Dict[str, Dict[str, Any]] = {}
     
     async def initialize_custom_mcps(self, custom_configs: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
-        for config in custom_configs:
-            try:
-                await self._initialize_single_custom_mcp(config)
-            except Exception as e:
-                logger.error(f"Failed to initialize custom MCP {config.get('name', 'Unknown')}: {e}")
-                continue
-        
+        await asyncio.gather(*[self._initialize_custom_mcp_safely(config) for config in custom_configs])
         return self.custom_tools
     
+    async def _initialize_custom_mcp_safely(self, config: Dict[str, Any]):
+        try:
+            await self._initialize_single_custom_mcp(config)
+        except asyncio.CancelledError:
+            logger.warning(f"Gave up initializing custom MCP {config.get('name', 'Unknown')}: discovery budget exceeded")
+            raise
+        except Exception as e:
+            logger.error(f"Failed to initialize custom MCP {config.get('name', 'Unknown')}: {e}")
+    
     async def _initialize_single_custom_mcp(self, config: Dict[str, Any]):
         custom_type = config.get('customType', 'sse')
         server_config = config.get('config', {})
@@ -62,8 +63,6 @@ class CustomMCPHandler:
         try:
             import os
             from pipedream import connection_service
-            from mcp import ClientSession
-            from mcp.client.streamable_http import streamablehttp_client
             
             access_token = await connection_service._ensure_access_token()
             
@@ -86,13 +85,12 @@ class CustomMCPHandler:
 
             url = "https://remote.mcp.pipedream.net"
             
-            async with streamablehttp_client(url, headers=headers) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    await session.initialize()
-                    tools_result = await session.list_tools()
-                    tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
-                    
-                    self._register_custom_tools(tools, server_name, enabled_tools, 'pipedream', server_config)
+            # The access token rotates, so it is left out of the tool-list cache key
+            tools = await mcp_tool_cache.list_tools(
+                MCPServerSpec.http(url, headers),
+                ignore_headers=("Authorization", "x-pd-rate-limit")
+            )
+            self._register_custom_tools(tools, server_name, enabled_tools, 'pipedream', server_config)
                     
         except Exception as e:
             logger.error(f"Pipedream MCP {server_name}: Connection failed - {str(e)}")
@@ -0,0 +1,160 @@
+"""
+Tmux command execution for SandboxShellTool.
+
+Every round trip to the sandbox goes through the Daytona process API, so the
+runner does as much as possible in one shell script per round trip:
+
+- Each tmux session's pane is piped to ``/tmp/helium_shell/<session>.log``, so
+  output can be read from a byte offset instead of capturing the whole
+  scrollback every time.
+- Each command writes its exit code to ``<session>.<command id>.exit`` when it
+  finishes. Waiting for a blocking command happens inside the sandbox (the
+  script sleeps until the sentinel file appears), so a short command is sent,
+  awaited and read in a single round trip, and a long one costs one round trip
+  per wait slice plus only the output produced since the last read.
+- The pane reaches the log asynchronously through ``pipe-pane``, while the
+  sentinel is written by the shell directly, so once the sentinel exists the
+  script waits for the log to stop growing before reading it.
+"""
+
+import re
+import shlex
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+from uuid import uuid4
+
+SHELL_STATE_DIR = "/tmp/helium_shell"
+# Daytona raw commands time out at 30s; leave room for the read part of the script
+WAIT_SLICE_SECONDS = 25
+WAIT_POLL_SECONDS = 0.1
+# Upper bound on waiting for the pane pipe to flush a finished command's output into the log
+FLUSH_POLLS = 20
+_HEADER = "__HELIUM_SHELL__"
+
+_ANSI_ESCAPE = re.compile(r'\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]')
+_HEADER_LINE = re.compile(_HEADER + r' (\S*) (\d+) (\d)\n?')
+
+
+@dataclass
+class CommandStatus:
+    """State of a session after one round trip."""
+    output: str
+    exit_code: Optional[int]
+    session_alive: bool
+
+    @property
+    def completed(self) -> bool:
+        return self.exit_code is not None or not self.session_alive
+
+
+def clean_terminal_output(raw: str) -> str:
+    """Turn raw pane output into plain text: drop escape sequences and overwritten line content."""
+    text = _ANSI_ESCAPE.sub('', raw)
+    lines = []
+    for line in text.split('\n'):
+        line = line.rstrip('\r')
+        # A bare carriage return redraws the line (progress bars); keep what was drawn last
+        if '\r' in line:
+            line = line.rsplit('\r', 1)[-1]
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+class TmuxCommandRunner:
+    """Runs commands in tmux sessions and reads their output incrementally.
+
+    Args:
+        execute: Runs a shell command in the sandbox and returns ``{"output", "exit_code"}``;
+            accepts a ``timeout`` keyword in seconds
+    """
+
+    def __init__(self, execute: Callable[..., Awaitable[Dict]]):
+        self._execute = execute
+        self._offsets: Dict[str, int] = {}
+        self._commands: Dict[str, str] = {}
+
+    def _log_path(self, session_name: str) -> str:
+        return f"{SHELL_STATE_DIR}/{session_name}.log"
+
+    def _exit_path(self, session_name: str, command_id: Optional[str]) -> str:
+        return f"{SHELL_STATE_DIR}/{session_name}.{command_id or 'none'}.exit"
+
+    def _start_script(self, session_name: str, command: str, cwd: str, command_id: str) -> str:
+        session = shlex.quote(session_name)
+        log = shlex.quote(self._log_path(session_name))
+        exit_path = self._exit_path(session_name, command_id)
+        # Typed into the session's shell, so the user's command keeps its own quoting and variables.
+        # The command ends its own line inside a group, so a trailing "&" or "# comment" cannot
+        # swallow the sentinel; the shell parses the whole group before running any of it.
+        first_line = f"cd {shlex.quote(cwd)} && {{ {command}"
+        last_line = f"}} ; echo $? > {shlex.quote(exit_path)}"
+        return (
+            f"mkdir -p {SHELL_STATE_DIR} && "
+            f"{{ tmux has-session -t {session} 2>/dev/null || tmux new-session -d -s {session}; }} && "
+            f"tmux pipe-pane -o -t {session} {shlex.quote('cat >> ' + log)} && "
+            f"tmux send-keys -t {session} -l {shlex.quote(first_line)} && "
+            f"tmux send-keys -t {session} Enter && "
+            f"tmux send-keys -t {session} -l {shlex.quote(last_line)} && "
+            f"tmux send-keys -t {session} Enter"
+        )
+
+    def _read_script(self, session_name: str, wait_seconds: float = 0) -> str:
+        session = shlex.quote(session_name)
+        log = shlex.quote(self._log_path(session_name))
+        exit_path = shlex.quote(self._exit_path(session_name, self._commands.get(session_name)))
+        offset = self._offsets.get(session_name, 0)
+        parts = []
+        if wait_seconds > 0:
+            polls = max(1, int(wait_seconds / WAIT_POLL_SECONDS))
+            parts.append(
+                f"i=0; while [ ! -f {exit_path} ] && [ $i -lt {polls} ] && tmux has-session -t {session} 2>/dev/null; "
+                f"do sleep {WAIT_POLL_SECONDS}; i=$((i+1)); done"
+            )
+        parts.append(
+            f"if tmux has-session -t {session} 2>/dev/null; then alive=1; else alive=0; fi; "
+            f"size=$(stat -c %s {log} 2>/dev/null || echo 0); "
+            f"if [ -f {exit_path} ]; then prev=-1; j=0; while [ \"$size\" != \"$prev\" ] && [ $j -lt {FLUSH_POLLS} ]; "
+            f"do prev=$size; sleep {WAIT_POLL_SECONDS}; size=$(stat -c %s {log} 2>/dev/null || echo 0); j=$((j+1)); done; fi; "
+            f"echo \"{_HEADER} $(cat {exit_path} 2>/dev/null | tr -d '[:space:]') $size $alive\"; "
+            f"if [ $size -gt {offset} ]; then tail -c +{offset + 1} {log} | head -c $((size - {offset})); fi"
+        )
+        return "; ".join(parts)
+
+    def _parse(self, session_name: str, output: str) -> CommandStatus:
+        match = _HEADER_LINE.search(output or '')
+        if not match:
+            return CommandStatus(output=clean_terminal_output(output or ''), exit_code=None, session_alive=False)
+        exit_code, size, alive = match.groups()
+        self._offsets[session_name] = int(size)
+        new_output = output[match.end():]
+        return CommandStatus(
+            output=clean_terminal_output(new_output),
+            exit_code=int(exit_code) if exit_code.lstrip('-').isdigit() else None,
+            session_alive=alive == "1",
+        )
+
+    async def start(self, session_name: str, command: str, cwd: str, wait_seconds: float = 0) -> CommandStatus:
+        """Send a command to the session, optionally waiting up to ``wait_seconds`` in the same round trip."""
+        command_id = str(uuid4())[:8]
+        self._commands[session_name] = command_id
+        self._offsets.setdefault(session_name, 0)
+        wait = min(wait_seconds, WAIT_SLICE_SECONDS)
+        script = f"{self._start_script(session_name, command, cwd, command_id)} && {{ {self._read_script(session_name, wait)}; }}"
+        result = await self._execute(script, timeout=int(wait) + 30)
+        return self._parse(session_name, result.get("output", ""))
+
+    async def poll(self, session_name: str, wait_seconds: float = 0) -> CommandStatus:
+        """Read output produced since the last read, waiting up to ``wait_seconds`` for the command to finish."""
+        wait = min(wait_seconds, WAIT_SLICE_SECONDS)
+        result = await self._execute(self._read_script(session_name, wait), timeout=int(wait) + 30)
+        return self._parse(session_name, result.get("output", ""))
+
+    async def kill(self, session_name: str) -> None:
+        """Kill the session and remove its log and sentinel files."""
+        session = shlex.quote(session_name)
+        await self._execute(
+            f"tmux kill-session -t {session} 2>/dev/null; "
+            f"rm -f {shlex.quote(self._log_path(session_name))} {SHELL_STATE_DIR}/{session}.*.exit"
+        )
+        self._offsets.pop(session_name, None)
+        self._commands.pop(session_name, None)
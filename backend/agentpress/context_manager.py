@@ -5,15 +5,143 @@ This module handles token counting and thread summarization to prevent
 reaching the context window limitations of LLM models.
 """
 
+import asyncio
+import functools
+import hashlib
 import json
-from typing import List, Dict, Any, Optional, Union
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Union
 
 from litellm.utils import token_counter
 from services.supabase import DBConnection
+from utils.config import config
 from utils.logger import logger
 
 DEFAULT_TOKEN_THRESHOLD = 120000
 
+# Maximum number of per-message token counts kept in memory
+TOKEN_COUNT_CACHE_SIZE = 20000
+
+# Conservative characters-per-token ratio for estimates that must not run the tokenizer
+CHARS_PER_TOKEN_ESTIMATE = 3
+
+
+class TokenCountCache:
+    """LRU cache of per-message token counts.
+
+    Entries are keyed by model, message_id and a hash of the message body, so a
+    message that is truncated or otherwise rewritten gets counted again.
+    """
+
+    def __init__(self, max_entries: int = TOKEN_COUNT_CACHE_SIZE):
+        self._counts: "OrderedDict[Tuple[str, Optional[str], str], int]" = OrderedDict()
+        self._max_entries = max_entries
+        # Compression may run in the worker pool, so guard the LRU bookkeeping
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(msg: Dict[str, Any]) -> str:
+        """Hash everything token_counter looks at, i.e. the message minus its message_id."""
+        digest = hashlib.blake2b(digest_size=16)
+        content = msg.get('content')
+        if isinstance(content, str):
+            digest.update(content.encode('utf-8', 'surrogatepass'))
+        else:
+            digest.update(json.dumps(content, sort_keys=True, default=str).encode('utf-8'))
+        rest = {k: v for k, v in msg.items() if k not in ('content', 'message_id')}
+        digest.update(json.dumps(rest, sort_keys=True, default=str).encode('utf-8'))
+        return digest.hexdigest()
+
+    def count(self, msg: Dict[str, Any], llm_model: str) -> int:
+        """Return the token count for a single message, tokenizing it only on a miss."""
+        key = (llm_model, msg.get('message_id'), self.fingerprint(msg))
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached is not None:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        count = token_counter(model=llm_model, messages=[msg])
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self._max_entries:
+                self._counts.popitem(last=False)
+        return count
+
+
+# Shared across ContextManager instances so counts survive between runs of a thread
+token_count_cache = TokenCountCache()
+
+
+class CompressionCancelled(Exception):
+    """Raised inside the compression pipeline once its caller has given up on it."""
+
+
+class CompressionMetrics:
+    """Timing counters for context compression calls in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.timeouts = 0
+        self.cancellations = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = 0.0
+
+    def record(self, elapsed_ms: float, timed_out: bool = False, cancelled: bool = False) -> None:
+        with self._lock:
+            self.calls += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+            self.last_ms = elapsed_ms
+            if timed_out:
+                self.timeouts += 1
+            if cancelled:
+                self.cancellations += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "timeouts": self.timeouts,
+                "cancellations": self.cancellations,
+                "avg_ms": (self.total_ms / self.calls) if self.calls else 0.0,
+                "max_ms": self.max_ms,
+                "last_ms": self.last_ms,
+            }
+
+
+compression_metrics = CompressionMetrics()
+
+_compression_executor: Optional[ThreadPoolExecutor] = None
+_compression_executor_lock = threading.Lock()
+
+
+def _get_compression_executor() -> ThreadPoolExecutor:
+    """Return the process-wide pool that context compression runs in."""
+    global _compression_executor
+    with _compression_executor_lock:
+        if _compression_executor is None:
+            _compression_executor = ThreadPoolExecutor(
+                max_workers=max(1, config.CONTEXT_COMPRESSION_MAX_WORKERS),
+                thread_name_prefix="context-compression",
+            )
+        return _compression_executor
+
+
+def _check_cancelled(cancel_event: Optional[threading.Event]) -> None:
+    if cancel_event is not None and cancel_event.is_set():
+        raise CompressionCancelled()
+
+
 class ContextManager:
     """Manages thread context including token counting and summarization."""
     
@@ -26,6 +154,33 @@ class ContextManager:
         self.db = DBConnection()
         self.token_threshold = token_threshold
 
+    def get_model_max_tokens(self, llm_model: str) -> int:
+        """Token budget for the prompt of a model."""
+        if 'sonnet' in llm_model.lower():
+            return 200 * 1000 - 64000 - 28000
+        elif 'gpt' in llm_model.lower():
+            return 128 * 1000 - 28000
+        elif 'gemini' in llm_model.lower():
+            return 1000 * 1000 - 300000
+        elif 'deepseek' in llm_model.lower():
+            return 128 * 1000 - 28000
+        else:
+            return 41 * 1000 - 10000
+
+    def count_message_tokens(self, msg: Dict[str, Any], llm_model: str) -> int:
+        """Count the tokens of a single message using the shared token count cache."""
+        if not isinstance(msg, dict):
+            return 0
+        return token_count_cache.count(msg, llm_model)
+
+    def count_tokens(self, messages: List[Dict[str, Any]], llm_model: str) -> int:
+        """Count the tokens of a message list as the sum of its cached per-message counts.
+
+        This slightly overestimates litellm's whole-list count (each message carries
+        its own reply priming), which errs on the side of compressing earlier.
+        """
+        return sum(self.count_message_tokens(msg, llm_model) for msg in messages)
+
     def is_tool_result_message(self, msg: Dict[str, Any]) -> bool:
         """Check if a message is a tool result message."""
         if not isinstance(msg, dict) or not ("content" in msg and msg['content']):
@@ -109,7 +264,7 @@ class ContextManager:
   
     def compress_tool_result_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
         """Compress the tool result messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = self.count_tokens(messages, llm_model)
         max_tokens_value = max_tokens or (100 * 1000)
 
         if uncompressed_total_token_count > max_tokens_value:
@@ -119,7 +274,7 @@ class ContextManager:
                     continue  # Skip non-dict messages
                 if self.is_tool_result_message(msg):  # Only compress ToolResult messages
                     _i += 1  # Count the number of ToolResult messages
-                    msg_token_count = token_counter(messages=[msg])  # Count the number of tokens in the message
+                    msg_token_count = self.count_message_tokens(msg, llm_model)  # Count the number of tokens in the message
                     if msg_token_count > token_threshold:  # If the message is too long
                         if _i > 1:  # If this is not the most recent ToolResult message
                             message_id = msg.get('message_id')  # Get the message_id
@@ -133,7 +288,7 @@ class ContextManager:
 
     def compress_user_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
         """Compress the user messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = self.count_tokens(messages, llm_model)
         max_tokens_value = max_tokens or (100 * 1000)
 
         if uncompressed_total_token_count > max_tokens_value:
@@ -143,7 +298,7 @@ class ContextManager:
                     continue  # Skip non-dict messages
                 if msg.get('role') == 'user':  # Only compress User messages
                     _i += 1  # Count the number of User messages
-                    msg_token_count = token_counter(messages=[msg])  # Count the number of tokens in the message
+                    msg_token_count = self.count_message_tokens(msg, llm_model)  # Count the number of tokens in the message
                     if msg_token_count > token_threshold:  # If the message is too long
                         if _i > 1:  # If this is not the most recent User message
                             message_id = msg.get('message_id')  # Get the message_id
@@ -157,7 +312,7 @@ class ContextManager:
 
     def compress_assistant_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
         """Compress the assistant messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = self.count_tokens(messages, llm_model)
         max_tokens_value = max_tokens or (100 * 1000)
         
         if uncompressed_total_token_count > max_tokens_value:
@@ -167,7 +322,7 @@ class ContextManager:
                     continue  # Skip non-dict messages
                 if msg.get('role') == 'assistant':  # Only compress Assistant messages
                     _i += 1  # Count the number of Assistant messages
-                    msg_token_count = token_counter(messages=[msg])  # Count the number of tokens in the message
+                    msg_token_count = self.count_message_tokens(msg, llm_model)  # Count the number of tokens in the message
                     if msg_token_count > token_threshold:  # If the message is too long
                         if _i > 1:  # If this is not the most recent Assistant message
                             message_id = msg.get('message_id')  # Get the message_id
@@ -207,7 +362,63 @@ class ContextManager:
                 result.append(msg)
         return result
 
-    def compress_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int] = 41000, token_threshold: int = 4096, max_iterations: int = 5) -> List[Dict[str, Any]]:
+    async def count_tokens_async(self, messages: List[Dict[str, Any]], llm_model: str) -> int:
+        """Count tokens like count_tokens, in the compression pool unless running inline."""
+        if config.CONTEXT_COMPRESSION_MODE == "inline":
+            return self.count_tokens(messages, llm_model)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_compression_executor(), self.count_tokens, messages, llm_model)
+
+    async def compress_messages_async(self, messages: List[Dict[str, Any]], llm_model: str, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Compress the messages without blocking the event loop.
+
+        In "thread_pool" mode the pipeline runs in the shared compression pool on
+        shallow copies of the messages. If the awaiting task is cancelled or the
+        timeout expires, the worker is told to stop at its next checkpoint.
+
+        Args:
+            messages: List of messages to compress
+            llm_model: Model name for token counting
+            timeout: Seconds to wait before giving up (defaults to CONTEXT_COMPRESSION_TIMEOUT_SECONDS)
+
+        Raises:
+            asyncio.TimeoutError: If compression did not finish within the timeout.
+        """
+        start = time.perf_counter()
+
+        if config.CONTEXT_COMPRESSION_MODE == "inline":
+            result = self.compress_messages(messages, llm_model)
+            compression_metrics.record((time.perf_counter() - start) * 1000)
+            return result
+
+        timeout = timeout if timeout is not None else config.CONTEXT_COMPRESSION_TIMEOUT_SECONDS
+        cancel_event = threading.Event()
+        working_messages = [dict(msg) if isinstance(msg, dict) else msg for msg in messages]
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            _get_compression_executor(),
+            functools.partial(self.compress_messages, working_messages, llm_model, cancel_event=cancel_event),
+        )
+
+        try:
+            result = await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            cancel_event.set()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            compression_metrics.record(elapsed_ms, timed_out=True)
+            logger.warning(f"Context compression timed out after {elapsed_ms:.0f}ms ({len(messages)} messages)")
+            raise
+        except asyncio.CancelledError:
+            cancel_event.set()
+            compression_metrics.record((time.perf_counter() - start) * 1000, cancelled=True)
+            raise
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        compression_metrics.record(elapsed_ms)
+        logger.info(f"Context compression took {elapsed_ms:.1f}ms for {len(messages)} messages")
+        return result
+
+    def compress_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int] = 41000, token_threshold: int = 4096, max_iterations: int = 5, cancel_event: Optional[threading.Event] = None) -> List[Dict[str, Any]]:
         """Compress the messages.
         
         Args:
@@ -216,40 +427,36 @@ class ContextManager:
             max_tokens: Maximum allowed tokens
             token_threshold: Token threshold for individual message compression (must be a power of 2)
             max_iterations: Maximum number of compression iterations
+            cancel_event: Optional event that aborts the pipeline with CompressionCancelled once set
         """
         # Set model-specific token limits
-        if 'sonnet' in llm_model.lower():
-            max_tokens = 200 * 1000 - 64000 - 28000
-        elif 'gpt' in llm_model.lower():
-            max_tokens = 128 * 1000 - 28000
-        elif 'gemini' in llm_model.lower():
-            max_tokens = 1000 * 1000 - 300000
-        elif 'deepseek' in llm_model.lower():
-            max_tokens = 128 * 1000 - 28000
-        else:
-            max_tokens = 41 * 1000 - 10000
+        max_tokens = self.get_model_max_tokens(llm_model)
 
+        _check_cancelled(cancel_event)
         result = messages
         result = self.remove_meta_messages(result)
 
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=result)
+        uncompressed_total_token_count = self.count_tokens(result, llm_model)
 
         result = self.compress_tool_result_messages(result, llm_model, max_tokens, token_threshold)
+        _check_cancelled(cancel_event)
         result = self.compress_user_messages(result, llm_model, max_tokens, token_threshold)
+        _check_cancelled(cancel_event)
         result = self.compress_assistant_messages(result, llm_model, max_tokens, token_threshold)
+        _check_cancelled(cancel_event)
 
-        compressed_token_count = token_counter(model=llm_model, messages=result)
+        compressed_token_count = self.count_tokens(result, llm_model)
 
-        logger.info(f"compress_messages: {uncompressed_total_token_count} -> {compressed_token_count}")  # Log the token compression for debugging later
+        logger.info(f"compress_messages: {uncompressed_total_token_count} -> {compressed_token_count} (token cache hits={token_count_cache.hits}, misses={token_count_cache.misses})")  # Log the token compression for debugging later
 
         if max_iterations <= 0:
             logger.warning(f"compress_messages: Max iterations reached, omitting messages")
-            result = self.compress_messages_by_omitting_messages(messages, llm_model, max_tokens)
+            result = self.compress_messages_by_omitting_messages(messages, llm_model, max_tokens, cancel_event=cancel_event)
             return result
 
         if compressed_token_count > max_tokens:
             logger.warning(f"Further token compression is needed: {compressed_token_count} > {max_tokens}")
-            result = self.compress_messages(messages, llm_model, max_tokens, token_threshold // 2, max_iterations - 1)
+            result = self.compress_messages(messages, llm_model, max_tokens, token_threshold // 2, max_iterations - 1, cancel_event=cancel_event)
 
         return self.middle_out_messages(result)
     
@@ -259,7 +466,8 @@ class ContextManager:
             llm_model: str, 
             max_tokens: Optional[int] = 41000,
             removal_batch_size: int = 10,
-            min_messages_to_keep: int = 10
+            min_messages_to_keep: int = 10,
+            cancel_event: Optional[threading.Event] = None
         ) -> List[Dict[str, Any]]:
         """Compress the messages by omitting messages from the middle.
         
@@ -269,6 +477,7 @@ class ContextManager:
             max_tokens: Maximum allowed tokens
             removal_batch_size: Number of messages to remove per iteration
             min_messages_to_keep: Minimum number of messages to preserve
+            cancel_event: Optional event that aborts the loop with CompressionCancelled once set
         """
         if not messages:
             return messages
@@ -277,7 +486,7 @@ class ContextManager:
         result = self.remove_meta_messages(result)
 
         # Early exit if no compression needed
-        initial_token_count = token_counter(model=llm_model, messages=result)
+        initial_token_count = self.count_tokens(result, llm_model)
         max_allowed_tokens = max_tokens or (100 * 1000)
         
         if initial_token_count <= max_allowed_tokens:
@@ -292,6 +501,7 @@ class ContextManager:
         
         while current_token_count > max_allowed_tokens and safety_limit > 0:
             safety_limit -= 1
+            _check_cancelled(cancel_event)
             
             if len(conversation_messages) <= min_messages_to_keep:
                 logger.warning(f"Cannot compress further: only {len(conversation_messages)} messages remain (min: {min_messages_to_keep})")
@@ -302,28 +512,77 @@ class ContextManager:
                 # Remove from middle, keeping recent and early context
                 middle_start = len(conversation_messages) // 2 - (removal_batch_size // 2)
                 middle_end = middle_start + removal_batch_size
+                removed_messages = conversation_messages[middle_start:middle_end]
                 conversation_messages = conversation_messages[:middle_start] + conversation_messages[middle_end:]
             else:
                 # Remove from earlier messages, preserving recent context
                 messages_to_remove = min(removal_batch_size, len(conversation_messages) // 2)
                 if messages_to_remove > 0:
+                    removed_messages = conversation_messages[:messages_to_remove]
                     conversation_messages = conversation_messages[messages_to_remove:]
                 else:
                     # Can't remove any more messages
                     break
 
-            # Recalculate token count
-            messages_to_count = ([system_message] + conversation_messages) if system_message else conversation_messages
-            current_token_count = token_counter(model=llm_model, messages=messages_to_count)
+            # Keep a running total instead of re-tokenizing the remaining messages
+            current_token_count -= self.count_tokens(removed_messages, llm_model)
 
         # Prepare final result
         final_messages = ([system_message] + conversation_messages) if system_message else conversation_messages
-        final_token_count = token_counter(model=llm_model, messages=final_messages)
+        final_token_count = current_token_count
         
         logger.info(f"compress_messages_by_omitting_messages: {initial_token_count} -> {final_token_count} tokens ({len(messages)} -> {len(final_messages)} messages)")
             
         return final_messages
     
+    def estimate_message_tokens(self, msg: Dict[str, Any]) -> int:
+        """Rough token count of a message from its length, without tokenizing it."""
+        if not isinstance(msg, dict):
+            return 0
+        content = msg.get('content')
+        length = len(content) if isinstance(content, str) else len(json.dumps(content, default=str))
+        if msg.get('tool_calls'):
+            length += len(json.dumps(msg['tool_calls'], default=str))
+        return length // CHARS_PER_TOKEN_ESTIMATE + 4
+
+    def truncate_to_token_estimate(self, messages: List[Dict[str, Any]], llm_model: str) -> List[Dict[str, Any]]:
+        """Fit the messages into the model's budget without running the tokenizer.
+
+        Fallback for when compress_messages_async times out: drops the oldest
+        conversation messages (keeping the system message) until the estimated
+        size fits, then middle-truncates the newest message if it alone is too large.
+        """
+        if not messages:
+            return messages
+        max_tokens = self.get_model_max_tokens(llm_model)
+        result = self.remove_meta_messages(messages)
+        system_message = result[0] if isinstance(result[0], dict) and result[0].get('role') == 'system' else None
+        conversation = result[1:] if system_message else result
+
+        total = sum(self.estimate_message_tokens(msg) for msg in result)
+        initial_total, initial_count = total, len(result)
+        start = 0
+        while total > max_tokens and start < len(conversation) - 1:
+            total -= self.estimate_message_tokens(conversation[start])
+            start += 1
+        # Tool results cannot lead the conversation without the call they answer
+        while start < len(conversation) - 1 and isinstance(conversation[start], dict) and conversation[start].get('role') == 'tool':
+            total -= self.estimate_message_tokens(conversation[start])
+            start += 1
+        conversation = conversation[start:]
+
+        if total > max_tokens and conversation:
+            last = dict(conversation[-1])
+            others = total - self.estimate_message_tokens(last)
+            budget_chars = max(1000, (max_tokens - others) * CHARS_PER_TOKEN_ESTIMATE)
+            last['content'] = self.safe_truncate(last.get('content') or '', budget_chars)
+            conversation = conversation[:-1] + [last]
+            total = others + self.estimate_message_tokens(last)
+
+        final_messages = ([system_message] + conversation) if system_message else conversation
+        logger.info(f"truncate_to_token_estimate: ~{initial_total} -> ~{total} tokens ({initial_count} -> {len(final_messages)} messages)")
+        return final_messages
+
     def middle_out_messages(self, messages: List[Dict[str, Any]], max_messages: int = 320) -> List[Dict[str, Any]]:
         """Remove messages from the middle of the list, keeping max_messages total."""
         if len(messages) <= max_messages:
@@ -0,0 +1,227 @@
+"""
+Incremental message cache for AgentPress threads.
+
+Keeps the already-parsed LLM messages of recently used threads in process
+memory so that ``ThreadManager.get_llm_messages`` only has to fetch rows that
+are newer than the last one it has seen. Deletes bump a per-thread version key
+in Redis, which makes every worker process drop its copy on the next read.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services import redis
+from utils.logger import logger
+
+# Number of threads kept in memory per process
+MESSAGE_CACHE_MAX_THREADS = 256
+
+# Entries not read for this long are dropped on the next access
+MESSAGE_CACHE_TTL_SECONDS = 30 * 60
+
+# Page size used when fetching rows from the database
+MESSAGE_FETCH_BATCH_SIZE = 1000
+
+# Incremental fetches look back this far before the cursor, so rows whose
+# created_at came from a slightly different clock or a late commit are not missed
+MESSAGE_CURSOR_OVERLAP_SECONDS = 5
+
+
+def _version_key(thread_id: str) -> str:
+    return f"thread_messages_version:{thread_id}"
+
+
+def _created_at_sort_key(created_at: Optional[str]) -> Any:
+    """Sort key for Postgres timestamps, which may drop trailing zeros in the fraction."""
+    if not created_at:
+        return datetime.min.isoformat()
+    try:
+        return datetime.fromisoformat(created_at).isoformat()
+    except ValueError:
+        return created_at
+
+
+def _cursor_with_overlap(cursor: str) -> str:
+    try:
+        return (datetime.fromisoformat(cursor) - timedelta(seconds=MESSAGE_CURSOR_OVERLAP_SECONDS)).isoformat()
+    except ValueError:
+        return cursor
+
+
+def parse_message_row(row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Parse a ``messages`` row into the LLM message dict, tagged with its message_id."""
+    content = row.get('content')
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except json.JSONDecodeError:
+            logger.error(f"Failed to parse message: {content}")
+            return None
+    if not isinstance(content, dict):
+        logger.error(f"Unexpected message content for {row.get('message_id')}: {str(content)[:100]}")
+        return None
+    content['message_id'] = row['message_id']
+    return content
+
+
+@dataclass
+class _ThreadEntry:
+    """Parsed messages of a single thread plus the cursor for incremental fetches."""
+    messages: List[Tuple[str, str, Dict[str, Any]]] = field(default_factory=list)  # (created_at, message_id, message)
+    message_ids: Set[str] = field(default_factory=set)
+    cursor: Optional[str] = None  # created_at of the newest row fetched from the DB
+    version: Optional[str] = None
+    touched_at: float = field(default_factory=time.monotonic)
+    needs_sort: bool = False
+
+    def add(self, created_at: str, message_id: str, message: Dict[str, Any]) -> bool:
+        if message_id in self.message_ids:
+            return False
+        if self.messages and _created_at_sort_key(created_at) < _created_at_sort_key(self.messages[-1][0]):
+            self.needs_sort = True
+        self.messages.append((created_at, message_id, message))
+        self.message_ids.add(message_id)
+        return True
+
+
+class ThreadMessageCache:
+    """Per-thread, append-only cache of parsed LLM messages."""
+
+    def __init__(self, max_threads: int = MESSAGE_CACHE_MAX_THREADS, ttl_seconds: int = MESSAGE_CACHE_TTL_SECONDS):
+        self._entries: "OrderedDict[str, _ThreadEntry]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._max_threads = max_threads
+        self._ttl = ttl_seconds
+
+    def _lock_for(self, thread_id: str) -> asyncio.Lock:
+        lock = self._locks.get(thread_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[thread_id] = lock
+        return lock
+
+    def _store(self, thread_id: str, entry: _ThreadEntry) -> None:
+        self._entries[thread_id] = entry
+        self._entries.move_to_end(thread_id)
+        while len(self._entries) > self._max_threads:
+            evicted_id, _ = self._entries.popitem(last=False)
+            lock = self._locks.get(evicted_id)
+            if lock is not None and not lock.locked():
+                del self._locks[evicted_id]
+
+    async def _get_version(self, thread_id: str) -> Optional[str]:
+        try:
+            return await redis.get(_version_key(thread_id))
+        except Exception as e:
+            logger.warning(f"Failed to read message cache version for thread {thread_id}: {e}")
+            raise
+
+    async def get_messages(self, client, thread_id: str) -> List[Dict[str, Any]]:
+        """Return all LLM messages for the thread, fetching only rows newer than the cached ones.
+
+        The returned message dicts are shallow copies, so callers may reassign
+        fields (e.g. ``content`` during compression) without touching the cache.
+        """
+        async with self._lock_for(thread_id):
+            entry = self._entries.get(thread_id)
+
+            try:
+                version = await self._get_version(thread_id)
+            except Exception:
+                # Without the version we cannot tell whether a delete happened elsewhere
+                entry = None
+                version = None
+
+            if entry is not None:
+                if entry.version != version or time.monotonic() - entry.touched_at > self._ttl:
+                    logger.debug(f"Message cache for thread {thread_id} is stale, reloading")
+                    entry = None
+
+            if entry is None:
+                entry = _ThreadEntry(version=version)
+
+            fetched = await self._fetch_since(client, thread_id, entry)
+            if entry.needs_sort:
+                entry.messages.sort(key=lambda item: _created_at_sort_key(item[0]))
+                entry.needs_sort = False
+            entry.touched_at = time.monotonic()
+            self._store(thread_id, entry)
+
+            logger.debug(f"Message cache for thread {thread_id}: fetched {fetched} new rows, {len(entry.messages)} total")
+            return [dict(message) for _, _, message in entry.messages]
+
+    async def _fetch_since(self, client, thread_id: str, entry: _ThreadEntry) -> int:
+        """Page through rows at or after the entry's cursor and merge them in."""
+        fetched = 0
+        offset = 0
+        cursor = entry.cursor
+
+        while True:
+            query = client.table('messages').select('message_id, content, created_at')\
+                .eq('thread_id', thread_id).eq('is_llm_message', True)
+            if cursor:
+                query = query.gte('created_at', _cursor_with_overlap(cursor))
+            result = await query.order('created_at').range(offset, offset + MESSAGE_FETCH_BATCH_SIZE - 1).execute()
+
+            if not result.data:
+                break
+
+            for row in result.data:
+                fetched += 1
+                created_at = row.get('created_at')
+                if created_at and (entry.cursor is None or _created_at_sort_key(created_at) > _created_at_sort_key(entry.cursor)):
+                    entry.cursor = created_at
+                if row['message_id'] in entry.message_ids:
+                    continue
+                message = parse_message_row(row)
+                if message is not None:
+                    entry.add(created_at, row['message_id'], message)
+
+            if len(result.data) < MESSAGE_FETCH_BATCH_SIZE:
+                break
+
+            offset += MESSAGE_FETCH_BATCH_SIZE
+
+        return fetched
+
+    def record_insert(self, thread_id: str, row: Dict[str, Any]) -> None:
+        """Add a freshly inserted LLM message row to the thread's entry, if one is cached.
+
+        The DB cursor is left untouched so rows written concurrently by other
+        processes with an earlier ``created_at`` are still picked up by the next fetch.
+        """
+        entry = self._entries.get(thread_id)
+        if entry is None or not row.get('message_id'):
+            return
+        content = row.get('content')
+        row = {**row, 'content': dict(content) if isinstance(content, dict) else content}
+        message = parse_message_row(row)
+        if message is not None:
+            entry.add(row.get('created_at'), row['message_id'], message)
+
+    def invalidate_local(self, thread_id: str) -> None:
+        """Drop the thread's entry from this process only."""
+        self._entries.pop(thread_id, None)
+
+    async def invalidate(self, thread_id: str) -> None:
+        """Drop the thread's entry in this and every other process."""
+        self.invalidate_local(thread_id)
+        try:
+            redis_client = await redis.get_client()
+            version_key = _version_key(thread_id)
+            await redis_client.incr(version_key)
+            await redis_client.expire(version_key, redis.REDIS_KEY_TTL)
+        except Exception as e:
+            logger.warning(f"Failed to bump message cache version for thread {thread_id}: {e}")
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# Global cache instance
+thread_message_cache = ThreadMessageCache()
@@ -0,0 +1,167 @@
+"""
+Write-behind persistence for AgentPress status messages.
+
+Status rows (tool started/completed, run start/end, finish, ...) are not read
+back by the LLM, so they do not need to be in the database before the chunk is
+sent to the client. ``BufferedMessageWriter`` assigns their ``message_id`` and
+``created_at`` up front, queues them, and writes them in bulk inserts from a
+background task. ``flush`` is the barrier callers use before a run is reported
+as finished.
+"""
+
+import asyncio
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from services.supabase import DBConnection
+from utils.logger import logger
+
+# Flush once this many rows are queued ...
+MESSAGE_WRITER_MAX_BATCH = 50
+# ... or once the oldest queued row has waited this long
+MESSAGE_WRITER_FLUSH_INTERVAL_SECONDS = 0.25
+# Attempts per batch before falling back to row-by-row inserts
+MESSAGE_WRITER_MAX_ATTEMPTS = 3
+
+_clock_lock = threading.Lock()
+_last_timestamp: Optional[datetime] = None
+
+
+def next_message_timestamp() -> str:
+    """Return a strictly increasing UTC timestamp for buffered status rows.
+
+    Buffered rows of a run sort in the order they were produced regardless of
+    when they reach the database. Directly inserted rows keep the database's
+    ``now()``; their stored ``created_at`` is fed back through
+    ``observe_message_timestamp``, so a status row never sorts before a row
+    this process has already seen inserted.
+    """
+    global _last_timestamp
+    with _clock_lock:
+        now = datetime.now(timezone.utc)
+        if _last_timestamp is not None and now <= _last_timestamp:
+            now = _last_timestamp + timedelta(microseconds=1)
+        _last_timestamp = now
+        return now.isoformat()
+
+
+def observe_message_timestamp(created_at: Optional[str]) -> None:
+    """Advance the status row clock past a ``created_at`` assigned by the database."""
+    global _last_timestamp
+    if not created_at:
+        return
+    try:
+        observed = datetime.fromisoformat(created_at)
+    except ValueError:
+        return
+    if observed.tzinfo is None:
+        observed = observed.replace(tzinfo=timezone.utc)
+    with _clock_lock:
+        if _last_timestamp is None or observed > _last_timestamp:
+            _last_timestamp = observed
+
+
+class BufferedMessageWriter:
+    """Queues message rows and persists them in ordered bulk inserts."""
+
+    def __init__(self, max_batch: int = MESSAGE_WRITER_MAX_BATCH, flush_interval: float = MESSAGE_WRITER_FLUSH_INTERVAL_SECONDS):
+        self.db = DBConnection()
+        self._max_batch = max_batch
+        self._flush_interval = flush_interval
+        self._pending: List[Dict[str, Any]] = []
+        self._flush_lock = asyncio.Lock()
+        self._timer_task: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.rows_written = 0
+        self.batches_written = 0
+        self.rows_failed = 0
+
+    def enqueue(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a row for insertion and return it as it will be stored.
+
+        Args:
+            row: Column values for the ``messages`` table (without id/timestamps).
+
+        Returns:
+            The row including its pre-assigned ``message_id``, ``created_at`` and ``updated_at``.
+        """
+        created_at = next_message_timestamp()
+        # Bulk inserts need every row to carry the same columns
+        stored = {
+            'message_id': str(uuid.uuid4()),
+            'agent_id': None,
+            'agent_version_id': None,
+            **row,
+            'created_at': created_at,
+            'updated_at': created_at,
+        }
+        self._pending.append(stored)
+
+        if len(self._pending) >= self._max_batch:
+            self._schedule_flush(delay=0)
+        else:
+            self._schedule_flush(delay=self._flush_interval)
+        return dict(stored)
+
+    def _schedule_flush(self, delay: float) -> None:
+        if delay > 0:
+            if self._timer_task is not None and not self._timer_task.done():
+                return
+            self._timer_task = self._spawn(self._delayed_flush(delay))
+        else:
+            # A full batch is waiting; don't let it sit out the timer
+            self._spawn(self._delayed_flush(0))
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _delayed_flush(self, delay: float) -> None:
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._flush_pending()
+        except Exception as e:
+            logger.error(f"Background message flush failed: {str(e)}", exc_info=True)
+
+    async def flush(self) -> None:
+        """Barrier: return once every row queued before this call has been written."""
+        await self._flush_pending()
+
+    async def _flush_pending(self) -> None:
+        # The lock keeps batches in enqueue order even when a timer and a barrier race
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self._max_batch]
+                del self._pending[:len(batch)]
+                await self._write_batch(batch)
+
+    async def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        client = await self.db.client
+        for attempt in range(MESSAGE_WRITER_MAX_ATTEMPTS):
+            try:
+                await client.table('messages').insert(batch).execute()
+                self.rows_written += len(batch)
+                self.batches_written += 1
+                logger.debug(f"Flushed {len(batch)} buffered messages")
+                return
+            except Exception as e:
+                logger.warning(f"Bulk insert of {len(batch)} buffered messages failed (attempt {attempt + 1}): {str(e)}")
+                await asyncio.sleep(0.2 * (2 ** attempt))
+
+        # One bad row should not take the rest of the batch down with it
+        for row in batch:
+            try:
+                await client.table('messages').upsert(row, on_conflict='message_id').execute()
+                self.rows_written += 1
+            except Exception as e:
+                self.rows_failed += 1
+                logger.error(f"Failed to persist buffered message {row.get('message_id')} for thread {row.get('thread_id')}: {str(e)}")
+
+
+# Process-wide writer shared by all ThreadManagers
+status_message_writer = BufferedMessageWriter()
@@ -18,7 +18,7 @@ from dataclasses import dataclass
 from utils.logger import logger
 from agentpress.tool import ToolResult
 from agentpress.tool_registry import ToolRegistry
-from agentpress.xml_tool_parser import XMLToolParser
+from agentpress.xml_tool_parser import XMLToolParser, StreamingXMLToolParser
 from langfuse.client import StatefulTraceClient
 from services.langfuse import langfuse
 from utils.json_helpers import (
@@ -169,8 +169,10 @@ class ResponseProcessor:
         continuous_state = continuous_state or {}
         accumulated_content = continuous_state.get('accumulated_content', "")
         tool_calls_buffer = {}
-        current_xml_content = accumulated_content   # equal to accumulated_content if auto-continuing, else blank
+        # Incremental XML scanner, carried over when auto-continuing so a tool call split across cycles is still found
+        xml_stream_parser = continuous_state.get('xml_stream_parser') or StreamingXMLToolParser()
         xml_chunks_buffer = []
+        last_invoke_xml = None
         pending_tool_executions = []
         yielded_tool_indices = set() # Stores indices of tools whose *status* has been yielded
         tool_index = 0
@@ -266,7 +268,6 @@ class ResponseProcessor:
                         chunk_content = delta.content
                         # print(chunk_content, end='', flush=True)
                         accumulated_content += chunk_content
-                        current_xml_content += chunk_content
 
                         if not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
                             # Yield ONLY content chunk (don't save)
@@ -286,10 +287,10 @@ class ResponseProcessor:
 
                         # --- Process XML Tool Calls (if enabled and limit not reached) ---
                         if config.xml_tool_calling and not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
-                            xml_chunks = self._extract_xml_chunks(current_xml_content)
-                            for xml_chunk in xml_chunks:
-                                current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
+                            for invoke_xml in xml_stream_parser.feed(chunk_content):
+                                xml_chunk = f"<function_calls>\n{invoke_xml}\n</function_calls>"
                                 xml_chunks_buffer.append(xml_chunk)
+                                last_invoke_xml = invoke_xml
                                 result = self._parse_xml_tool_call(xml_chunk)
                                 if result:
                                     tool_call, parsing_details = result
@@ -511,11 +512,11 @@ class ResponseProcessor:
             # Only save assistant message if NOT auto-continuing due to length to avoid duplicate messages
             if accumulated_content and not should_auto_continue:
                 # ... (Truncate accumulated_content logic) ...
-                if config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls and xml_chunks_buffer:
-                    last_xml_chunk = xml_chunks_buffer[-1]
-                    last_chunk_end_pos = accumulated_content.find(last_xml_chunk) + len(last_xml_chunk)
-                    if last_chunk_end_pos > 0:
-                        accumulated_content = accumulated_content[:last_chunk_end_pos]
+                if config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls and last_invoke_xml:
+                    last_invoke_pos = accumulated_content.rfind(last_invoke_xml)
+                    if last_invoke_pos >= 0:
+                        # Cut after the last executed invoke and close its <function_calls> block
+                        accumulated_content = accumulated_content[:last_invoke_pos + len(last_invoke_xml)] + "\n</function_calls>"
 
                 # ... (Extract complete_native_tool_calls logic) ...
                 # Update complete_native_tool_calls from buffer (initialized earlier)
@@ -574,9 +575,7 @@ class ResponseProcessor:
                  # Gather XML tool calls from buffer (up to limit)
                 parsed_xml_data = []
                 if config.xml_tool_calling:
-                    # Reparse remaining content just in case (should be empty if processed correctly)
-                    xml_chunks = self._extract_xml_chunks(current_xml_content)
-                    xml_chunks_buffer.extend(xml_chunks)
+                    # The streaming parser has already emitted every complete invoke into xml_chunks_buffer
                     # Process only chunks not already handled in the stream loop
                     remaining_limit = config.max_xml_tool_calls - xml_tool_call_count if config.max_xml_tool_calls > 0 else len(xml_chunks_buffer)
                     xml_chunks_to_process = xml_chunks_buffer[:remaining_limit] # Ensure limit is respected
@@ -837,9 +836,11 @@ class ResponseProcessor:
             if should_auto_continue:
                 continuous_state['accumulated_content'] = accumulated_content
                 continuous_state['sequence'] = __sequence
+                continuous_state['xml_stream_parser'] = xml_stream_parser
                 
                 logger.info(f"Updated continuous state for auto-continue with {len(accumulated_content)} chars")
             else:
+                continuous_state.pop('xml_stream_parser', None)
                 # Save and Yield the final thread_run_end status (only if not auto-continuing and finish_reason is not 'length')
                 try:
                     end_content = {"status_type": "thread_run_end"}
@@ -1080,14 +1081,13 @@ class ResponseProcessor:
             # If no new format found, fall back to old format for backwards compatibility
             if not chunks:
                 pos = 0
+                available_functions = self.tool_registry.get_available_functions()
                 while pos < len(content):
                     # Find the next tool tag
                     next_tag_start = -1
                     current_tag = None
                     
                     # Find the earliest occurrence of any registered tool function name
-                    # Check for available function names
-                    available_functions = self.tool_registry.get_available_functions()
                     for func_name in available_functions.keys():
                         # Convert function name to potential tag name (underscore to dash)
                         tag_name = func_name.replace('_', '-')
@@ -0,0 +1,115 @@
+"""
+Cache for the XML tool-calling section of the system prompt.
+
+The section lists every registered function as JSON Schema plus its usage
+examples and runs to several KB. It only depends on the registered tool set,
+so it is rendered once per ``ToolRegistry`` fingerprint and agent version and
+reused for every iteration and run that shares them. The cache is per process:
+each worker renders a given tool set once.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from agentpress.tool_registry import ToolRegistry
+from utils.logger import logger
+
+# Number of distinct tool sets kept per process
+TOOL_PROMPT_CACHE_MAX_ENTRIES = 128
+
+
+def render_tool_prompt(tool_registry: ToolRegistry) -> str:
+    """Render the XML tool-calling instructions for the registry's tools.
+
+    Returns:
+        The prompt section, or an empty string if no tools are registered
+    """
+    openapi_schemas = tool_registry.get_openapi_schemas()
+    if not openapi_schemas:
+        return ""
+
+    usage_examples = tool_registry.get_usage_examples()
+
+    # Convert schemas to JSON string
+    schemas_json = json.dumps(openapi_schemas, indent=2)
+
+    # Build usage examples section if any exist
+    usage_examples_section = ""
+    if usage_examples:
+        usage_examples_section = "\n\nUsage Examples:\n"
+        for func_name, example in usage_examples.items():
+            usage_examples_section += f"\n{func_name}:\n{example}\n"
+
+    return f"""
+In this environment you have access to a set of tools you can use to answer the user's question.
+
+You can invoke functions by writing a <function_calls> block like the following as part of your reply to the user:
+
+<function_calls>
+<invoke name="function_name">
+<parameter name="param_name">param_value</parameter>
+...
+</invoke>
+</function_calls>
+
+String and scalar parameters should be specified as-is, while lists and objects should use JSON format.
+
+Here are the functions available in JSON Schema format:
+
+```json
+{schemas_json}
+```
+
+When using the tools:
+- Use the exact function names from the JSON schema above
+- Include all required parameters as specified in the schema
+- Format complex data (objects, arrays) as JSON strings within the parameter tags
+- Boolean values should be "true" or "false" (lowercase)
+{usage_examples_section}"""
+
+
+class ToolPromptCache:
+    """LRU of rendered tool prompt sections keyed by tool-set fingerprint and agent version."""
+
+    def __init__(self, max_entries: int = TOOL_PROMPT_CACHE_MAX_ENTRIES):
+        self._entries: "OrderedDict[Tuple[str, Optional[str]], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tool_registry: ToolRegistry, agent_version: Optional[str] = None) -> str:
+        """Return the rendered prompt section, rendering it on first use."""
+        key = (tool_registry.get_fingerprint(), agent_version)
+
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        rendered = render_tool_prompt(tool_registry)
+        logger.debug(f"Rendered tool prompt for fingerprint {key[0][:12]} (agent version {agent_version}): {len(rendered)} chars")
+
+        with self._lock:
+            self._entries[key] = rendered
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return rendered
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Global cache instance
+tool_prompt_cache = ToolPromptCache()
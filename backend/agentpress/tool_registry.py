@@ -1,6 +1,7 @@
 from typing import Dict, Type, Any, List, Optional, Callable
 from agentpress.tool import Tool, SchemaType
 from utils.logger import logger
+import hashlib
 import json
 
 
@@ -22,6 +23,9 @@ class ToolRegistry:
     def __init__(self):
         """Initialize a new ToolRegistry instance."""
         self.tools = {}
+        # What each function's schemas come from, for the fingerprint
+        self._sources: Dict[str, str] = {}
+        self._fingerprint: Optional[str] = None
         logger.debug("Initialized new ToolRegistry instance")
     
     def register_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
@@ -52,11 +56,39 @@ class ToolRegistry:
                             "instance": tool_instance,
                             "schema": schema
                         }
+                        self._sources[func_name] = f"{tool_class.__module__}.{tool_class.__qualname__}"
                         registered_openapi += 1
                         logger.debug(f"Registered OpenAPI function {func_name} from {tool_class.__name__}")
         
+        self._fingerprint = None
         logger.debug(f"Tool registration complete for {tool_class.__name__}: {registered_openapi} OpenAPI functions")
 
+    def register_tool_instance(self, tool_instance: Tool, schemas: Dict[str, List[Any]]):
+        """Register the schemas of an already initialized tool instance.
+
+        Used for tools whose schemas are only known after setup (e.g. MCP tools).
+
+        Args:
+            tool_instance: The tool instance handling the functions
+            schemas: Mapping of function name to its schemas
+        """
+        for func_name, schema_list in schemas.items():
+            for schema in schema_list:
+                self.tools[func_name] = {
+                    "instance": tool_instance,
+                    "schema": schema
+                }
+            # These schemas are built at runtime, so they are identified by content
+            payload = json.dumps(
+                [[schema.schema_type.value, schema.schema] for schema in schema_list],
+                sort_keys=True,
+                separators=(',', ':'),
+                default=str,
+            )
+            self._sources[func_name] = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        self._fingerprint = None
+        logger.debug(f"Registered {len(schemas)} functions from {type(tool_instance).__name__}")
+
     def get_available_functions(self) -> Dict[str, Callable]:
         """Get all available tool functions.
         
@@ -127,3 +159,18 @@ class ToolRegistry:
         logger.debug(f"Retrieved {len(examples)} usage examples")
         return examples
 
+    def get_fingerprint(self) -> str:
+        """Get a stable hash identifying the registered tool set.
+
+        Decorated tools declare their schemas on the class, so they are
+        identified by function name and tool class without rendering anything;
+        tools registered with ``register_tool_instance`` are identified by a hash
+        of their schemas. The value is memoized until the next registration.
+
+        Returns:
+            Hex digest identifying the registered tool set
+        """
+        if self._fingerprint is None:
+            payload = json.dumps(list(self._sources.items()), separators=(',', ':'))
+            self._fingerprint = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        return self._fingerprint
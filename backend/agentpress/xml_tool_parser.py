@@ -221,6 +221,108 @@ class XMLToolParser:
         return True, None
 
 
+class StreamingXMLToolParser:
+    """
+    Incremental scanner for XML tool calls in a streamed LLM response.
+
+    Remembers its position and tag state between deltas, so each call to
+    ``feed`` only looks at the new text (plus a few characters carried over
+    for tags split across deltas). The first ``<invoke>`` of each
+    ``<function_calls>`` block is returned as soon as its ``</invoke>`` arrives;
+    like the whole-block parsing it replaces, any further invokes in the same
+    block are skipped.
+    """
+
+    FUNCTION_CALLS_OPEN = '<function_calls>'
+    FUNCTION_CALLS_CLOSE = '</function_calls>'
+    INVOKE_OPEN = '<invoke'
+    INVOKE_CLOSE = '</invoke>'
+
+    _OUTSIDE = 0
+    _IN_FUNCTION_CALLS = 1
+    _IN_INVOKE = 2
+    _AFTER_INVOKE = 3
+
+    def __init__(self):
+        """Initialize the streaming parser."""
+        self._state = self._OUTSIDE
+        self._carry = ""
+        self._invoke_parts: List[str] = []
+
+    @property
+    def in_function_calls(self) -> bool:
+        """Whether the stream is currently inside an unclosed <function_calls> block."""
+        return self._state != self._OUTSIDE
+
+    @staticmethod
+    def _tail(text: str, start: int, *tags: str) -> str:
+        """Characters that may be the beginning of one of ``tags`` split across deltas."""
+        keep = max(len(tag) for tag in tags) - 1
+        return text[max(start, len(text) - keep):]
+
+    def feed(self, delta: str) -> List[str]:
+        """
+        Consume the next piece of streamed text.
+
+        Args:
+            delta: Newly received content
+
+        Returns:
+            Raw ``<invoke ...>...</invoke>`` strings completed by this delta, in order
+        """
+        completed = []
+        text = self._carry + delta
+        self._carry = ""
+        pos = 0
+
+        while True:
+            if self._state == self._OUTSIDE:
+                start = text.find(self.FUNCTION_CALLS_OPEN, pos)
+                if start == -1:
+                    self._carry = self._tail(text, pos, self.FUNCTION_CALLS_OPEN)
+                    break
+                self._state = self._IN_FUNCTION_CALLS
+                pos = start + len(self.FUNCTION_CALLS_OPEN)
+
+            elif self._state == self._IN_FUNCTION_CALLS:
+                invoke_start = text.find(self.INVOKE_OPEN, pos)
+                block_end = text.find(self.FUNCTION_CALLS_CLOSE, pos)
+                if block_end != -1 and (invoke_start == -1 or block_end < invoke_start):
+                    self._state = self._OUTSIDE
+                    pos = block_end + len(self.FUNCTION_CALLS_CLOSE)
+                elif invoke_start != -1:
+                    self._state = self._IN_INVOKE
+                    self._invoke_parts = []
+                    pos = invoke_start
+                else:
+                    self._carry = self._tail(text, pos, self.INVOKE_OPEN, self.FUNCTION_CALLS_CLOSE)
+                    break
+
+            elif self._state == self._AFTER_INVOKE:
+                block_end = text.find(self.FUNCTION_CALLS_CLOSE, pos)
+                if block_end == -1:
+                    self._carry = self._tail(text, pos, self.FUNCTION_CALLS_CLOSE)
+                    break
+                self._state = self._OUTSIDE
+                pos = block_end + len(self.FUNCTION_CALLS_CLOSE)
+
+            else:
+                invoke_end = text.find(self.INVOKE_CLOSE, pos)
+                if invoke_end == -1:
+                    # Keep the invoke body, but only rescan its last few characters next time
+                    self._carry = self._tail(text, pos, self.INVOKE_CLOSE)
+                    self._invoke_parts.append(text[pos:len(text) - len(self._carry)])
+                    break
+                end = invoke_end + len(self.INVOKE_CLOSE)
+                self._invoke_parts.append(text[pos:end])
+                completed.append("".join(self._invoke_parts))
+                self._invoke_parts = []
+                self._state = self._AFTER_INVOKE
+                pos = end
+
+        return completed
+
+
 # Convenience function for quick parsing
 def parse_xml_tool_calls(content: str) -> List[XMLToolCall]:
     """
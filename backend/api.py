@@ -74,8 +74,17 @@ async def lifespan(app: FastAPI):
         credentials_api.initialize(db)
         template_api.initialize(db)
         
+        # Keep pre-warmed sandboxes ready for new projects
+        from sandbox.sandbox_pool import sandbox_pool
+        sandbox_pool.start()
+        
+        # Fail agent runs whose worker died
+        agent_api.start_active_run_reaper()
+        
         yield
         
+        await sandbox_pool.stop()
+        
         # Clean up agent resources
         logger.info("Cleaning up agent resources")
         await agent_api.cleanup()
@@ -9,8 +9,9 @@ from datetime import datetime
 from collections import OrderedDict
 
 from mcp import ClientSession
-from mcp.client.sse import sse_client
-from mcp.client.streamable_http import streamablehttp_client
+
+from .session_pool import mcp_session_pool, MCPServerSpec
+from .tool_cache import mcp_tool_cache
 
 from utils.logger import logger
 from credentials import EncryptionService
@@ -51,6 +52,7 @@ class MCPConnection:
     external_user_id: Optional[str] = None
     session: Optional[ClientSession] = field(default=None, compare=False)
     tools: Optional[List[Any]] = field(default=None, compare=False)
+    server: Optional[MCPServerSpec] = field(default=None, compare=False)
 
 
 @dataclass(frozen=True)
@@ -119,30 +121,25 @@ class MCPService:
             server_url = self._get_server_url(request.qualified_name, request.config, request.provider)
             headers = self._get_headers(request.qualified_name, request.config, request.provider, request.external_user_id)
             
-            async with streamablehttp_client(server_url, headers=headers) as (
-                read_stream, write_stream, _
-            ):
-                session = ClientSession(read_stream, write_stream)
-                await session.initialize()
-                
-                tool_result = await session.list_tools()
-                tools = tool_result.tools if tool_result else []
-                
-                connection = MCPConnection(
-                    qualified_name=request.qualified_name,
-                    name=request.name,
-                    config=request.config,
-                    enabled_tools=request.enabled_tools,
-                    provider=request.provider,
-                    external_user_id=request.external_user_id,
-                    session=session,
-                    tools=tools
-                )
-                
-                self._connections[request.qualified_name] = connection
-                self._logger.info(f"Connected to {request.qualified_name} ({len(tools)} tools available)")
-                
-                return connection
+            # The pool owns the session, so it stays usable after this call returns
+            server = MCPServerSpec.http(server_url, headers)
+            tools = await mcp_tool_cache.list_tools(server)
+            
+            connection = MCPConnection(
+                qualified_name=request.qualified_name,
+                name=request.name,
+                config=request.config,
+                enabled_tools=request.enabled_tools,
+                provider=request.provider,
+                external_user_id=request.external_user_id,
+                tools=tools,
+                server=server
+            )
+            
+            self._connections[request.qualified_name] = connection
+            self._logger.info(f"Connected to {request.qualified_name} ({len(tools)} tools available)")
+            
+            return connection
                 
         except Exception as e:
             self._logger.error(f"Failed to connect to {request.qualified_name}: {str(e)}")
@@ -229,14 +226,14 @@ class MCPService:
         if not connection:
             raise MCPToolNotFoundError(f"Tool not found: {request.tool_name}")
         
-        if not connection.session:
+        if not connection.server:
             raise MCPToolExecutionError(f"No active session for tool: {request.tool_name}")
         
         if request.tool_name not in connection.enabled_tools:
             raise MCPToolExecutionError(f"Tool not enabled: {request.tool_name}")
         
         try:
-            result = await connection.session.call_tool(request.tool_name, request.arguments)
+            result = await mcp_session_pool.call_tool(connection.server, request.tool_name, request.arguments)
             
             self._logger.info(f"Tool {request.tool_name} executed successfully")
             
@@ -292,28 +289,26 @@ class MCPService:
             raise CustomMCPError("URL is required for HTTP MCP connections")
         
         try:
-            async with streamablehttp_client(url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    await session.initialize()
-                    tool_result = await session.list_tools()
-                    
-                    tools_info = []
-                    for tool in tool_result.tools:
-                        tools_info.append({
-                            "name": tool.name,
-                            "description": tool.description,
-                            "inputSchema": tool.inputSchema
-                        })
-                    
-                    return CustomMCPConnectionResult(
-                        success=True,
-                        qualified_name=f"custom_http_{url.split('/')[-1]}",
-                        display_name=f"Custom HTTP MCP ({url})",
-                        tools=tools_info,
-                        config=config,
-                        url=url,
-                        message=f"Connected via HTTP ({len(tools_info)} tools)"
-                    )
+            # Explicit discovery always refreshes the cached tool list agent runs use
+            tools = await mcp_tool_cache.list_tools(MCPServerSpec.http(url), refresh=True)
+            
+            tools_info = []
+            for tool in tools:
+                tools_info.append({
+                    "name": tool.name,
+                    "description": tool.description,
+                    "inputSchema": tool.inputSchema
+                })
+            
+            return CustomMCPConnectionResult(
+                success=True,
+                qualified_name=f"custom_http_{url.split('/')[-1]}",
+                display_name=f"Custom HTTP MCP ({url})",
+                tools=tools_info,
+                config=config,
+                url=url,
+                message=f"Connected via HTTP ({len(tools_info)} tools)"
+            )
         
         except Exception as e:
             self._logger.error(f"Error connecting to HTTP MCP server: {str(e)}")
@@ -333,28 +328,25 @@ class MCPService:
             raise CustomMCPError("URL is required for SSE MCP connections")
         
         try:
-            async with sse_client(url) as (read_stream, write_stream):
-                async with ClientSession(read_stream, write_stream) as session:
-                    await session.initialize()
-                    tool_result = await session.list_tools()
-                    
-                    tools_info = []
-                    for tool in tool_result.tools:
-                        tools_info.append({
-                            "name": tool.name,
-                            "description": tool.description,
-                            "inputSchema": tool.inputSchema
-                        })
-                    
-                    return CustomMCPConnectionResult(
-                        success=True,
-                        qualified_name=f"custom_sse_{url.split('/')[-1]}",
-                        display_name=f"Custom SSE MCP ({url})",
-                        tools=tools_info,
-                        config=config,
-                        url=url,
-                        message=f"Connected via SSE ({len(tools_info)} tools)"
-                    )
+            tools = await mcp_tool_cache.list_tools(MCPServerSpec.sse(url, config.get("headers")), refresh=True)
+            
+            tools_info = []
+            for tool in tools:
+                tools_info.append({
+                    "name": tool.name,
+                    "description": tool.description,
+                    "inputSchema": tool.inputSchema
+                })
+            
+            return CustomMCPConnectionResult(
+                success=True,
+                qualified_name=f"custom_sse_{url.split('/')[-1]}",
+                display_name=f"Custom SSE MCP ({url})",
+                tools=tools_info,
+                config=config,
+                url=url,
+                message=f"Connected via SSE ({len(tools_info)} tools)"
+            )
         
         except Exception as e:
             self._logger.error(f"Error connecting to SSE MCP server: {str(e)}")
@@ -0,0 +1,329 @@
+"""
+Pool of initialized MCP client sessions.
+
+Opening an MCP connection costs a transport handshake (or, for stdio, a new
+subprocess) plus ``ClientSession.initialize()``. The pool keeps sessions open
+per server (transport, URL or command, and credentials), so discovery and the
+tool calls of an agent turn share one handshake.
+
+Each session is owned by a background task that enters the transport and
+session context managers and holds them open until the session is evicted;
+anyio requires the same task to enter and exit them. Idle sessions are closed
+after ``MCP_SESSION_IDLE_TTL_SECONDS``, sessions idle for longer than
+``MCP_SESSION_HEALTH_CHECK_SECONDS`` are pinged before reuse. ``list_tools``
+is retried once on a fresh session after a transport failure; ``call_tool``
+only when the request could not be sent at all, since the server may already
+have run a side-effecting tool. Errors returned by the server are never retried.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import anyio
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.sse import sse_client
+from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+from mcp.shared.exceptions import McpError
+
+from utils.logger import logger
+
+MCP_SESSION_IDLE_TTL_SECONDS = 300
+MCP_SESSION_HEALTH_CHECK_SECONDS = 60
+MCP_SESSION_MAX_SESSIONS = 64
+MCP_SESSION_CONNECT_TIMEOUT_SECONDS = 15
+MCP_SESSION_CALL_TIMEOUT_SECONDS = 30
+
+
+@dataclass(frozen=True)
+class MCPServerSpec:
+    """How to reach one MCP server; two equal specs share a pooled session."""
+    transport: str  # "http", "sse" or "stdio"
+    url: Optional[str] = None
+    headers: Dict[str, str] = field(default_factory=dict, compare=False)
+    command: Optional[str] = None
+    args: List[str] = field(default_factory=list, compare=False)
+    env: Dict[str, str] = field(default_factory=dict, compare=False)
+
+    @classmethod
+    def http(cls, url: str, headers: Optional[Dict[str, str]] = None) -> "MCPServerSpec":
+        return cls(transport="http", url=url, headers=dict(headers or {}))
+
+    @classmethod
+    def sse(cls, url: str, headers: Optional[Dict[str, str]] = None) -> "MCPServerSpec":
+        return cls(transport="sse", url=url, headers=dict(headers or {}))
+
+    @classmethod
+    def stdio(cls, command: str, args: Optional[List[str]] = None, env: Optional[Dict[str, str]] = None) -> "MCPServerSpec":
+        return cls(transport="stdio", command=command, args=list(args or []), env=dict(env or {}))
+
+    @property
+    def key(self) -> str:
+        # Credentials are part of the key, so sessions are never shared across users
+        payload = json.dumps(
+            [self.transport, self.url, self.headers, self.command, self.args, self.env],
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @property
+    def label(self) -> str:
+        return self.url if self.transport != "stdio" else f"{self.command} {' '.join(self.args)}".strip()
+
+
+@asynccontextmanager
+async def open_session(spec: MCPServerSpec):
+    """Open a transport for ``spec`` and yield an initialized ClientSession."""
+    if spec.transport == "http":
+        async with streamablehttp_client(spec.url, headers=spec.headers or None) as (read, write, _):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                yield session
+    elif spec.transport == "sse":
+        try:
+            transport = sse_client(spec.url, headers=spec.headers)
+        except TypeError as e:
+            # Older clients don't accept headers
+            if "unexpected keyword argument" not in str(e):
+                raise
+            transport = sse_client(spec.url)
+        async with transport as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                yield session
+    elif spec.transport == "stdio":
+        server_params = StdioServerParameters(command=spec.command, args=spec.args, env=spec.env)
+        async with stdio_client(server_params) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                yield session
+    else:
+        raise ValueError(f"Unsupported MCP transport: {spec.transport}")
+
+
+class _PooledSession:
+    """One open session and the task that keeps its context managers entered."""
+
+    def __init__(self, spec: MCPServerSpec):
+        self.spec = spec
+        self.session: Optional[ClientSession] = None
+        self.error: Optional[BaseException] = None
+        self.ready = asyncio.Event()
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        # Taken out of the pool; closed once its last caller releases it
+        self.retired = False
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._hold())
+
+    async def _hold(self) -> None:
+        try:
+            async with open_session(self.spec) as session:
+                self.session = session
+                self.ready.set()
+                await self._stop.wait()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.session = None
+            self.ready.set()
+
+    @property
+    def alive(self) -> bool:
+        return not self._task.done() and not self._stop.is_set()
+
+    async def close(self) -> None:
+        self._stop.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=5)
+        except (asyncio.TimeoutError, Exception):
+            self._task.cancel()
+
+
+class MCPSessionPool:
+    """Keeps initialized MCP sessions alive and hands them out per server spec."""
+
+    def __init__(self, max_sessions: int = MCP_SESSION_MAX_SESSIONS, idle_ttl: float = MCP_SESSION_IDLE_TTL_SECONDS):
+        self._entries: Dict[str, _PooledSession] = {}
+        self._connect_locks: Dict[str, asyncio.Lock] = {}
+        self._max_sessions = max_sessions
+        self._idle_ttl = idle_ttl
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self.connects = 0
+        self.reuses = 0
+        self.reconnects = 0
+
+    def _check_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Sessions from another (finished) loop can't be used or closed from here
+            self._entries.clear()
+            self._connect_locks.clear()
+            self._loop = loop
+            self._reaper = None
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def _acquire(self, spec: MCPServerSpec, timeout: float) -> _PooledSession:
+        self._check_loop()
+        key = spec.key
+        lock = self._connect_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.alive and entry.session is not None:
+                if time.monotonic() - entry.last_used > MCP_SESSION_HEALTH_CHECK_SECONDS and not await self._healthy(entry, timeout):
+                    await self._retire(entry)
+                    entry = None
+                else:
+                    self.reuses += 1
+            elif entry is not None:
+                await self._retire(entry)
+                entry = None
+
+            if entry is None:
+                entry = await self._connect(spec, timeout)
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+            return entry
+
+    async def _connect(self, spec: MCPServerSpec, timeout: float) -> _PooledSession:
+        await self._make_room()
+        entry = _PooledSession(spec)
+        try:
+            await asyncio.wait_for(entry.ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            await entry.close()
+            raise TimeoutError(f"Timed out connecting to MCP server {spec.label}")
+        except asyncio.CancelledError:
+            # e.g. the discovery budget ran out; don't leave the holder task behind
+            await entry.close()
+            raise
+        if entry.session is None:
+            await entry.close()
+            raise ConnectionError(f"Failed to connect to MCP server {spec.label}: {entry.error}")
+        self._entries[spec.key] = entry
+        self.connects += 1
+        logger.debug(f"Opened pooled MCP session for {spec.label} ({len(self._entries)} open)")
+        return entry
+
+    async def _healthy(self, entry: _PooledSession, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(entry.session.send_ping(), timeout=min(timeout, 5))
+            return True
+        except Exception as e:
+            logger.info(f"Pooled MCP session for {entry.spec.label} failed health check: {str(e)}")
+            return False
+
+    async def _make_room(self) -> None:
+        while len(self._entries) >= self._max_sessions:
+            idle = [(e.last_used, k) for k, e in self._entries.items() if e.in_use == 0]
+            if not idle:
+                return
+            _, key = min(idle)
+            await self._evict(key)
+
+    async def _evict(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            await entry.close()
+
+    async def _retire(self, entry: _PooledSession) -> None:
+        """Take a session out of the pool without cutting off callers still using it."""
+        if self._entries.get(entry.spec.key) is entry:
+            self._entries.pop(entry.spec.key, None)
+        entry.retired = True
+        if entry.in_use == 0:
+            await entry.close()
+
+    async def _release(self, entry: _PooledSession) -> None:
+        entry.in_use -= 1
+        entry.last_used = time.monotonic()
+        if entry.retired and entry.in_use == 0:
+            await entry.close()
+
+    @staticmethod
+    def _retryable(error: Exception, idempotent: bool) -> bool:
+        if isinstance(error, McpError):
+            # The server received the request and answered it
+            return False
+        if idempotent:
+            return True
+        # Raised while writing to a closed transport, i.e. before the request left this process
+        return isinstance(error, (anyio.ClosedResourceError, anyio.BrokenResourceError))
+
+    async def _reap_idle(self) -> None:
+        while True:
+            await asyncio.sleep(max(self._idle_ttl / 4, 1))
+            now = time.monotonic()
+            for key, entry in list(self._entries.items()):
+                if entry.in_use == 0 and (now - entry.last_used > self._idle_ttl or not entry.alive):
+                    logger.debug(f"Closing idle MCP session for {entry.spec.label}")
+                    await self._evict(key)
+
+    async def _run(self, spec: MCPServerSpec, operation, connect_timeout: float, call_timeout: float, idempotent: bool):
+        for attempt in range(2):
+            entry = await self._acquire(spec, connect_timeout)
+            try:
+                async with asyncio.timeout(call_timeout):
+                    return await operation(entry.session)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                if attempt == 0 and self._retryable(e, idempotent):
+                    # The connection is gone; retry once on a fresh session
+                    logger.warning(f"MCP call to {spec.label} failed, reconnecting: {str(e)}")
+                    self.reconnects += 1
+                    await self._retire(entry)
+                    continue
+                raise
+            finally:
+                await self._release(entry)
+
+    async def call_tool(
+        self,
+        spec: MCPServerSpec,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        connect_timeout: float = MCP_SESSION_CONNECT_TIMEOUT_SECONDS,
+        call_timeout: float = MCP_SESSION_CALL_TIMEOUT_SECONDS,
+    ):
+        """Call a tool on the server, reusing a pooled session when one is open.
+
+        Not retried once the request may have reached the server, so side-effecting tools run at most once.
+        """
+        return await self._run(spec, lambda session: session.call_tool(tool_name, arguments), connect_timeout, call_timeout, idempotent=False)
+
+    async def list_tools(
+        self,
+        spec: MCPServerSpec,
+        connect_timeout: float = MCP_SESSION_CONNECT_TIMEOUT_SECONDS,
+        call_timeout: float = MCP_SESSION_CALL_TIMEOUT_SECONDS,
+    ):
+        """List the server's tools, leaving the session open for the calls that follow."""
+        result = await self._run(spec, lambda session: session.list_tools(), connect_timeout, call_timeout, idempotent=True)
+        return result.tools if hasattr(result, 'tools') else result
+
+    async def close_all(self) -> None:
+        for key in list(self._entries.keys()):
+            await self._evict(key)
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'open': len(self._entries),
+            'connects': self.connects,
+            'reuses': self.reuses,
+            'reconnects': self.reconnects,
+        }
+
+
+# Process-wide pool shared by discovery and tool execution
+mcp_session_pool = MCPSessionPool()
@@ -0,0 +1,100 @@
+"""
+Cross-run cache of MCP server tool lists.
+
+An agent run used to call ``list_tools()`` on every configured MCP server
+before its first LLM call. Tool lists rarely change, so they are cached in
+Redis under a hash of the server config for ``MCP_TOOL_CACHE_TTL_SECONDS``.
+On a hit no connection is opened at all; the pooled session is created lazily
+by the first tool call. Discovery endpoints pass ``refresh=True`` so a user
+re-checking a server always sees its current tools.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+from mcp.types import Tool
+
+from utils.cache import Cache
+from utils.config import config
+from utils.logger import logger
+from .session_pool import mcp_session_pool, MCPServerSpec, MCP_SESSION_CONNECT_TIMEOUT_SECONDS, MCP_SESSION_CALL_TIMEOUT_SECONDS
+
+
+def config_hash(spec: MCPServerSpec, ignore_headers: Iterable[str] = ()) -> str:
+    """Hash of the server config; ``ignore_headers`` drops short-lived tokens that don't change the tool list."""
+    ignored = {h.lower() for h in ignore_headers}
+    headers = {k: v for k, v in spec.headers.items() if k.lower() not in ignored}
+    payload = json.dumps(
+        [spec.transport, spec.url, headers, spec.command, spec.args, spec.env],
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _cache_key(spec: MCPServerSpec, ignore_headers: Iterable[str]) -> str:
+    return f"mcp_tools:{config_hash(spec, ignore_headers)}"
+
+
+class MCPToolListCache:
+    """Redis-backed tool lists in front of ``mcp_session_pool.list_tools``."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    async def list_tools(
+        self,
+        spec: MCPServerSpec,
+        refresh: bool = False,
+        ignore_headers: Iterable[str] = (),
+        connect_timeout: float = MCP_SESSION_CONNECT_TIMEOUT_SECONDS,
+        call_timeout: float = MCP_SESSION_CALL_TIMEOUT_SECONDS,
+    ) -> List[Tool]:
+        """Get the server's tools, from the cache unless ``refresh`` is set."""
+        key = _cache_key(spec, ignore_headers)
+
+        if not refresh:
+            cached = await self._get(key)
+            if cached is not None:
+                self.hits += 1
+                logger.debug(f"MCP tool list cache hit for {spec.label} ({len(cached)} tools)")
+                return cached
+
+        self.misses += 1
+        tools = await mcp_session_pool.list_tools(spec, connect_timeout=connect_timeout, call_timeout=call_timeout) or []
+        await self._set(key, tools)
+        return tools
+
+    async def invalidate(self, spec: MCPServerSpec, ignore_headers: Iterable[str] = ()) -> None:
+        try:
+            await Cache.invalidate(_cache_key(spec, ignore_headers))
+        except Exception as e:
+            logger.warning(f"Failed to invalidate MCP tool list for {spec.label}: {str(e)}")
+
+    async def _get(self, key: str) -> Optional[List[Tool]]:
+        try:
+            cached = await Cache.get(key)
+        except Exception as e:
+            logger.warning(f"Failed to read MCP tool list cache: {str(e)}")
+            return None
+        if cached is None:
+            return None
+        try:
+            return [Tool.model_validate(tool) for tool in cached]
+        except Exception as e:
+            logger.warning(f"Discarding unreadable MCP tool list cache entry: {str(e)}")
+            return None
+
+    async def _set(self, key: str, tools: List[Tool]) -> None:
+        payload: List[Dict[str, Any]] = [tool.model_dump(mode='json', exclude_none=True) for tool in tools]
+        try:
+            await Cache.set(key, payload, ttl=config.MCP_TOOL_CACHE_TTL_SECONDS)
+        except Exception as e:
+            logger.warning(f"Failed to write MCP tool list cache: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+mcp_tool_cache = MCPToolListCache()
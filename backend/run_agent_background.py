@@ -3,7 +3,6 @@ dotenv.load_dotenv(".env")
 
 import sentry
 import asyncio
-import json
 import traceback
 from datetime import datetime, timezone
 from typing import Optional
@@ -13,6 +12,13 @@ from utils.logger import logger, structlog
 import dramatiq
 import uuid
 from agentpress.thread_manager import ThreadManager
+from agentpress.message_writer import status_message_writer
+from agent import response_transport
+from agent.response_transport import ResponseWriter
+from agent.chunk_coalescer import ChunkCoalescer
+from agent.run_scheduler import run_scheduler, RunQueueFull
+from agent.run_control import run_control_listener
+from agent.active_runs import active_run_registry
 from services.supabase import DBConnection
 from services import redis
 from dramatiq.brokers.redis import RedisBroker
@@ -44,6 +50,7 @@ async def initialize():
     await db.initialize()
 
     _initialized = True
+    run_scheduler.start(dispatch_agent_runs.send)
     logger.info(f"Initialized agent API with instance ID: {instance_id}")
 
 @dramatiq.actor
@@ -69,6 +76,68 @@ async def run_agent_background(
     request_id: Optional[str] = None,
 ):
     """Run the agent in the background using Redis for state."""
+    await execute_agent_run(
+        agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
+        project_id=project_id, model_name=model_name,
+        enable_thinking=enable_thinking, reasoning_effort=reasoning_effort,
+        stream=stream, enable_context_manager=enable_context_manager,
+        agent_config=agent_config, is_agent_builder=is_agent_builder,
+        target_agent_id=target_agent_id, request_id=request_id,
+    )
+
+@dramatiq.actor
+async def dispatch_agent_runs():
+    """Admit queued agent runs while this worker has free slots (see agent/run_scheduler.py)."""
+    structlog.contextvars.clear_contextvars()
+    try:
+        await initialize()
+    except Exception as e:
+        logger.critical(f"Failed to initialize Redis connection: {e}")
+        raise e
+
+    await run_scheduler.drain(lambda run_kwargs: execute_agent_run(**run_kwargs))
+
+async def enqueue_agent_run(account_id: str, lane: str, **run_kwargs) -> Optional[int]:
+    """Hand an agent run to the workers.
+
+    With the scheduler enabled the run waits in its lane until a worker admits
+    it; otherwise it is sent straight to ``run_agent_background``.
+
+    Returns:
+        The run's queue position, or None when the scheduler is disabled
+
+    Raises:
+        RunQueueFull: if the account may not queue more runs; the run is marked failed
+    """
+    if not run_scheduler.enabled:
+        run_agent_background.send(**run_kwargs)
+        return None
+    agent_run_id = run_kwargs['agent_run_id']
+    try:
+        position = await run_scheduler.submit(agent_run_id, account_id, lane, run_kwargs)
+    except RunQueueFull as e:
+        await update_agent_run_status(await db.client, agent_run_id, "failed", error=str(e))
+        await _cleanup_active_run(agent_run_id)
+        raise
+    dispatch_agent_runs.send()
+    return position
+
+async def execute_agent_run(
+    agent_run_id: str,
+    thread_id: str,
+    instance_id: str,
+    project_id: str,
+    model_name: str,
+    enable_thinking: Optional[bool],
+    reasoning_effort: Optional[str],
+    stream: bool,
+    enable_context_manager: bool,
+    agent_config: Optional[dict] = None,
+    is_agent_builder: Optional[bool] = False,
+    target_agent_id: Optional[str] = None,
+    request_id: Optional[str] = None,
+):
+    """Execute one agent run in this worker, writing its responses to Redis."""
     structlog.contextvars.clear_contextvars()
     structlog.contextvars.bind_contextvars(
         agent_run_id=agent_run_id,
@@ -121,56 +190,24 @@ async def run_agent_background(
     client = await db.client
     start_time = datetime.now(timezone.utc)
     total_responses = 0
-    pubsub = None
-    stop_checker = None
-    stop_signal_received = False
+    stop_signal = None
 
     # Define Redis keys and channels
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
-    instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id}"
+    response_writer = ResponseWriter(agent_run_id)
+    coalescer = ChunkCoalescer(response_writer.append)
     global_control_channel = f"agent_run:{agent_run_id}:control"
-    instance_active_key = f"active_run:{instance_id}:{agent_run_id}"
-
-    async def check_for_stop_signal():
-        nonlocal stop_signal_received
-        if not pubsub: return
-        try:
-            while not stop_signal_received:
-                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
-                if message and message.get("type") == "message":
-                    data = message.get("data")
-                    if isinstance(data, bytes): data = data.decode('utf-8')
-                    if data == "STOP":
-                        logger.info(f"Received STOP signal for agent run {agent_run_id} (Instance: {instance_id})")
-                        stop_signal_received = True
-                        break
-                # Periodically refresh the active run key TTL
-                if total_responses % 50 == 0: # Refresh every 50 responses or so
-                    try: await redis.expire(instance_active_key, redis.REDIS_KEY_TTL)
-                    except Exception as ttl_err: logger.warning(f"Failed to refresh TTL for {instance_active_key}: {ttl_err}")
-                await asyncio.sleep(0.1) # Short sleep to prevent tight loop
-        except asyncio.CancelledError:
-            logger.info(f"Stop signal checker cancelled for {agent_run_id} (Instance: {instance_id})")
-        except Exception as e:
-            logger.error(f"Error in stop signal checker for {agent_run_id}: {e}", exc_info=True)
-            stop_signal_received = True # Stop the run if the checker fails
 
     trace = langfuse.trace(name="agent_run", id=agent_run_id, session_id=thread_id, metadata={"project_id": project_id, "instance_id": instance_id})
     try:
-        # Setup Pub/Sub listener for control signals
-        pubsub = await redis.create_pubsub()
+        # STOP on either control channel reaches this run through the process-wide listener
         try:
-            await retry(lambda: pubsub.subscribe(instance_control_channel, global_control_channel))
+            stop_signal = await run_control_listener.register(agent_run_id)
         except Exception as e:
             logger.error(f"Redis failed to subscribe to control channels: {e}", exc_info=True)
             raise e
 
-        logger.debug(f"Subscribed to control channels: {instance_control_channel}, {global_control_channel}")
-        stop_checker = asyncio.create_task(check_for_stop_signal())
-
-        # Ensure active run key exists and has TTL
-        await redis.set(instance_active_key, "running", ex=redis.REDIS_KEY_TTL)
+        # Register the run as ours; its lease is renewed until the run finishes
+        await active_run_registry.start(agent_run_id, instance_id)
 
 
         # Initialize agent generator
@@ -188,19 +225,15 @@ async def run_agent_background(
         final_status = "running"
         error_message = None
 
-        pending_redis_operations = []
-
         async for response in agent_gen:
-            if stop_signal_received:
+            if stop_signal.is_set():
                 logger.info(f"Agent run {agent_run_id} stopped by signal.")
                 final_status = "stopped"
                 trace.span(name="agent_run_stopped").end(status_message="agent_run_stopped", level="WARNING")
                 break
 
-            # Store response in Redis list and publish notification
-            response_json = json.dumps(response)
-            pending_redis_operations.append(asyncio.create_task(redis.rpush(response_list_key, response_json)))
-            pending_redis_operations.append(asyncio.create_task(redis.publish(response_channel, "new")))
+            # Assistant deltas are merged into frames; everything else goes straight to the writer
+            coalescer.add(response)
             total_responses += 1
 
             # Check for agent-signaled completion or error
@@ -220,12 +253,14 @@ async def run_agent_background(
              logger.info(f"Agent run {agent_run_id} completed normally (duration: {duration:.2f}s, responses: {total_responses})")
              completion_message = {"type": "status", "status": "completed", "message": "Agent run completed successfully"}
              trace.span(name="agent_run_completed").end(status_message="agent_run_completed")
-             await redis.rpush(response_list_key, json.dumps(completion_message))
-             await redis.publish(response_channel, "new") # Notify about the completion message
+             coalescer.add(completion_message)
+
+        # Everything must be in Redis before the end-of-stream signal goes out
+        coalescer.close()
+        await response_writer.close()
 
-        # Fetch final responses from Redis for DB update
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
+        # Make sure buffered status messages are persisted before the run is marked done
+        await status_message_writer.flush()
 
         # Update DB status
         await update_agent_run_status(client, agent_run_id, final_status, error=error_message)
@@ -233,7 +268,7 @@ async def run_agent_background(
         # Publish final control signal (END_STREAM or ERROR)
         control_signal = "END_STREAM" if final_status == "completed" else "ERROR" if final_status == "failed" else "STOP"
         try:
-            await redis.publish(global_control_channel, control_signal)
+            await response_transport.publish_control(agent_run_id, control_signal)
             # No need to publish to instance channel as the run is ending on this instance
             logger.debug(f"Published final control signal '{control_signal}' to {global_control_channel}")
         except Exception as e:
@@ -247,79 +282,61 @@ async def run_agent_background(
         final_status = "failed"
         trace.span(name="agent_run_failed").end(status_message=error_message, level="ERROR")
 
-        # Push error message to Redis list
+        # Push error message after whatever was already queued
         error_response = {"type": "status", "status": "error", "message": error_message}
         try:
-            await redis.rpush(response_list_key, json.dumps(error_response))
-            await redis.publish(response_channel, "new")
+            coalescer.close()
+            error_writer = response_writer if not response_writer.closed else ResponseWriter(agent_run_id)
+            error_writer.append(error_response)
+            await error_writer.close()
         except Exception as redis_err:
              logger.error(f"Failed to push error response to Redis for {agent_run_id}: {redis_err}")
 
-        # Fetch final responses (including the error)
-        all_responses = []
         try:
-             all_responses_json = await redis.lrange(response_list_key, 0, -1)
-             all_responses = [json.loads(r) for r in all_responses_json]
-        except Exception as fetch_err:
-             logger.error(f"Failed to fetch responses from Redis after error for {agent_run_id}: {fetch_err}")
-             all_responses = [error_response] # Use the error message we tried to push
+            await status_message_writer.flush()
+        except Exception as flush_err:
+            logger.error(f"Failed to flush buffered messages for {agent_run_id}: {flush_err}")
 
         # Update DB status
         await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}")
 
         # Publish ERROR signal
         try:
-            await redis.publish(global_control_channel, "ERROR")
+            await response_transport.publish_control(agent_run_id, "ERROR")
             logger.debug(f"Published ERROR signal to {global_control_channel}")
         except Exception as e:
             logger.warning(f"Failed to publish ERROR signal: {str(e)}")
 
     finally:
-        # Cleanup stop checker task
-        if stop_checker and not stop_checker.done():
-            stop_checker.cancel()
-            try: await stop_checker
-            except asyncio.CancelledError: pass
-            except Exception as e: logger.warning(f"Error during stop_checker cancellation: {e}")
-
-        # Close pubsub connection
-        if pubsub:
-            try:
-                await pubsub.unsubscribe()
-                await pubsub.close()
-                logger.debug(f"Closed pubsub connection for {agent_run_id}")
-            except Exception as e:
-                logger.warning(f"Error closing pubsub for {agent_run_id}: {str(e)}")
+        run_control_listener.unregister(agent_run_id)
 
         # Set TTL on the response list in Redis
         await _cleanup_redis_response_list(agent_run_id)
 
-        # Remove the instance-specific active run key
-        await _cleanup_redis_instance_key(agent_run_id)
+        # Remove the run from the active run registry
+        await _cleanup_active_run(agent_run_id)
 
         # Clean up the run lock
         await _cleanup_redis_run_lock(agent_run_id)
 
-        # Wait for all pending redis operations to complete, with timeout
+        # Wait for queued responses to be written, with timeout
+        if not response_writer.closed:
+            coalescer.close()
         try:
-            await asyncio.wait_for(asyncio.gather(*pending_redis_operations), timeout=30.0)
+            await asyncio.wait_for(response_writer.close(), timeout=30.0)
         except asyncio.TimeoutError:
             logger.warning(f"Timeout waiting for pending Redis operations for {agent_run_id}")
 
         logger.info(f"Agent run background task fully completed for: {agent_run_id} (Instance: {instance_id}) with final status: {final_status}")
 
-async def _cleanup_redis_instance_key(agent_run_id: str):
-    """Clean up the instance-specific Redis key for an agent run."""
-    if not instance_id:
-        logger.warning("Instance ID not set, cannot clean up instance key.")
-        return
-    key = f"active_run:{instance_id}:{agent_run_id}"
-    logger.debug(f"Cleaning up Redis instance key: {key}")
+async def _cleanup_active_run(agent_run_id: str):
+    """Remove an agent run from the active run registry."""
+    logger.debug(f"Removing agent run {agent_run_id} from the active run registry")
     try:
-        await redis.delete(key)
-        logger.debug(f"Successfully cleaned up Redis key: {key}")
+        owner_instance_id = await active_run_registry.finish(agent_run_id)
+        logger.debug(f"Removed agent run {agent_run_id} (instance {owner_instance_id}) from the active run registry")
     except Exception as e:
-        logger.warning(f"Failed to clean up Redis key {key}: {str(e)}")
+        logger.warning(f"Failed to remove agent run {agent_run_id} from the active run registry: {str(e)}")
 
 async def _cleanup_redis_run_lock(agent_run_id: str):
     """Clean up the run lock Redis key for an agent run."""
@@ -335,13 +352,12 @@ async def _cleanup_redis_run_lock(agent_run_id: str):
 REDIS_RESPONSE_LIST_TTL = 3600 * 24
 
 async def _cleanup_redis_response_list(agent_run_id: str):
-    """Set TTL on the Redis response list."""
-    response_list_key = f"agent_run:{agent_run_id}:responses"
+    """Set TTL on the run's stored responses."""
     try:
-        await redis.expire(response_list_key, REDIS_RESPONSE_LIST_TTL)
-        logger.debug(f"Set TTL ({REDIS_RESPONSE_LIST_TTL}s) on response list: {response_list_key}")
+        await response_transport.expire(agent_run_id, REDIS_RESPONSE_LIST_TTL)
+        logger.debug(f"Set TTL ({REDIS_RESPONSE_LIST_TTL}s) on responses of {agent_run_id}")
     except Exception as e:
-        logger.warning(f"Failed to set TTL on response list {response_list_key}: {str(e)}")
+        logger.warning(f"Failed to set TTL on responses of {agent_run_id}: {str(e)}")
 
 async def update_agent_run_status(
     client,
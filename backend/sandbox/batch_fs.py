@@ -0,0 +1,147 @@
+"""
+Batched file operations against a sandbox.
+
+Each Daytona filesystem call is one HTTP round trip, so writing or reading
+many files one by one is dominated by latency. These helpers move a whole set
+of files in a single tar archive:
+
+- ``write_files``: one upload of a tar.gz plus one ``tar -x`` (parent
+  directories and permissions come with the archive)
+- ``read_files``: one ``tar -c``, one download and one cleanup, whatever the
+  number of files
+- ``stat_files`` / ``delete_files``: one command each
+
+``download_files`` is the bounded-concurrency alternative for callers that
+want each file as soon as it arrives.
+"""
+
+import asyncio
+import io
+import shlex
+import tarfile
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Union
+from uuid import uuid4
+
+from daytona_sdk import AsyncSandbox
+
+from utils.logger import logger
+
+BATCH_TMP_DIR = "/tmp"
+DOWNLOAD_CONCURRENCY = 8
+
+
+@dataclass
+class FileStat:
+    path: str
+    size: int
+    modified: int
+    is_dir: bool
+
+
+def _exec_output(response) -> str:
+    return getattr(response, 'result', None) or ''
+
+
+async def stat_files(sandbox: AsyncSandbox, paths: Iterable[str]) -> Dict[str, Optional[FileStat]]:
+    """Stat many paths in one command; missing paths map to None."""
+    paths = list(paths)
+    if not paths:
+        return {}
+    quoted = " ".join(shlex.quote(p) for p in paths)
+    response = await sandbox.process.exec(f"stat -c '%s|%Y|%F|%n' -- {quoted} 2>/dev/null; true", timeout=30)
+    stats: Dict[str, Optional[FileStat]] = {p: None for p in paths}
+    for line in _exec_output(response).splitlines():
+        parts = line.split('|', 3)
+        if len(parts) != 4 or parts[3] not in stats:
+            continue
+        size, modified, kind, path = parts
+        stats[path] = FileStat(path=path, size=int(size), modified=int(modified), is_dir=kind == 'directory')
+    return stats
+
+
+async def write_files(sandbox: AsyncSandbox, files: Dict[str, Union[str, bytes]], permissions: str = "644") -> None:
+    """Write many files (absolute paths) with one archive upload and one extract."""
+    if not files:
+        return
+    mode = int(permissions, 8)
+    now = int(time.time())
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for path, content in files.items():
+            data = content.encode() if isinstance(content, str) else content
+            info = tarfile.TarInfo(name=path.lstrip('/'))
+            info.size = len(data)
+            info.mode = mode
+            info.mtime = now
+            archive.addfile(info, io.BytesIO(data))
+
+    archive_path = f"{BATCH_TMP_DIR}/batch_write_{uuid4().hex}.tar.gz"
+    await sandbox.fs.upload_file(buffer.getvalue(), archive_path)
+    response = await sandbox.process.exec(
+        f"/bin/sh -c 'tar -xzf {archive_path} -C / --no-same-owner; status=$?; rm -f {archive_path}; exit $status'",
+        timeout=60,
+    )
+    if getattr(response, 'exit_code', 0) != 0:
+        raise RuntimeError(f"Failed to extract {len(files)} files: {_exec_output(response).strip()}")
+    logger.debug(f"Wrote {len(files)} files ({len(buffer.getvalue())} bytes compressed) in one batch")
+
+
+async def read_files(sandbox: AsyncSandbox, paths: Iterable[str]) -> Dict[str, bytes]:
+    """Read many files (absolute paths) through one archive; unreadable files are left out."""
+    paths = list(paths)
+    if not paths:
+        return {}
+    archive_path = f"{BATCH_TMP_DIR}/batch_read_{uuid4().hex}.tar.gz"
+    quoted = " ".join(shlex.quote(p.lstrip('/')) for p in paths)
+    await sandbox.process.exec(
+        f"tar -czf {archive_path} -C / --ignore-failed-read -- {quoted} 2>/dev/null; true",
+        timeout=60,
+    )
+    try:
+        data = await sandbox.fs.download_file(archive_path)
+    finally:
+        try:
+            await sandbox.process.exec(f"rm -f {archive_path}", timeout=10)
+        except Exception as e:
+            logger.warning(f"Failed to remove {archive_path}: {str(e)}")
+
+    contents: Dict[str, bytes] = {}
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as archive:
+        for member in archive.getmembers():
+            if not member.isfile():
+                continue
+            extracted = archive.extractfile(member)
+            if extracted is not None:
+                contents[f"/{member.name}"] = extracted.read()
+    return contents
+
+
+async def delete_files(sandbox: AsyncSandbox, paths: Iterable[str]) -> None:
+    """Delete many files in one command."""
+    paths = list(paths)
+    if not paths:
+        return
+    quoted = " ".join(shlex.quote(p) for p in paths)
+    await sandbox.process.exec(f"rm -f -- {quoted}", timeout=30)
+
+
+async def download_files(
+    sandbox: AsyncSandbox,
+    paths: Iterable[str],
+    concurrency: int = DOWNLOAD_CONCURRENCY,
+) -> Dict[str, bytes]:
+    """Download files individually, at most ``concurrency`` at a time; failed downloads are skipped."""
+    semaphore = asyncio.Semaphore(concurrency)
+    contents: Dict[str, bytes] = {}
+
+    async def download(path: str) -> None:
+        async with semaphore:
+            try:
+                contents[path] = await sandbox.fs.download_file(path)
+            except Exception as e:
+                logger.warning(f"Error reading file {path}: {str(e)}")
+
+    await asyncio.gather(*[download(path) for path in paths])
+    return contents
@@ -0,0 +1,135 @@
+"""
+Direct HTTP channel to the browser automation API inside a sandbox.
+
+Browser actions used to run ``curl`` through ``sandbox.process.exec`` and get
+back JSON with the screenshot embedded as base64, which the browser tool then
+validated, decoded and re-uploaded. The channel instead calls the API through
+the sandbox's preview link on port 8003, over one pooled ``httpx`` client per
+process:
+
+- Actions are sent with ``X-Screenshot-Transport: binary``, so the JSON result
+  only carries ``screenshot_hash``.
+- The screenshot is then streamed from ``/automation/screenshot/{hash}`` as raw
+  JPEG bytes, checked (content type, JPEG signature, size limit) chunk by chunk
+  while it arrives, and uploaded to object storage as is.
+
+Callers fall back to the exec path on ``BrowserChannelUnavailable``, which is
+only raised when the action cannot have reached the browser API (no preview
+link or a connection failure). Anything else, including a proxy error such as a
+502/504 for a slow action, is returned as a failed result and not retried,
+since the action may already have run.
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from daytona_sdk import AsyncSandbox
+
+BROWSER_API_PORT = 8003
+PREVIEW_LINK_TTL_SECONDS = 600
+ACTION_TIMEOUT_SECONDS = 60
+MAX_SCREENSHOT_BYTES = 10 * 1024 * 1024
+JPEG_SIGNATURE = b"\xff\xd8\xff"
+
+
+class ScreenshotValidationError(Exception):
+    pass
+
+
+class BrowserChannelUnavailable(Exception):
+    """The request never reached the browser API, so it is safe to retry another way."""
+
+
+class BrowserChannel:
+    """Pooled HTTP access to sandbox browser APIs."""
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._links: Dict[str, Tuple[float, str, Optional[str]]] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        # Pooled connections belong to the loop that opened them
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(ACTION_TIMEOUT_SECONDS, connect=10.0),
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            )
+            self._loop = loop
+        return self._client
+
+    async def _base_url(self, sandbox: AsyncSandbox) -> Tuple[str, Dict[str, str]]:
+        entry = self._links.get(sandbox.id)
+        if entry is None or time.monotonic() - entry[0] > PREVIEW_LINK_TTL_SECONDS:
+            try:
+                link = await sandbox.get_preview_link(BROWSER_API_PORT)
+                url = link.url if hasattr(link, 'url') else str(link).split("url='")[1].split("'")[0]
+            except Exception as e:
+                raise BrowserChannelUnavailable(f"No preview link for port {BROWSER_API_PORT}: {str(e)}") from e
+            entry = (time.monotonic(), url.rstrip('/'), getattr(link, 'token', None))
+            self._links[sandbox.id] = entry
+        _, url, token = entry
+        headers = {"X-Daytona-Preview-Token": token} if token else {}
+        return url, headers
+
+    def invalidate(self, sandbox_id: str) -> None:
+        self._links.pop(sandbox_id, None)
+
+    async def call(self, sandbox: AsyncSandbox, endpoint: str, params: Optional[dict] = None, method: str = "POST") -> Dict[str, Any]:
+        """Run a browser action and return its JSON result (without inline screenshot)."""
+        base_url, headers = await self._base_url(sandbox)
+        headers["X-Screenshot-Transport"] = "binary"
+        url = f"{base_url}/api/automation/{endpoint}"
+        client = self._get_client()
+        try:
+            if method == "GET":
+                response = await client.get(url, params=params, headers=headers)
+            else:
+                response = await client.request(method, url, json=params or {}, headers=headers)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            self.invalidate(sandbox.id)
+            raise BrowserChannelUnavailable(f"Cannot connect to browser API: {str(e)}") from e
+
+        # Like curl before, error responses from the API itself are returned as results
+        if "application/json" not in response.headers.get("content-type", ""):
+            # A proxy answered instead of the API; the request may still have reached it
+            self.invalidate(sandbox.id)
+            message = f"Browser API did not answer through the preview link (HTTP {response.status_code})"
+            return {"success": False, "message": message, "error": message}
+        return response.json()
+
+    async def fetch_screenshot(self, sandbox: AsyncSandbox, screenshot_hash: str) -> bytes:
+        """Stream a screenshot's raw bytes, validating them as they arrive."""
+        base_url, headers = await self._base_url(sandbox)
+        url = f"{base_url}/api/automation/screenshot/{screenshot_hash}"
+        async with self._get_client().stream("GET", url, headers=headers) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("content-type", "")
+            if not content_type.startswith("image/jpeg"):
+                raise ScreenshotValidationError(f"Unexpected screenshot content type: {content_type}")
+            declared = int(response.headers.get("content-length") or 0)
+            if declared > MAX_SCREENSHOT_BYTES:
+                raise ScreenshotValidationError(f"Screenshot too large: {declared} bytes")
+
+            data = bytearray()
+            async for chunk in response.aiter_bytes():
+                data.extend(chunk)
+                if len(data) >= len(JPEG_SIGNATURE) and not data.startswith(JPEG_SIGNATURE):
+                    raise ScreenshotValidationError("Screenshot is not a JPEG image")
+                if len(data) > MAX_SCREENSHOT_BYTES:
+                    raise ScreenshotValidationError(f"Screenshot larger than {MAX_SCREENSHOT_BYTES} bytes")
+
+        if len(data) < 100:
+            raise ScreenshotValidationError(f"Screenshot too small: {len(data)} bytes")
+        return bytes(data)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+browser_channel = BrowserChannel()
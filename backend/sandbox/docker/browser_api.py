@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Body
+from fastapi import FastAPI, APIRouter, HTTPException, Body, Depends, Header, Response
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
@@ -6,7 +6,7 @@ import asyncio
 import json
 import logging
 import base64
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from datetime import datetime
 import os
 import random
@@ -15,6 +15,174 @@ import traceback
 import pytesseract
 from PIL import Image
 import io
+import hashlib
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+
+#######################################################
+# Screenshot and OCR pipeline settings
+#######################################################
+
+# OCR runs on every action (the agent reads ocr_text from action results); when disabled it is
+# only computed on request (/automation/ocr). Either way it runs off the loop and is cached by hash.
+EAGER_OCR = os.getenv("BROWSER_EAGER_OCR", "true").lower() == "true"
+OCR_CACHE_SIZE = 64
+# Screenshots kept by hash so OCR can be requested for a recent one
+SCREENSHOT_HISTORY_SIZE = 8
+# An unchanged page reuses its last screenshot for at most this long
+SCREENSHOT_MAX_REUSE_SECONDS = 15
+
+# Image decoding and tesseract run here so they never block the event loop
+image_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="browser-image")
+
+# "binary": action results carry only screenshot_hash, and the image is fetched raw from
+# /automation/screenshot/{hash}; "inline" (default): results embed screenshot_base64
+screenshot_transport: ContextVar[str] = ContextVar("screenshot_transport", default="inline")
+
+
+async def read_screenshot_transport(x_screenshot_transport: Optional[str] = Header(None)):
+    # An async dependency runs in the request's task, so the value is visible to the handler
+    screenshot_transport.set("binary" if x_screenshot_transport == "binary" else "inline")
+
+# Installed in every document: counts DOM mutations and user input, so an unchanged page can be detected cheaply
+PAGE_VERSION_SCRIPT = """
+(() => {
+    if (window.__heliumPageVersion !== undefined) return;
+    window.__heliumPageVersion = 0;
+    const bump = () => { window.__heliumPageVersion++; };
+    new MutationObserver(bump).observe(document, {
+        subtree: true, childList: true, attributes: true, characterData: true
+    });
+    for (const type of ['input', 'change', 'focusin', 'focusout', 'scroll']) {
+        document.addEventListener(type, bump, true);
+    }
+})();
+"""
+
+# Everything that decides whether the viewport can look different from the last screenshot
+PAGE_SIGNATURE_SCRIPT = """
+() => ({
+    url: location.href,
+    version: window.__heliumPageVersion === undefined ? null : window.__heliumPageVersion,
+    scroll: [window.scrollX, window.scrollY],
+    viewport: [window.innerWidth, window.innerHeight, window.devicePixelRatio],
+    volatile: !!document.querySelector('canvas, video') ||
+        document.getAnimations().some(a => a.playState === 'running')
+})
+"""
+
+
+# Incremental extraction of interactive elements. The first call in a document installs a
+# MutationObserver that records changed nodes and their ancestors; later calls re-read attributes
+# and text only for elements in that dirty set, skip the scan entirely when nothing changed, and
+# return full records only for elements that are new or whose content or position may have changed.
+# Layout can also change without mutations (images and fonts loading, transitions, resizes), so
+# those mark the layout dirty too; clicks resolve elements by their stable ID, not by position.
+DOM_SNAPSHOT_SCRIPT = """
+(full) => {
+    const SELECTOR = 'a, button, input, select, textarea, [role="button"], [role="link"], [role="checkbox"], [role="radio"], [tabindex]:not([tabindex="-1"])';
+    let t = window.__heliumDom;
+    if (!t) {
+        t = window.__heliumDom = {
+            docId: Math.random().toString(36).slice(2),
+            ids: new WeakMap(),
+            nextId: 1,
+            records: new Map(),
+            dirty: new Set(),
+            layoutDirty: true,
+            collected: false
+        };
+        const markDirty = (node) => {
+            t.layoutDirty = true;
+            if (node && node.nodeType !== Node.ELEMENT_NODE) node = node.parentNode;
+            while (node && !t.dirty.has(node)) {
+                t.dirty.add(node);
+                node = node.parentNode;
+            }
+        };
+        new MutationObserver(mutations => {
+            for (const m of mutations) markDirty(m.target);
+        }).observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+        // Typing changes an input's value without any DOM mutation
+        for (const type of ['input', 'change']) {
+            document.addEventListener(type, e => markDirty(e.target), true);
+        }
+        // Size and visibility can change without any mutation
+        const markLayoutDirty = () => { t.layoutDirty = true; };
+        window.addEventListener('resize', markLayoutDirty);
+        for (const type of ['load', 'error', 'transitionend', 'animationend']) {
+            document.addEventListener(type, markLayoutDirty, true);
+        }
+        if (document.fonts) document.fonts.addEventListener('loadingdone', markLayoutDirty);
+        if (window.ResizeObserver) {
+            const observeRoot = () => {
+                if (document.body) new ResizeObserver(markLayoutDirty).observe(document.body);
+            };
+            if (document.body) observeRoot(); else document.addEventListener('DOMContentLoaded', observeRoot);
+        }
+    }
+
+    full = full || !t.collected;
+    const viewport = {scrollX: window.scrollX, scrollY: window.scrollY, width: window.innerWidth, height: window.innerHeight};
+    const animating = document.getAnimations().some(a => a.playState === 'running');
+    if (!full && !t.layoutDirty && !animating) {
+        return {docId: t.docId, full: false, unchanged: true, ...viewport};
+    }
+
+    const next = new Map();
+    const order = [];
+    const changed = [];
+    for (const el of document.querySelectorAll(SELECTOR)) {
+        const style = window.getComputedStyle(el);
+        const rect = el.getBoundingClientRect();
+        if (style.display === 'none' || style.visibility === 'hidden' || style.opacity === '0' ||
+            rect.width <= 0 || rect.height <= 0) {
+            continue;
+        }
+        let id = t.ids.get(el);
+        if (id === undefined) {
+            id = t.nextId++;
+            t.ids.set(el, id);
+        }
+        const page = [rect.left + window.scrollX, rect.top + window.scrollY, rect.width, rect.height];
+        const previous = t.records.get(id);
+        let record;
+        if (full || !previous || t.dirty.has(el)) {
+            const attributes = {};
+            for (const attr of el.attributes) attributes[attr.name] = attr.value;
+            record = {id, tagName: el.tagName.toLowerCase(), text: el.innerText || el.value || '', attributes, page};
+            changed.push(record);
+        } else {
+            record = {...previous, page};
+            if (page.some((v, i) => v !== previous.page[i])) changed.push(record);
+        }
+        next.set(id, record);
+        order.push(id);
+    }
+    const removed = [...t.records.keys()].filter(id => !next.has(id));
+    t.records = next;
+    t.dirty.clear();
+    t.layoutDirty = false;
+    t.collected = true;
+    return {docId: t.docId, full, unchanged: false, order, changed, removed, ...viewport};
+}
+"""
+
+# Attributes reported for each interactive element
+ELEMENT_INFO_ATTRIBUTES = ['id', 'href', 'src', 'alt', 'placeholder', 'name', 'role', 'title', 'type']
+# Elements listed per category in a diff; the full list is always in interactive_elements
+MAX_DIFF_ELEMENTS = 50
+
+
+def _encode_screenshot(screenshot_bytes: bytes) -> tuple:
+    return base64.b64encode(screenshot_bytes).decode('utf-8'), hashlib.sha256(screenshot_bytes).hexdigest()
+
+
+def _run_ocr(screenshot_base64: str) -> str:
+    image = Image.open(io.BytesIO(base64.b64decode(screenshot_base64)))
+    return pytesseract.image_to_string(image).strip()
 
 #######################################################
 # Action model definitions
@@ -75,6 +243,9 @@ class DoneAction(BaseModel):
     success: bool = True
     text: str = ""
 
+class OCRAction(BaseModel):
+    screenshot_hash: Optional[str] = None  # Defaults to the latest screenshot
+
 #######################################################
 # DOM Structure Models
 #######################################################
@@ -130,6 +301,7 @@ class DOMElementNode(DOMBaseNode):
     is_in_viewport: bool = False
     shadow_root: bool = False
     highlight_index: Optional[int] = None
+    snapshot_id: Optional[int] = None  # Stable ID assigned by DOM_SNAPSHOT_SCRIPT
     viewport_coordinates: Optional[CoordinateSet] = None
     page_coordinates: Optional[CoordinateSet] = None
     viewport_info: Optional[ViewportInfo] = None
@@ -246,6 +418,104 @@ class DOMState:
     pixels_above: int = 0
     pixels_below: int = 0
 
+def element_info(index: int, element: DOMElementNode) -> Dict[str, Any]:
+    """Simplified description of an interactive element"""
+    info = {
+        'index': index,
+        'tag_name': element.tag_name,
+        'text': element.get_all_text_till_next_clickable_element(),
+        'is_in_viewport': element.is_in_viewport
+    }
+    for attr_name in ELEMENT_INFO_ATTRIBUTES:
+        if attr_name in element.attributes:
+            info[attr_name] = element.attributes[attr_name]
+    return info
+
+@dataclass
+class DOMSnapshot:
+    """Interactive elements of one document, kept up to date from DOM_SNAPSHOT_SCRIPT results.
+    
+    Elements are keyed by the stable ID the page assigns them; highlight indexes stay positional
+    (1-based among visible elements in document order), as the click actions expect.
+    """
+    doc_id: str
+    root: DOMElementNode = field(default_factory=lambda: DOMElementNode(
+        is_visible=True, tag_name="body", is_interactive=False, is_top_element=True
+    ))
+    nodes: Dict[int, DOMElementNode] = field(default_factory=dict)
+    order: List[int] = field(default_factory=list)
+    diff: Dict[str, Any] = field(default_factory=dict)
+    
+    @staticmethod
+    def _build_node(record: Dict[str, Any]) -> DOMElementNode:
+        x, y, width, height = record['page']
+        node = DOMElementNode(
+            is_visible=True,
+            tag_name=record.get('tagName', 'div'),
+            attributes=record.get('attributes', {}),
+            is_interactive=True,
+            page_coordinates=CoordinateSet(x=x, y=y, width=width, height=height),
+            snapshot_id=record['id']
+        )
+        if record.get('text'):
+            text_node = DOMTextNode(is_visible=True, text=record['text'])
+            text_node.parent = node
+            node.children.append(text_node)
+        return node
+    
+    @staticmethod
+    def _same(old: DOMElementNode, new: DOMElementNode) -> bool:
+        # Moving an element (e.g. after a layout shift) is not a change worth reporting
+        return (replace(old.hash, page_coordinates=None) == replace(new.hash, page_coordinates=None) and
+                old.get_all_text_till_next_clickable_element() == new.get_all_text_till_next_clickable_element())
+    
+    def apply(self, data: Dict[str, Any]) -> Dict[int, DOMElementNode]:
+        """Apply one script result and return the selector map; the change summary is left in ``diff``"""
+        previous_index = {element_id: position for position, element_id in enumerate(self.order, 1)}
+        added, changed, removed = [], [], []
+        
+        if not data.get('unchanged'):
+            for element_id in data.get('removed', []):
+                node = self.nodes.pop(element_id, None)
+                if node is not None:
+                    removed.append(element_info(previous_index.get(element_id, 0), node))
+            for record in data.get('changed', []):
+                node = self._build_node(record)
+                old = self.nodes.get(record['id'])
+                if old is None:
+                    added.append(record['id'])
+                elif not self._same(old, node):
+                    changed.append(record['id'])
+                self.nodes[record['id']] = node
+            self.order = [element_id for element_id in data.get('order', []) if element_id in self.nodes]
+        
+        # Positions and viewport coordinates are cheap to recompute for every element
+        scroll_x, scroll_y = data.get('scrollX', 0), data.get('scrollY', 0)
+        width, height = data.get('width', 0), data.get('height', 0)
+        selector_map = {}
+        self.root.children = []
+        for position, element_id in enumerate(self.order, 1):
+            node = self.nodes[element_id]
+            page = node.page_coordinates
+            node.highlight_index = position
+            node.viewport_coordinates = CoordinateSet(x=page.x - scroll_x, y=page.y - scroll_y, width=page.width, height=page.height)
+            node.is_in_viewport = (node.viewport_coordinates.x >= 0 and node.viewport_coordinates.y >= 0 and
+                                   node.viewport_coordinates.x + page.width <= width and
+                                   node.viewport_coordinates.y + page.height <= height)
+            node.parent = self.root
+            self.root.children.append(node)
+            selector_map[position] = node
+        
+        position_of = {element_id: position for position, element_id in enumerate(self.order, 1)}
+        self.diff = {
+            'full': bool(data.get('full')),
+            'added': [element_info(position_of[i], self.nodes[i]) for i in added if i in position_of][:MAX_DIFF_ELEMENTS],
+            'removed': removed[:MAX_DIFF_ELEMENTS],
+            'changed': [element_info(position_of[i], self.nodes[i]) for i in changed if i in position_of][:MAX_DIFF_ELEMENTS],
+            'unchanged': len(self.order) - len(added) - len(changed),
+        }
+        return selector_map
+
 #######################################################
 # Browser Action Result Model
 #######################################################
@@ -260,10 +530,12 @@ class BrowserActionResult(BaseModel):
     title: Optional[str] = None
     elements: Optional[str] = None  # Formatted string of clickable elements
     screenshot_base64: Optional[str] = None
+    screenshot_hash: Optional[str] = None  # SHA-256 of the screenshot, usable with /automation/ocr
     pixels_above: int = 0
     pixels_below: int = 0
     content: Optional[str] = None
     ocr_text: Optional[str] = None  # Added field for OCR text
+    elements_diff: Optional[Dict[str, Any]] = None  # Elements added, removed and changed since the previous state
     
     # Additional metadata
     element_count: int = 0  # Number of interactive elements found
@@ -280,7 +552,7 @@ class BrowserActionResult(BaseModel):
 
 class BrowserAutomation:
     def __init__(self):
-        self.router = APIRouter()
+        self.router = APIRouter(dependencies=[Depends(read_screenshot_transport)])
         self.browser: Browser = None
         self.browser_context: BrowserContext = None
         self.pages: List[Page] = []
@@ -289,6 +561,19 @@ class BrowserAutomation:
         self.include_attributes = ["id", "href", "src", "alt", "aria-label", "placeholder", "name", "role", "title", "value"]
         self.screenshot_dir = os.path.join(os.getcwd(), "screenshots")
         os.makedirs(self.screenshot_dir, exist_ok=True)
+        self.headless = os.getenv("BROWSER_HEADLESS", "false").lower() == "true"
+        self.eager_ocr = EAGER_OCR
+        self.reuse_screenshots = True
+        
+        # Screenshot and OCR caches, keyed by screenshot hash
+        self._last_screenshot: Optional[Dict[str, Any]] = None
+        self._screenshots: "OrderedDict[str, str]" = OrderedDict()
+        self._ocr_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._ocr_inflight: Dict[str, asyncio.Future] = {}
+        self.screenshot_stats = {'captured': 0, 'reused': 0, 'ocr_runs': 0, 'ocr_hits': 0}
+        
+        # Incremental DOM state per page
+        self._dom_snapshots: Dict[Page, DOMSnapshot] = {}
         
         # Register routes
         self.router.on_startup.append(self.startup)
@@ -326,6 +611,12 @@ class BrowserAutomation:
         
         # Drag and drop
         self.router.post("/automation/drag_drop")(self.drag_drop)
+        
+        # OCR of a recent screenshot
+        self.router.post("/automation/ocr")(self.ocr)
+        
+        # Raw screenshot bytes
+        self.router.get("/automation/screenshot/{screenshot_hash}")(self.get_screenshot)
 
     async def startup(self):
         """Initialize the browser instance on startup"""
@@ -336,7 +627,7 @@ class BrowserAutomation:
             
             # Use non-headless mode for testing with slower timeouts
             launch_options = {
-                "headless": False,
+                "headless": self.headless,
                 "timeout": 60000
             }
             
@@ -352,6 +643,8 @@ class BrowserAutomation:
                 self.browser = await playwright.chromium.launch(**launch_options)
                 self.browser_context = await self.browser.new_context(viewport={'width': 1024, 'height': 768})
                 print("Browser launched with minimal options")
+            
+            await self.browser_context.add_init_script(PAGE_VERSION_SCRIPT)
 
             try:
                 await self.get_current_page()
@@ -400,136 +693,32 @@ class BrowserAutomation:
             raise HTTPException(status_code=500, detail="No browser pages available")
         return self.pages[self.current_page_index]
     
-    async def get_selector_map(self) -> Dict[int, DOMElementNode]:
-        """Get a map of selectable elements on the page"""
+    async def get_selector_map(self, full: bool = False) -> Dict[int, DOMElementNode]:
+        """Get a map of selectable elements on the page, updated incrementally from the last call"""
         page = await self.get_current_page()
         
-        # Create a selector map for interactive elements
-        selector_map = {}
-        
         try:
-            # More comprehensive JavaScript to find interactive elements
-            elements_js = """
-            (() => {
-                // Helper function to get all attributes as an object
-                function getAttributes(el) {
-                    const attributes = {};
-                    for (const attr of el.attributes) {
-                        attributes[attr.name] = attr.value;
-                    }
-                    return attributes;
-                }
-                
-                // Find all potentially interactive elements
-                const interactiveElements = Array.from(document.querySelectorAll(
-                    'a, button, input, select, textarea, [role="button"], [role="link"], [role="checkbox"], [role="radio"], [tabindex]:not([tabindex="-1"])'
-                ));
-                
-                // Filter for visible elements
-                const visibleElements = interactiveElements.filter(el => {
-                    const style = window.getComputedStyle(el);
-                    const rect = el.getBoundingClientRect();
-                    return style.display !== 'none' && 
-                           style.visibility !== 'hidden' && 
-                           style.opacity !== '0' &&
-                           rect.width > 0 && 
-                           rect.height > 0;
-                });
-                
-                // Map to our expected structure
-                return visibleElements.map((el, index) => {
-                    const rect = el.getBoundingClientRect();
-                    const isInViewport = rect.top >= 0 && 
-                                      rect.left >= 0 && 
-                                      rect.bottom <= window.innerHeight &&
-                                      rect.right <= window.innerWidth;
-                    
-                    return {
-                        index: index + 1,
-                        tagName: el.tagName.toLowerCase(),
-                        text: el.innerText || el.value || '',
-                        attributes: getAttributes(el),
-                        isVisible: true,
-                        isInteractive: true,
-                        pageCoordinates: {
-                            x: rect.left + window.scrollX,
-                            y: rect.top + window.scrollY,
-                            width: rect.width,
-                            height: rect.height
-                        },
-                        viewportCoordinates: {
-                            x: rect.left,
-                            y: rect.top,
-                            width: rect.width,
-                            height: rect.height
-                        },
-                        isInViewport: isInViewport
-                    };
-                });
-            })();
-            """
-            
-            elements = await page.evaluate(elements_js)
-            print(f"Found {len(elements)} interactive elements in selector map")
-            
-            # Create a root element for the tree
-            root = DOMElementNode(
-                is_visible=True,
-                tag_name="body",
-                is_interactive=False,
-                is_top_element=True
-            )
+            data = await page.evaluate(DOM_SNAPSHOT_SCRIPT, full)
+            snapshot = self._dom_snapshots.get(page)
+            if snapshot is None or snapshot.doc_id != data['docId']:
+                # New document (or a page we have no state for): start from a full extraction
+                if not data.get('full'):
+                    data = await page.evaluate(DOM_SNAPSHOT_SCRIPT, True)
+                self._dom_snapshots = {p: snap for p, snap in self._dom_snapshots.items() if p in self.pages}
+                snapshot = DOMSnapshot(doc_id=data['docId'])
+                self._dom_snapshots[page] = snapshot
+            
+            selector_map = snapshot.apply(data)
+            diff = snapshot.diff
+            print(f"Found {len(selector_map)} interactive elements in selector map "
+                  f"(+{len(diff['added'])} -{len(diff['removed'])} ~{len(diff['changed'])})")
             
-            # Create element nodes for each element
-            for idx, el in enumerate(elements):
-                # Create coordinate sets
-                page_coordinates = None
-                viewport_coordinates = None
-                
-                if 'pageCoordinates' in el:
-                    coords = el['pageCoordinates']
-                    page_coordinates = CoordinateSet(
-                        x=coords.get('x', 0),
-                        y=coords.get('y', 0),
-                        width=coords.get('width', 0),
-                        height=coords.get('height', 0)
-                    )
-                
-                if 'viewportCoordinates' in el:
-                    coords = el['viewportCoordinates']
-                    viewport_coordinates = CoordinateSet(
-                        x=coords.get('x', 0),
-                        y=coords.get('y', 0),
-                        width=coords.get('width', 0),
-                        height=coords.get('height', 0)
-                    )
-                
-                # Create the element node
-                element_node = DOMElementNode(
-                    is_visible=el.get('isVisible', True),
-                    tag_name=el.get('tagName', 'div'),
-                    attributes=el.get('attributes', {}),
-                    is_interactive=el.get('isInteractive', True),
-                    is_in_viewport=el.get('isInViewport', False),
-                    highlight_index=el.get('index', idx + 1),
-                    page_coordinates=page_coordinates,
-                    viewport_coordinates=viewport_coordinates
-                )
-                
-                # Add a text node if there's text content
-                if el.get('text'):
-                    text_node = DOMTextNode(is_visible=True, text=el.get('text', ''))
-                    text_node.parent = element_node
-                    element_node.children.append(text_node)
-                
-                selector_map[el.get('index', idx + 1)] = element_node
-                root.children.append(element_node)
-                element_node.parent = root
-                
         except Exception as e:
             print(f"Error getting selector map: {e}")
             traceback.print_exc()
+            self._dom_snapshots.pop(page, None)
             # Create a dummy element to avoid breaking tests
+            selector_map = {}
             dummy = DOMElementNode(
                 is_visible=True,
                 tag_name="a",
@@ -544,6 +733,11 @@ class BrowserAutomation:
         
         return selector_map
     
+    def get_elements_diff(self, page: Page) -> Optional[Dict[str, Any]]:
+        """Changes found by the last selector map update of a page"""
+        snapshot = self._dom_snapshots.get(page)
+        return snapshot.diff if snapshot is not None else None
+    
     async def get_current_dom_state(self) -> DOMState:
         """Get the current DOM state including element tree and selector map"""
         try:
@@ -558,11 +752,11 @@ class BrowserAutomation:
                 is_top_element=True
             )
             
-            # Add all elements from selector map as children of root
+            # Add all elements from selector map as children of root; snapshot nodes are
+            # already parented to the snapshot's root, so adopt them unconditionally
             for element in selector_map.values():
-                if element.parent is None:
-                    element.parent = root
-                    root.children.append(element)
+                element.parent = root
+                root.children.append(element)
             
             # Get basic page info
             url = page.url
@@ -633,8 +827,27 @@ class BrowserAutomation:
                 pixels_below=0
             )
     
-    async def take_screenshot(self) -> str:
-        """Take a screenshot and return as base64 encoded string"""
+    async def _page_signature(self, page: Page) -> Optional[str]:
+        """Hash of the page state that determines what a screenshot shows, or None if it can't be trusted"""
+        try:
+            signature = await page.evaluate(PAGE_SIGNATURE_SCRIPT)
+        except Exception as e:
+            print(f"Error getting page signature: {e}")
+            return None
+        if signature.get('version') is None or signature.get('volatile'):
+            return None
+        return hashlib.sha256(json.dumps(signature, sort_keys=True).encode()).hexdigest()
+    
+    def _remember_screenshot(self, screenshot_hash: str, screenshot: str) -> None:
+        self._screenshots[screenshot_hash] = screenshot
+        self._screenshots.move_to_end(screenshot_hash)
+        while len(self._screenshots) > SCREENSHOT_HISTORY_SIZE:
+            self._screenshots.popitem(last=False)
+    
+    async def capture_screenshot(self) -> tuple:
+        """Take a screenshot unless the page is unchanged since the last one
+        Returns a tuple of (screenshot_base64, screenshot_hash, reused)
+        """
         try:
             page = await self.get_current_page()
             
@@ -644,8 +857,13 @@ class BrowserAutomation:
             except Exception as e:
                 print(f"Warning: Network idle timeout, proceeding anyway: {e}")
             
-            # Wait for any animations to complete
-            # await page.wait_for_timeout(1000)  # Wait 1 second for animations
+            signature = await self._page_signature(page) if self.reuse_screenshots else None
+            last = self._last_screenshot
+            if (signature is not None and last is not None and last['page'] is page
+                    and last['signature'] == signature
+                    and time.monotonic() - last['taken_at'] < SCREENSHOT_MAX_REUSE_SECONDS):
+                self.screenshot_stats['reused'] += 1
+                return last['screenshot'], last['hash'], True
             
             # Take screenshot with increased timeout and better options
             screenshot_bytes = await page.screenshot(
@@ -656,12 +874,28 @@ class BrowserAutomation:
                 scale='device'  # Use device scale factor
             )
             
-            return base64.b64encode(screenshot_bytes).decode('utf-8')
+            loop = asyncio.get_running_loop()
+            screenshot, screenshot_hash = await loop.run_in_executor(image_executor, _encode_screenshot, screenshot_bytes)
+            self.screenshot_stats['captured'] += 1
+            self._remember_screenshot(screenshot_hash, screenshot)
+            self._last_screenshot = {
+                'page': page,
+                'signature': signature,
+                'screenshot': screenshot,
+                'hash': screenshot_hash,
+                'taken_at': time.monotonic(),
+            }
+            return screenshot, screenshot_hash, False
         except Exception as e:
             print(f"Error taking screenshot: {e}")
             traceback.print_exc()
-            # Return an empty string rather than failing
-            return ""
+            # Return an empty screenshot rather than failing
+            return "", None, False
+    
+    async def take_screenshot(self) -> str:
+        """Take a screenshot and return as base64 encoded string"""
+        screenshot, _, _ = await self.capture_screenshot()
+        return screenshot
     
     async def save_screenshot_to_file(self) -> str:
         """Take a screenshot and save to file, returning the path"""
@@ -678,27 +912,46 @@ class BrowserAutomation:
             print(f"Error saving screenshot: {e}")
             return ""
     
-    async def extract_ocr_text_from_screenshot(self, screenshot_base64: str) -> str:
-        """Extract text from screenshot using OCR"""
+    def cached_ocr_text(self, screenshot_hash: Optional[str]) -> Optional[str]:
+        """OCR text of a screenshot if it was already extracted"""
+        if screenshot_hash is None or screenshot_hash not in self._ocr_cache:
+            return None
+        self._ocr_cache.move_to_end(screenshot_hash)
+        self.screenshot_stats['ocr_hits'] += 1
+        return self._ocr_cache[screenshot_hash]
+    
+    async def extract_ocr_text_from_screenshot(self, screenshot_base64: str, screenshot_hash: Optional[str] = None) -> str:
+        """Extract text from screenshot using OCR, in the image worker pool and cached by screenshot hash"""
         if not screenshot_base64:
             return ""
-            
+        if screenshot_hash is None:
+            screenshot_hash = hashlib.sha256(base64.b64decode(screenshot_base64)).hexdigest()
+        
+        cached = self.cached_ocr_text(screenshot_hash)
+        if cached is not None:
+            return cached
+        
+        # Concurrent requests for the same screenshot share one OCR run
+        future = self._ocr_inflight.get(screenshot_hash)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(image_executor, _run_ocr, screenshot_base64)
+            self._ocr_inflight[screenshot_hash] = future
+            self.screenshot_stats['ocr_runs'] += 1
         try:
-            # Decode base64 to image
-            image_bytes = base64.b64decode(screenshot_base64)
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # Extract text using pytesseract
-            ocr_text = pytesseract.image_to_string(image)
-            
-            # Clean up the text
-            ocr_text = ocr_text.strip()
-            
-            return ocr_text
+            ocr_text = await asyncio.shield(future)
         except Exception as e:
             print(f"Error performing OCR: {e}")
             traceback.print_exc()
             return ""
+        finally:
+            if future.done():
+                self._ocr_inflight.pop(screenshot_hash, None)
+        
+        self._ocr_cache[screenshot_hash] = ocr_text
+        while len(self._ocr_cache) > OCR_CACHE_SIZE:
+            self._ocr_cache.popitem(last=False)
+        return ocr_text
     
     async def get_updated_browser_state(self, action_name: str) -> tuple:
         """Helper method to get updated browser state after any action
@@ -710,7 +963,7 @@ class BrowserAutomation:
             
             # Get updated state
             dom_state = await self.get_current_dom_state()
-            screenshot = await self.take_screenshot()
+            screenshot, screenshot_hash, reused = await self.capture_screenshot()
             
             # Format elements for output
             elements = dom_state.element_tree.clickable_elements_to_string(
@@ -725,23 +978,10 @@ class BrowserAutomation:
             metadata['element_count'] = len(dom_state.selector_map)
             
             # Create simplified interactive elements list
-            interactive_elements = []
-            for idx, element in dom_state.selector_map.items():
-                element_info = {
-                    'index': idx,
-                    'tag_name': element.tag_name,
-                    'text': element.get_all_text_till_next_clickable_element(),
-                    'is_in_viewport': element.is_in_viewport
-                }
-                
-                # Add key attributes
-                for attr_name in ['id', 'href', 'src', 'alt', 'placeholder', 'name', 'role', 'title', 'type']:
-                    if attr_name in element.attributes:
-                        element_info[attr_name] = element.attributes[attr_name]
-                
-                interactive_elements.append(element_info)
-            
-            metadata['interactive_elements'] = interactive_elements
+            metadata['interactive_elements'] = [
+                element_info(idx, element) for idx, element in dom_state.selector_map.items()
+            ]
+            metadata['elements_diff'] = self.get_elements_diff(page)
             
             # Get viewport dimensions - Fix syntax error in JavaScript
             try:
@@ -760,13 +1000,18 @@ class BrowserAutomation:
                 metadata['viewport_width'] = 0
                 metadata['viewport_height'] = 0
             
-            # Extract OCR text from screenshot if available
-            ocr_text = ""
+            metadata['screenshot_hash'] = screenshot_hash
+            
+            # OCR text is extracted in eager mode (the default; an unchanged screenshot hits the
+            # cache). Otherwise only already known text is included, the rest is on request.
             if screenshot:
-                ocr_text = await self.extract_ocr_text_from_screenshot(screenshot)
-                metadata['ocr_text'] = ocr_text
+                if self.eager_ocr:
+                    metadata['ocr_text'] = await self.extract_ocr_text_from_screenshot(screenshot, screenshot_hash)
+                else:
+                    metadata['ocr_text'] = self.cached_ocr_text(screenshot_hash) or ""
             
-            print(f"Got updated state after {action_name}: {len(dom_state.selector_map)} elements")
+            print(f"Got updated state after {action_name}: {len(dom_state.selector_map)} elements"
+                  f"{' (screenshot reused)' if reused else ''}")
             return dom_state, screenshot, elements, metadata
         except Exception as e:
             print(f"Error getting updated state after {action_name}: {e}")
@@ -789,13 +1034,15 @@ class BrowserAutomation:
             url=dom_state.url if dom_state else fallback_url or "",
             title=dom_state.title if dom_state else "",
             elements=elements,
-            screenshot_base64=screenshot,
+            screenshot_base64=screenshot if screenshot_transport.get() == "inline" else None,
+            screenshot_hash=metadata.get('screenshot_hash'),
             pixels_above=dom_state.pixels_above if dom_state else 0,
             pixels_below=dom_state.pixels_below if dom_state else 0,
             content=content,
             ocr_text=metadata.get('ocr_text', ""),
             element_count=metadata.get('element_count', 0),
             interactive_elements=metadata.get('interactive_elements', []),
+            elements_diff=metadata.get('elements_diff'),
             viewport_width=metadata.get('viewport_width', 0),
             viewport_height=metadata.get('viewport_height', 0)
         )
@@ -1046,13 +1293,18 @@ class BrowserAutomation:
             element_to_click = selector_map[action.index]
             print(f"Attempting to click element: {element_to_click}")
 
-            # Construct a more reliable selector using JavaScript evaluation
-            # Find the element based on its properties captured in selector_map
+            # Find the element by the stable ID the snapshot gave it; the positional index is only
+            # a fallback, since layout changes since the snapshot can shift positions
             js_selector_script = """
             (targetElementInfo) => {
                 const interactiveElements = Array.from(document.querySelectorAll(
                     'a, button, input, select, textarea, [role="button"], [role="link"], [role="checkbox"], [role="radio"], [tabindex]:not([tabindex="-1"])'
                 ));
+                const tracker = window.__heliumDom;
+                if (tracker && targetElementInfo.elementId != null && tracker.docId === targetElementInfo.docId) {
+                    const match = interactiveElements.find(el => tracker.ids.get(el) === targetElementInfo.elementId);
+                    if (match) return match;
+                }
                 
                 const visibleElements = interactiveElements.filter(el => {
                     const style = window.getComputedStyle(el);
@@ -1068,7 +1320,12 @@ class BrowserAutomation:
             }
             """
             
-            element_info = {'index': action.index} # Pass the target index to the script
+            snapshot = self._dom_snapshots.get(page)
+            element_info = {
+                'index': action.index,
+                'elementId': element_to_click.snapshot_id,
+                'docId': snapshot.doc_id if snapshot else None,
+            }
             
             target_element_handle = await page.evaluate_handle(js_selector_script, element_info)
 
@@ -1838,6 +2095,40 @@ class BrowserAutomation:
                 content=None
             )
 
+    # Screenshot Actions
+    
+    async def get_screenshot(self, screenshot_hash: str):
+        """Return a recent screenshot as raw JPEG bytes"""
+        screenshot = self._screenshots.get(screenshot_hash)
+        if not screenshot:
+            raise HTTPException(status_code=404, detail=f"No recent screenshot with hash {screenshot_hash}")
+        loop = asyncio.get_running_loop()
+        image_bytes = await loop.run_in_executor(image_executor, base64.b64decode, screenshot)
+        return Response(content=image_bytes, media_type="image/jpeg", headers={"X-Screenshot-Hash": screenshot_hash})
+    
+    # OCR Actions
+    
+    async def ocr(self, action: OCRAction = Body(...)):
+        """Extract text from a recent screenshot (the latest one by default)"""
+        screenshot_hash = action.screenshot_hash
+        if screenshot_hash is None and self._last_screenshot is not None:
+            screenshot_hash = self._last_screenshot['hash']
+        screenshot = self._screenshots.get(screenshot_hash) if screenshot_hash else None
+        if not screenshot:
+            return BrowserActionResult(
+                success=False,
+                message="Screenshot not found",
+                error=f"No recent screenshot with hash {screenshot_hash}" if screenshot_hash else "No screenshot taken yet"
+            )
+        
+        ocr_text = await self.extract_ocr_text_from_screenshot(screenshot, screenshot_hash)
+        return BrowserActionResult(
+            success=True,
+            message=f"Extracted {len(ocr_text)} characters of text",
+            screenshot_hash=screenshot_hash,
+            ocr_text=ocr_text
+        )
+
 # Create singleton instance
 automation_service = BrowserAutomation()
 
@@ -2091,6 +2382,61 @@ async def test_browser_api_2():
         await automation_service.shutdown()
         print("Browser closed")
 
+async def benchmark_browser_api(iterations: int = 10):
+    """Measure per-action state refresh time and event loop blocking in a headless browser"""
+    page_html = "<html><body><h1>Benchmark</h1>" + "".join(
+        f"<p>Paragraph {i} with some text to recognize.</p><a href='#{i}'>Link {i}</a>" for i in range(40)
+    ) + "<button id='mutate'>Mutate</button></body></html>"
+    
+    async def measure(label: str, action) -> None:
+        # A ticker that should wake every 10ms; any extra delay is time the loop was blocked
+        max_lag = 0.0
+        running = True
+        
+        async def ticker():
+            nonlocal max_lag
+            while running:
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                max_lag = max(max_lag, time.perf_counter() - started - 0.01)
+        
+        ticker_task = asyncio.create_task(ticker())
+        durations = []
+        for i in range(iterations):
+            started = time.perf_counter()
+            await action(i)
+            durations.append(time.perf_counter() - started)
+        running = False
+        await ticker_task
+        print(f"{label:<40} avg {1000 * sum(durations) / len(durations):7.1f} ms   "
+              f"max loop block {1000 * max_lag:7.1f} ms   {automation_service.screenshot_stats}")
+    
+    async def unchanged(_):
+        await automation_service.get_updated_browser_state("benchmark")
+    
+    async def mutated(i):
+        page = await automation_service.get_current_page()
+        await page.evaluate(f"document.querySelector('h1').textContent = 'Benchmark {i}'")
+        await automation_service.get_updated_browser_state("benchmark")
+    
+    try:
+        automation_service.headless = True
+        await automation_service.startup()
+        page = await automation_service.get_current_page()
+        await page.set_content(page_html)
+        
+        for eager_ocr, reuse in [(True, False), (True, True), (False, True)]:
+            automation_service.eager_ocr = eager_ocr
+            automation_service.reuse_screenshots = reuse
+            automation_service.screenshot_stats = {k: 0 for k in automation_service.screenshot_stats}
+            automation_service._ocr_cache.clear()
+            automation_service._last_screenshot = None
+            mode = f"eager_ocr={eager_ocr}, reuse={reuse}"
+            await measure(f"[{mode}] unchanged page", unchanged)
+            await measure(f"[{mode}] changed page", mutated)
+    finally:
+        await automation_service.shutdown()
+
 if __name__ == '__main__':
     import uvicorn
     import sys
@@ -2098,6 +2444,7 @@ if __name__ == '__main__':
     # Check command line arguments for test mode
     test_mode_1 = "--test" in sys.argv
     test_mode_2 = "--test2" in sys.argv
+    bench_mode = "--bench" in sys.argv
     
     if test_mode_1:
         print("Running in test mode 1")
@@ -2105,6 +2452,9 @@ if __name__ == '__main__':
     elif test_mode_2:
         print("Running in test mode 2 (Chess Page)")
         asyncio.run(test_browser_api_2())
+    elif bench_mode:
+        print("Running screenshot/OCR benchmark (headless)")
+        asyncio.run(benchmark_browser_api())
     else:
         print("Starting API server")
         uvicorn.run("browser_api:api_app", host="0.0.0.0", port=8003)
\ No newline at end of file
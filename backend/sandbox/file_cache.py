@@ -0,0 +1,168 @@
+"""
+Content-addressed cache of sandbox files for edit round trips.
+
+``str_replace`` and ``edit_file`` used to download the whole file, change it
+locally and upload all of it again, and repeated edits to the same file moved
+the same bytes every time. ``SandboxFileCache`` keeps the content of files a
+run has read or written, keyed by path and SHA-256:
+
+- ``read`` asks the sandbox for the file's ``sha256sum`` (one small command)
+  and only downloads when the hash differs from the cached copy, so writes made
+  through the shell or any other tool are always noticed.
+- ``write`` records the new content under its hash. For large files with a
+  small change, only the changed byte range is uploaded and spliced into the
+  file in place; the splice is verified against the expected hash and falls
+  back to a full upload.
+"""
+
+import hashlib
+import shlex
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from uuid import uuid4
+
+from daytona_sdk import AsyncSandbox
+
+from utils.logger import logger
+
+# Files below this size are always uploaded whole
+SPLICE_MIN_FILE_BYTES = 64 * 1024
+# Splice only when the changed range is at most this fraction of the file
+SPLICE_MAX_CHANGE_RATIO = 0.25
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+@dataclass
+class CachedFile:
+    content: bytes
+    sha256: str
+
+
+def _sha256(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _common_prefix(a: bytes, b: bytes, limit: int) -> int:
+    # Compare in blocks first; a byte-by-byte loop over a large file is slow in Python
+    block = 4096
+    n = 0
+    while n + block <= limit and a[n:n + block] == b[n:n + block]:
+        n += block
+    while n < limit and a[n] == b[n]:
+        n += 1
+    return n
+
+
+def _changed_range(old: bytes, new: bytes) -> Tuple[int, int, int]:
+    """Common prefix length, and where the changed region ends in ``old`` and ``new``."""
+    prefix = _common_prefix(old, new, min(len(old), len(new)))
+    suffix = _common_prefix(old[prefix:][::-1], new[prefix:][::-1], min(len(old), len(new)) - prefix)
+    return prefix, len(old) - suffix, len(new) - suffix
+
+
+class SandboxFileCache:
+    """Per-run cache of file contents, validated by hash on every read."""
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self._files: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def _store(self, path: str, content: bytes, sha256: Optional[str] = None) -> None:
+        self.invalidate(path)
+        if len(content) > self._max_bytes:
+            return
+        self._files[path] = CachedFile(content=content, sha256=sha256 or _sha256(content))
+        self._bytes += len(content)
+        while self._bytes > self._max_bytes and self._files:
+            _, evicted = self._files.popitem(last=False)
+            self._bytes -= len(evicted.content)
+
+    def remember(self, path: str, content: bytes) -> None:
+        """Record content that was just written to ``path`` by other means."""
+        self._store(path, content)
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        """Drop one path, or everything when no path is given."""
+        if path is None:
+            self._files.clear()
+            self._bytes = 0
+            return
+        entry = self._files.pop(path, None)
+        if entry is not None:
+            self._bytes -= len(entry.content)
+
+    async def remote_hash(self, sandbox: AsyncSandbox, path: str) -> Optional[str]:
+        """SHA-256 of the file in the sandbox, or None if it doesn't exist."""
+        response = await sandbox.process.exec(f"sha256sum -- {shlex.quote(path)} 2>/dev/null", timeout=30)
+        if getattr(response, 'exit_code', 1) != 0:
+            return None
+        output = (getattr(response, 'result', None) or '').strip()
+        return output.split()[0] if output else None
+
+    async def read(self, sandbox: AsyncSandbox, path: str) -> Optional[bytes]:
+        """Current content of a file, or None if it doesn't exist."""
+        remote_hash = await self.remote_hash(sandbox, path)
+        if remote_hash is None:
+            self.invalidate(path)
+            return None
+
+        entry = self._files.get(path)
+        if entry is not None and entry.sha256 == remote_hash:
+            self._files.move_to_end(path)
+            self.hits += 1
+            self.bytes_saved += len(entry.content)
+            return entry.content
+
+        self.misses += 1
+        content = await sandbox.fs.download_file(path)
+        self._store(path, content)
+        return content
+
+    async def write(self, sandbox: AsyncSandbox, path: str, content: bytes) -> None:
+        """Write a file, sending only the changed bytes when that is much smaller."""
+        entry = self._files.get(path)
+        if entry is not None and len(entry.content) >= SPLICE_MIN_FILE_BYTES:
+            start, old_end, new_end = _changed_range(entry.content, content)
+            changed = max(old_end - start, new_end - start)
+            if changed <= len(entry.content) * SPLICE_MAX_CHANGE_RATIO:
+                if await self._splice(sandbox, path, start, old_end, content[start:new_end], _sha256(content)):
+                    self.bytes_saved += len(content) - (new_end - start)
+                    self._store(path, content)
+                    return
+
+        await sandbox.fs.upload_file(content, path)
+        self._store(path, content)
+
+    async def _splice(self, sandbox: AsyncSandbox, path: str, start: int, old_end: int, chunk: bytes, expected: str) -> bool:
+        chunk_path = f"/tmp/splice_{uuid4().hex}"
+        target = shlex.quote(path)
+        try:
+            await sandbox.fs.upload_file(chunk, chunk_path)
+            # Writing through "cat >" keeps the file's inode, owner and permissions
+            script = (
+                f"t=$(mktemp) && head -c {start} {target} > \"$t\" && cat {chunk_path} >> \"$t\" && "
+                f"tail -c +{old_end + 1} {target} >> \"$t\" && "
+                f"[ \"$(sha256sum < \"$t\" | cut -d' ' -f1)\" = {expected} ] && cat \"$t\" > {target}; "
+                f"status=$?; rm -f \"$t\" {chunk_path}; exit $status"
+            )
+            response = await sandbox.process.exec(script, timeout=30)
+            if getattr(response, 'exit_code', 1) == 0:
+                return True
+            logger.warning(f"Splice of {path} did not verify, uploading the whole file")
+        except Exception as e:
+            logger.warning(f"Splice of {path} failed, uploading the whole file: {str(e)}")
+        return False
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'files': len(self._files),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytes_saved': self.bytes_saved,
+        }
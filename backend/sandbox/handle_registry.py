@@ -0,0 +1,139 @@
+"""
+Process-wide registry of sandbox handles.
+
+Every sandbox tool used to look up its project and call ``get_or_start_sandbox``
+on its own, so an agent run made the same ``projects`` query and Daytona
+``get`` (and possibly ``start``) about ten times. The registry caches the
+``AsyncSandbox`` per sandbox ID, and the sandbox info per project, for
+``SANDBOX_HANDLE_TTL_SECONDS``. Concurrent lookups of the same key share one
+in-flight request. Handles are dropped when a sandbox is deleted.
+
+The backend never stops or archives sandboxes itself: Daytona does, after
+``auto_stop_interval`` (30 minutes) idle and then ``auto_archive_interval``.
+There is no stop call site to invalidate from, so the TTL (2 minutes by
+default) bounds how long a handle to a sandbox that stopped meanwhile is
+reused; the next lookup after it goes back to Daytona, which restarts a
+stopped sandbox.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from daytona_sdk import AsyncSandbox
+
+from utils.config import config
+from utils.logger import logger
+
+# Expired entries are swept once a map grows past this size
+MAX_ENTRIES = 1024
+
+
+class SandboxHandleRegistry:
+    """Caches sandbox handles with single-flight lookups and a liveness TTL."""
+
+    def __init__(self, ttl: Optional[int] = None):
+        self._ttl = ttl
+        self._sandboxes: Dict[str, Tuple[float, AsyncSandbox]] = {}
+        self._projects: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.hits = 0
+        self.lookups = 0
+
+    @property
+    def ttl(self) -> int:
+        return config.SANDBOX_HANDLE_TTL_SECONDS if self._ttl is None else self._ttl
+
+    def _check_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # In-flight futures belong to the loop that created them
+            self._inflight.clear()
+            self._loop = loop
+
+    async def _single_flight(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        self._check_loop()
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetch())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: one caller being cancelled must not cancel the lookup for the others
+        return await asyncio.shield(future)
+
+    def _prune(self, entries: Dict[str, Tuple[float, Any]]) -> None:
+        if len(entries) >= MAX_ENTRIES:
+            for key in [k for k, entry in entries.items() if not self._fresh(entry)]:
+                entries.pop(key, None)
+
+    def _fresh(self, entry: Optional[Tuple[float, Any]]) -> bool:
+        return entry is not None and time.monotonic() - entry[0] < self.ttl
+
+    async def get_sandbox(self, sandbox_id: str) -> AsyncSandbox:
+        """Get a running sandbox, starting it at most once for concurrent callers."""
+        entry = self._sandboxes.get(sandbox_id)
+        if self._fresh(entry):
+            self.hits += 1
+            return entry[1]
+
+        async def fetch() -> AsyncSandbox:
+            from sandbox.sandbox import get_or_start_sandbox
+
+            self.lookups += 1
+            sandbox = await get_or_start_sandbox(sandbox_id)
+            self._prune(self._sandboxes)
+            self._sandboxes[sandbox_id] = (time.monotonic(), sandbox)
+            return sandbox
+
+        return await self._single_flight(f"sandbox:{sandbox_id}", fetch)
+
+    async def get_project_sandbox(self, client, project_id: str) -> Tuple[str, Optional[str], AsyncSandbox]:
+        """Get the sandbox of a project.
+
+        Returns:
+            (sandbox_id, sandbox_pass, sandbox)
+        """
+        entry = self._projects.get(project_id)
+        if self._fresh(entry):
+            sandbox_info = entry[1]
+        else:
+            async def fetch() -> Dict[str, Any]:
+                project = await client.table('projects').select('sandbox').eq('project_id', project_id).execute()
+                if not project.data or len(project.data) == 0:
+                    raise ValueError(f"Project {project_id} not found")
+                info = project.data[0].get('sandbox') or {}
+                if not info.get('id'):
+                    raise ValueError(f"No sandbox found for project {project_id}")
+                self._prune(self._projects)
+                self._projects[project_id] = (time.monotonic(), info)
+                return info
+
+            sandbox_info = await self._single_flight(f"project:{project_id}", fetch)
+
+        sandbox = await self.get_sandbox(sandbox_info['id'])
+        return sandbox_info['id'], sandbox_info.get('pass'), sandbox
+
+    def invalidate(self, sandbox_id: str) -> None:
+        """Forget a sandbox handle; call this wherever the backend stops, archives or deletes a sandbox."""
+        if self._sandboxes.pop(sandbox_id, None) is not None:
+            logger.debug(f"Dropped cached handle for sandbox {sandbox_id}")
+        for project_id, (_, info) in list(self._projects.items()):
+            if info.get('id') == sandbox_id:
+                self._projects.pop(project_id, None)
+
+    def invalidate_project(self, project_id: str) -> None:
+        entry = self._projects.pop(project_id, None)
+        if entry is not None:
+            self._sandboxes.pop(entry[1].get('id'), None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'sandboxes': len(self._sandboxes),
+            'projects': len(self._projects),
+            'hits': self.hits,
+            'lookups': self.lookups,
+        }
+
+
+sandbox_registry = SandboxHandleRegistry()
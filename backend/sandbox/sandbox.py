@@ -79,18 +79,9 @@ async def start_supervisord_session(sandbox: AsyncSandbox):
         logger.warning("Continuing without supervisord session - this is not critical for basic functionality")
         # Don't raise the exception - this is not critical for sandbox creation
 
-async def create_sandbox(password: str, project_id: str = None) -> AsyncSandbox:
-    """Create a new sandbox with all required services configured and running."""
-    
-    logger.debug("Creating new Daytona sandbox environment")
-    logger.debug("Configuring sandbox with snapshot and environment variables")
-    
-    labels = None
-    if project_id:
-        logger.debug(f"Using sandbox_id as label: {project_id}")
-        labels = {'id': project_id}
-        
-    params = CreateSandboxFromSnapshotParams(
+def build_sandbox_params(password: str, labels: dict = None) -> CreateSandboxFromSnapshotParams:
+    """Parameters for a new sandbox from the configured snapshot."""
+    return CreateSandboxFromSnapshotParams(
         snapshot=Configuration.SANDBOX_SNAPSHOT_NAME,
         public=True,
         labels=labels,
@@ -115,6 +106,19 @@ async def create_sandbox(password: str, project_id: str = None) -> AsyncSandbox:
         auto_stop_interval=30,
         auto_archive_interval=2 * 60,
     )
+
+async def create_sandbox(password: str, project_id: str = None) -> AsyncSandbox:
+    """Create a new sandbox with all required services configured and running."""
+    
+    logger.debug("Creating new Daytona sandbox environment")
+    logger.debug("Configuring sandbox with snapshot and environment variables")
+    
+    labels = None
+    if project_id:
+        logger.debug(f"Using sandbox_id as label: {project_id}")
+        labels = {'id': project_id}
+        
+    params = build_sandbox_params(password, labels)
     
     # Create the sandbox
     try:
@@ -145,6 +149,9 @@ async def delete_sandbox(sandbox_id: str) -> bool:
         # Delete the sandbox
         await daytona.delete(sandbox)
         
+        from sandbox.handle_registry import sandbox_registry
+        sandbox_registry.invalidate(sandbox_id)
+        
         logger.info(f"Successfully deleted sandbox {sandbox_id}")
         return True
     except Exception as e:
@@ -0,0 +1,283 @@
+"""
+Pool of pre-warmed sandboxes.
+
+Creating a sandbox and waiting for supervisord takes several seconds, which
+every new project (and every scheduled trigger run) used to pay inline. The
+pool keeps ``SANDBOX_POOL_TARGET_SIZE`` sandboxes per snapshot created and
+running, listed in Redis under ``sandbox_pool:{snapshot}`` as
+``{"id", "pass", "created_at"}`` entries, so any API worker can take one:
+
+- ``claim`` LPOPs an entry, which hands each pooled sandbox to exactly one
+  caller, checks the sandbox is still running and labels it with the project.
+- A background task per process reaps entries older than
+  ``SANDBOX_POOL_MAX_AGE_SECONDS`` (pooled sandboxes are idle, so they must be
+  replaced before Daytona auto-stops them) and refills the pool. Only one
+  process refills at a time, guarded by a Redis lock.
+
+The Daytona client is injected, so the pool can be driven by a fake client
+that implements ``create``, ``get`` and ``delete``.
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Dict, Optional, Set, Tuple
+
+from daytona_sdk import AsyncSandbox, SandboxState
+
+from services import redis
+from utils.config import config, Configuration
+from utils.logger import logger
+
+# Claims try this many pooled entries before falling back to creating a sandbox
+MAX_CLAIM_ATTEMPTS = 3
+REFILL_LOCK_TTL_SECONDS = 600
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SandboxPool:
+    """Pre-created sandboxes for one snapshot, shared by all workers through Redis."""
+
+    def __init__(
+        self,
+        client=None,
+        snapshot: Optional[str] = None,
+        target_size: Optional[int] = None,
+        max_age: Optional[int] = None,
+        check_interval: Optional[int] = None,
+        refill_concurrency: Optional[int] = None,
+    ):
+        self._client = client
+        self.snapshot = snapshot or Configuration.SANDBOX_SNAPSHOT_NAME
+        self.target_size = config.SANDBOX_POOL_TARGET_SIZE if target_size is None else target_size
+        self.max_age = config.SANDBOX_POOL_MAX_AGE_SECONDS if max_age is None else max_age
+        self.check_interval = config.SANDBOX_POOL_CHECK_INTERVAL_SECONDS if check_interval is None else check_interval
+        self.refill_concurrency = max(1, config.SANDBOX_POOL_REFILL_CONCURRENCY if refill_concurrency is None else refill_concurrency)
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        # Background deletions; held so they are not garbage-collected mid-flight
+        self._discards: Set[asyncio.Task] = set()
+        self.claims = 0
+        self.misses = 0
+        self.created = 0
+        self.reaped = 0
+        self.failures = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            from sandbox.sandbox import daytona
+            self._client = daytona
+        return self._client
+
+    @property
+    def enabled(self) -> bool:
+        return self.target_size > 0
+
+    @property
+    def key(self) -> str:
+        return f"sandbox_pool:{self.snapshot}"
+
+    @property
+    def _lock_key(self) -> str:
+        return f"{self.key}:refill_lock"
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry.get('created_at', 0) > self.max_age
+
+    async def claim(self, project_id: str) -> Optional[Tuple[AsyncSandbox, str]]:
+        """Take a running sandbox from the pool for a project.
+
+        Returns:
+            (sandbox, password), or None when the pool has nothing usable
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            for _ in range(MAX_CLAIM_ATTEMPTS):
+                raw = await redis.lpop(self.key)
+                if raw is None:
+                    break
+                entry = json.loads(raw)
+                if self._expired(entry):
+                    self._discard_later(entry['id'])
+                    continue
+
+                try:
+                    sandbox = await self.client.get(entry['id'])
+                except Exception as e:
+                    logger.warning(f"Pooled sandbox {entry['id']} is gone: {str(e)}")
+                    self.failures += 1
+                    continue
+                if sandbox.state != SandboxState.STARTED:
+                    self._discard_later(entry['id'], sandbox)
+                    continue
+
+                try:
+                    await sandbox.set_labels({'id': project_id})
+                except Exception as e:
+                    logger.warning(f"Failed to label pooled sandbox {sandbox.id} for project {project_id}: {str(e)}")
+
+                self.claims += 1
+                logger.info(f"Claimed pooled sandbox {sandbox.id} for project {project_id}")
+                return sandbox, entry['pass']
+        except Exception as e:
+            logger.error(f"Error claiming sandbox from pool: {str(e)}")
+        finally:
+            self._kick()
+
+        self.misses += 1
+        return None
+
+    async def _create(self) -> None:
+        from sandbox.sandbox import build_sandbox_params, start_supervisord_session
+
+        password = str(uuid.uuid4())
+        sandbox = await self.client.create(build_sandbox_params(password, {'pool': self.snapshot}))
+        await start_supervisord_session(sandbox)
+        entry = {'id': sandbox.id, 'pass': password, 'created_at': time.time()}
+        try:
+            await redis.rpush(self.key, json.dumps(entry))
+        except Exception:
+            await self._discard(sandbox.id, sandbox)
+            raise
+        self.created += 1
+        logger.debug(f"Added sandbox {sandbox.id} to the pool for {self.snapshot}")
+
+    def _discard_later(self, sandbox_id: str, sandbox: Optional[AsyncSandbox] = None) -> None:
+        task = asyncio.create_task(self._discard(sandbox_id, sandbox))
+        self._discards.add(task)
+        task.add_done_callback(self._discards.discard)
+
+    async def _discard(self, sandbox_id: str, sandbox: Optional[AsyncSandbox] = None) -> None:
+        try:
+            if sandbox is None:
+                sandbox = await self.client.get(sandbox_id)
+            await self.client.delete(sandbox)
+        except Exception as e:
+            logger.warning(f"Failed to delete pooled sandbox {sandbox_id}: {str(e)}")
+        self.reaped += 1
+
+    async def reap(self) -> int:
+        """Delete pooled sandboxes that are too old to hand out."""
+        reaped = 0
+        for raw in await redis.lrange(self.key, 0, -1):
+            try:
+                entry = json.loads(raw)
+            except json.JSONDecodeError:
+                await redis.lrem(self.key, 1, raw)
+                continue
+            # LREM succeeding means no claim took this entry in the meantime
+            if self._expired(entry) and await redis.lrem(self.key, 1, raw):
+                await self._discard(entry['id'])
+                reaped += 1
+        if reaped:
+            logger.info(f"Reaped {reaped} expired sandboxes from the pool for {self.snapshot}")
+        return reaped
+
+    async def refill(self) -> int:
+        """Create sandboxes until the pool is back at its target size."""
+        token = str(uuid.uuid4())
+        if not await redis.set(self._lock_key, token, ex=REFILL_LOCK_TTL_SECONDS, nx=True):
+            return 0
+
+        added = 0
+        try:
+            while True:
+                missing = self.target_size - await redis.llen(self.key)
+                if missing <= 0:
+                    break
+                batch = min(missing, self.refill_concurrency)
+                results = await asyncio.gather(*[self._create() for _ in range(batch)], return_exceptions=True)
+                errors = [r for r in results if isinstance(r, Exception)]
+                added += batch - len(errors)
+                if errors:
+                    self.failures += len(errors)
+                    logger.error(f"Failed to create {len(errors)} pooled sandboxes: {str(errors[0])}")
+                    break
+        finally:
+            redis_client = await redis.get_client()
+            await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, self._lock_key, token)
+
+        if added:
+            logger.info(f"Added {added} sandboxes to the pool for {self.snapshot}")
+        return added
+
+    def _kick(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _maintain(self) -> None:
+        while True:
+            try:
+                await self.reap()
+                await self.refill()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Sandbox pool maintenance failed: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        """Start background reaping and refilling in this process."""
+        if not self.enabled or (self._task is not None and not self._task.done()):
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._maintain())
+        logger.info(f"Sandbox pool started for {self.snapshot} (target size {self.target_size})")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._discards:
+            await asyncio.gather(*self._discards, return_exceptions=True)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            'snapshot': self.snapshot,
+            'target_size': self.target_size,
+            'ready': await redis.llen(self.key) if self.enabled else 0,
+            'claims': self.claims,
+            'misses': self.misses,
+            'created': self.created,
+            'reaped': self.reaped,
+            'failures': self.failures,
+            'discarding': len(self._discards),
+        }
+
+
+sandbox_pool = SandboxPool()
+
+
+async def acquire_sandbox(project_id: str) -> Tuple[AsyncSandbox, str]:
+    """Get a running sandbox for a new project, from the pool when one is ready.
+
+    Returns:
+        (sandbox, password)
+    """
+    claimed = await sandbox_pool.claim(project_id)
+    if claimed is not None:
+        return claimed
+
+    from sandbox.sandbox import create_sandbox
+
+    sandbox_pass = str(uuid.uuid4())
+    sandbox = await create_sandbox(sandbox_pass, project_id)
+    return sandbox, sandbox_pass
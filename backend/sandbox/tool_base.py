@@ -3,7 +3,7 @@ from typing import Optional
 from agentpress.thread_manager import ThreadManager
 from agentpress.tool import Tool
 from daytona_sdk import AsyncSandbox
-from sandbox.sandbox import get_or_start_sandbox
+from sandbox.handle_registry import sandbox_registry
 from utils.logger import logger
 from utils.files_utils import clean_path
 
@@ -29,23 +29,11 @@ class SandboxToolsBase(Tool):
                 # Get database client
                 client = await self.thread_manager.db.client
                 
-                # Get project data
-                project = await client.table('projects').select('*').eq('project_id', self.project_id).execute()
-                if not project.data or len(project.data) == 0:
-                    raise ValueError(f"Project {self.project_id} not found")
-                
-                project_data = project.data[0]
-                sandbox_info = project_data.get('sandbox', {})
-                
-                if not sandbox_info.get('id'):
-                    raise ValueError(f"No sandbox found for project {self.project_id}")
-                
-                # Store sandbox info
-                self._sandbox_id = sandbox_info['id']
-                self._sandbox_pass = sandbox_info.get('pass')
-                
-                # Get or start the sandbox
-                self._sandbox = await get_or_start_sandbox(self._sandbox_id)
+                # Shared with the other sandbox tools of this run, so the project
+                # lookup and get_or_start_sandbox happen once
+                self._sandbox_id, self._sandbox_pass, self._sandbox = await sandbox_registry.get_project_sandbox(
+                    client, self.project_id
+                )
                 
                 # # Log URLs if not already printed
                 # if not SandboxToolsBase._urls_printed:
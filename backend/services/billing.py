@@ -7,10 +7,13 @@ stripe listen --forward-to localhost:8000/api/billing/webhook
 from fastapi import APIRouter, HTTPException, Depends, Request
 from typing import Optional, Dict, Tuple
 import stripe
+import json
 from datetime import datetime, timezone, timedelta
 from utils.logger import logger
 from utils.config import config, EnvMode
 from services.supabase import DBConnection
+from services.usage_ledger import usage_ledger
+from services.billing_cache import billing_decision_cache
 from utils.auth_utils import get_current_user_id_from_jwt
 from pydantic import BaseModel
 from utils.constants import MODEL_ACCESS_TIERS, MODEL_NAME_ALIASES, HARDCODED_MODEL_PRICES
@@ -131,6 +134,9 @@ SUBSCRIPTION_TIERS = {
     config.STRIPE_TIER_25_170_YEARLY_COMMITMENT_ID: {'name': 'tier_25_170_yearly_commitment', 'minutes': 1500, 'cost': 200 + 5},  # 25 hours/month, $170/month (12-month commitment)
 }
 
+# Price IDs that belong to our product; subscriptions to anything else are ignored
+SUBSCRIPTION_PRICE_IDS = frozenset(SUBSCRIPTION_TIERS)
+
 # Pydantic models for request/response validation
 class CreateCheckoutSessionRequest(BaseModel):
     price_id: str
@@ -194,84 +200,73 @@ async def create_stripe_customer(client, user_id: str, email: str) -> str:
 async def get_user_subscription(user_id: str) -> Optional[Dict]:
     """Get the current subscription for a user from Stripe."""
     try:
-        # Get customer ID
-        db = DBConnection()
-        client = await db.client
-        customer_id = await get_stripe_customer_id(client, user_id)
-        
-        if not customer_id:
-            return None
-            
-        # Get all active subscriptions for the customer
-        subscriptions = await stripe.Subscription.list_async(
-            customer=customer_id,
-            status='active'
-        )
-        # print("Found subscriptions:", subscriptions)
-        
-        # Check if we have any subscriptions
-        if not subscriptions or not subscriptions.get('data'):
-            return None
-            
-        # Filter subscriptions to only include our product's subscriptions
-        our_subscriptions = []
-        for sub in subscriptions['data']:
-            # Check if subscription items contain any of our price IDs
-            for item in sub.get('items', {}).get('data', []):
-                price_id = item.get('price', {}).get('id')
-                if price_id in [
-                    config.STRIPE_FREE_TIER_ID,
-                    config.STRIPE_TIER_2_20_ID, config.STRIPE_TIER_6_50_ID, config.STRIPE_TIER_12_100_ID,
-                    config.STRIPE_TIER_25_200_ID, config.STRIPE_TIER_50_400_ID, config.STRIPE_TIER_125_800_ID,
-                    config.STRIPE_TIER_200_1000_ID,
-                    # Yearly tiers
-                    config.STRIPE_TIER_2_20_YEARLY_ID, config.STRIPE_TIER_6_50_YEARLY_ID,
-                    config.STRIPE_TIER_12_100_YEARLY_ID, config.STRIPE_TIER_25_200_YEARLY_ID,
-                    config.STRIPE_TIER_50_400_YEARLY_ID, config.STRIPE_TIER_125_800_YEARLY_ID,
-                    config.STRIPE_TIER_200_1000_YEARLY_ID,
-                    # Yearly commitment tiers (monthly payments with 12-month commitment)
-                    config.STRIPE_TIER_2_17_YEARLY_COMMITMENT_ID,
-                    config.STRIPE_TIER_6_42_YEARLY_COMMITMENT_ID,
-                    config.STRIPE_TIER_25_170_YEARLY_COMMITMENT_ID
-                ]:
-                    our_subscriptions.append(sub)
-        
-        if not our_subscriptions:
-            return None
-            
-        # If there are multiple active subscriptions, we need to handle this
-        if len(our_subscriptions) > 1:
-            logger.warning(f"User {user_id} has multiple active subscriptions: {[sub['id'] for sub in our_subscriptions]}")
-            
-            # Get the most recent subscription
-            most_recent = max(our_subscriptions, key=lambda x: x['created'])
-            
-            # Cancel all other subscriptions
-            for sub in our_subscriptions:
-                if sub['id'] != most_recent['id']:
-                    try:
-                        await stripe.Subscription.modify_async(
-                            sub['id'],
-                            cancel_at_period_end=True
-                        )
-                        logger.info(f"Cancelled subscription {sub['id']} for user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Error cancelling subscription {sub['id']}: {str(e)}")
-            
-            return most_recent
-            
-        return our_subscriptions[0]
-        
+        return await _fetch_user_subscription(user_id)
     except Exception as e:
         logger.error(f"Error getting subscription from Stripe: {str(e)}")
         return None
 
-async def calculate_monthly_usage(client, user_id: str) -> float:
-    """Calculate total agent run minutes for the current month for a user."""
+async def _fetch_user_subscription(user_id: str) -> Optional[Dict]:
+    """Get the current subscription for a user from Stripe, raising on errors."""
+    # Get customer ID
+    db = DBConnection()
+    client = await db.client
+    customer_id = await get_stripe_customer_id(client, user_id)
+
+    if not customer_id:
+        return None
+
+    # Get all active subscriptions for the customer
+    subscriptions = await stripe.Subscription.list_async(
+        customer=customer_id,
+        status='active'
+    )
+    # print("Found subscriptions:", subscriptions)
+
+    # Check if we have any subscriptions
+    if not subscriptions or not subscriptions.get('data'):
+        return None
+
+    # Filter subscriptions to only include our product's subscriptions
+    our_subscriptions = []
+    for sub in subscriptions['data']:
+        # Check if subscription items contain any of our price IDs
+        for item in sub.get('items', {}).get('data', []):
+            price_id = item.get('price', {}).get('id')
+            if price_id in SUBSCRIPTION_PRICE_IDS:
+                our_subscriptions.append(sub)
+
+    if not our_subscriptions:
+        return None
+
+    # If there are multiple active subscriptions, we need to handle this
+    if len(our_subscriptions) > 1:
+        logger.warning(f"User {user_id} has multiple active subscriptions: {[sub['id'] for sub in our_subscriptions]}")
+
+        # Get the most recent subscription
+        most_recent = max(our_subscriptions, key=lambda x: x['created'])
+
+        # Cancel all other subscriptions
+        for sub in our_subscriptions:
+            if sub['id'] != most_recent['id']:
+                try:
+                    await stripe.Subscription.modify_async(
+                        sub['id'],
+                        cancel_at_period_end=True
+                    )
+                    logger.info(f"Cancelled subscription {sub['id']} for user {user_id}")
+                except Exception as e:
+                    logger.error(f"Error cancelling subscription {sub['id']}: {str(e)}")
+
+        return most_recent
+
+    return our_subscriptions[0]
+
+async def calculate_monthly_usage_by_message(client, user_id: str) -> Dict[str, float]:
+    """Calculate the cost of each of the user's assistant responses this month, keyed by message_id."""
     start_time = time.time()
     
     # Use get_usage_logs to fetch all usage data (it already handles the date filtering and batching)
-    total_cost = 0.0
+    costs: Dict[str, float] = {}
     page = 0
     items_per_page = 1000
     
@@ -282,9 +277,8 @@ async def calculate_monthly_usage(client, user_id: str) -> float:
         if not usage_result['logs']:
             break
         
-        # Sum up the estimated costs from this page
         for log_entry in usage_result['logs']:
-            total_cost += log_entry['estimated_cost']
+            costs[log_entry['message_id']] = log_entry['estimated_cost']
         
         # If there are no more pages, break
         if not usage_result['has_more']:
@@ -294,9 +288,41 @@ async def calculate_monthly_usage(client, user_id: str) -> float:
     
     end_time = time.time()
     execution_time = end_time - start_time
-    logger.info(f"Calculate monthly usage took {execution_time:.3f} seconds, total cost: {total_cost}")
+    logger.info(f"Calculate monthly usage took {execution_time:.3f} seconds, total cost: {sum(costs.values())}")
     
-    return total_cost
+    return costs
+
+
+async def get_monthly_usage(client, user_id: str) -> float:
+    """Get the current month's cost for a user from the usage ledger.
+
+    Falls back to a full scan to seed a month the first time it is read.
+    """
+    return await usage_ledger.get_monthly_cost(
+        client, user_id, seed=lambda: calculate_monthly_usage_by_message(client, user_id)
+    )
+
+
+async def record_assistant_usage(client, thread_id: str, message_id: str, content: Dict, created_at: Optional[str] = None) -> None:
+    """Add the cost of a completed assistant response to its account's usage ledger."""
+    if config.ENV_MODE == EnvMode.LOCAL:
+        return
+    try:
+        usage = content.get('usage') or {}
+        cost = calculate_token_cost(
+            usage.get('prompt_tokens', 0),
+            usage.get('completion_tokens', 0),
+            content.get('model', 'unknown')
+        )
+        if cost <= 0:
+            return
+        account_id = await usage_ledger.account_for_thread(client, thread_id)
+        if not account_id:
+            logger.warning(f"Could not resolve account for thread {thread_id}, usage not recorded")
+            return
+        await usage_ledger.record(client, account_id, message_id, cost, created_at)
+    except Exception as e:
+        logger.error(f"Error recording usage for thread {thread_id}: {str(e)}")
 
 
 async def get_usage_logs(client, user_id: str, page: int = 0, items_per_page: int = 1000) -> Dict:
@@ -311,42 +337,14 @@ async def get_usage_logs(client, user_id: str, page: int = 0, items_per_page: in
     
     start_of_month = max(start_of_month, cutoff_date)
     
-    # First get all threads for this user in batches
-    batch_size = 1000
-    offset = 0
-    all_threads = []
-    
-    while True:
-        threads_batch = await client.table('threads') \
-            .select('thread_id, agent_runs(thread_id)') \
-            .eq('account_id', user_id) \
-            .gte('agent_runs.created_at', start_of_month.isoformat()) \
-            .range(offset, offset + batch_size - 1) \
-            .execute()
-        
-        if not threads_batch.data:
-            break
-            
-        all_threads.extend(threads_batch.data)
-        
-        # If we got less than batch_size, we've reached the end
-        if len(threads_batch.data) < batch_size:
-            break
-            
-        offset += batch_size
-    
-    if not all_threads:
-        return {"logs": [], "has_more": False}
-    
-    thread_ids = [t['thread_id'] for t in all_threads]
-    
     # Fetch usage messages with pagination, including thread project info
     start_time = time.time()
+    # Filter on the joined thread's account instead of collecting the user's thread IDs first
     messages_result = await client.table('messages') \
         .select(
-            'message_id, thread_id, created_at, content, threads!inner(project_id)'
+            'message_id, thread_id, created_at, content, threads!inner(project_id, account_id)'
         ) \
-        .in_('thread_id', thread_ids) \
+        .eq('threads.account_id', user_id) \
         .eq('type', 'assistant_response_end') \
         .gte('created_at', start_of_month.isoformat()) \
         .order('created_at', desc=True) \
@@ -377,7 +375,7 @@ async def get_usage_logs(client, user_id: str, page: int = 0, items_per_page: in
             # Safely calculate total tokens
             total_tokens = (prompt_tokens or 0) + (completion_tokens or 0)
             
-            # Calculate estimated cost using the same logic as calculate_monthly_usage
+            # Calculate estimated cost using the same logic as calculate_monthly_usage_by_message
             estimated_cost = calculate_token_cost(
                 prompt_tokens,
                 completion_tokens,
@@ -483,6 +481,64 @@ def calculate_token_cost(prompt_tokens: int, completion_tokens: int, model: str)
         logger.error(f"Error calculating token cost for model {model}: {str(e)}")
         return 0.0
 
+def get_subscription_price_id(subscription: Optional[Dict]) -> str:
+    """Get the price ID of a subscription, defaulting to the free tier."""
+    if not subscription:
+        return config.STRIPE_FREE_TIER_ID
+    if subscription.get('items') and subscription['items'].get('data') and len(subscription['items']['data']) > 0:
+        return subscription['items']['data'][0]['price']['id']
+    return subscription.get('price_id', config.STRIPE_FREE_TIER_ID)
+
+async def get_billing_decision(client, user_id: str, include_usage: bool = False) -> Dict:
+    """
+    Resolve a user's subscription tier and, optionally, remaining budget.
+    
+    The Stripe-derived fields are cached per account for a short time (see
+    services/billing_cache.py) so repeated checks during an agent run don't call
+    Stripe. Usage is read fresh from the usage ledger on every call, so an
+    account is stopped as soon as it runs out of budget.
+    
+    Returns:
+        Dict with subscription, price_id, tier_name and cost_limit, plus
+        current_usage and remaining_budget when include_usage is set.
+    """
+    decision = await billing_decision_cache.get(user_id)
+    if decision is None:
+        try:
+            subscription = await _fetch_user_subscription(user_id)
+        except Exception as e:
+            # Answer as before (free tier) but don't pin that answer in the cache
+            logger.error(f"Error getting subscription from Stripe: {str(e)}")
+            subscription = None
+            cacheable = False
+        else:
+            cacheable = True
+        price_id = get_subscription_price_id(subscription)
+        
+        # Get tier info - default to free tier if not found
+        tier_info = SUBSCRIPTION_TIERS.get(price_id)
+        if not tier_info:
+            logger.warning(f"Unknown subscription tier: {price_id}, defaulting to free tier")
+            tier_info = SUBSCRIPTION_TIERS[config.STRIPE_FREE_TIER_ID]
+        
+        decision = {
+            # Round-trip through JSON so the Stripe object can be stored in Redis
+            'subscription': json.loads(json.dumps(subscription)) if subscription else None,
+            'price_id': price_id,
+            'tier_name': tier_info['name'],
+            'cost_limit': tier_info['cost'],
+        }
+        if cacheable:
+            await billing_decision_cache.set(user_id, decision)
+    
+    # Never write usage into the cached dict
+    decision = dict(decision)
+    if include_usage:
+        current_usage = await get_monthly_usage(client, user_id)
+        decision['current_usage'] = current_usage
+        decision['remaining_budget'] = decision['cost_limit'] - current_usage
+    return decision
+
 async def get_allowed_models_for_user(client, user_id: str):
     """
     Get the list of models allowed for a user based on their subscription tier.
@@ -491,20 +547,8 @@ async def get_allowed_models_for_user(client, user_id: str):
         List of model names allowed for the user's subscription tier.
     """
 
-    subscription = await get_user_subscription(user_id)
-    tier_name = 'free'
-    
-    if subscription:
-        price_id = None
-        if subscription.get('items') and subscription['items'].get('data') and len(subscription['items']['data']) > 0:
-            price_id = subscription['items']['data'][0]['price']['id']
-        else:
-            price_id = subscription.get('price_id', config.STRIPE_FREE_TIER_ID)
-        
-        # Get tier info for this price_id
-        tier_info = SUBSCRIPTION_TIERS.get(price_id)
-        if tier_info:
-            tier_name = tier_info['name']
+    decision = await get_billing_decision(client, user_id)
+    tier_name = decision['tier_name']
     
     # Return allowed models for this tier
     return MODEL_ACCESS_TIERS.get(tier_name, MODEL_ACCESS_TIERS['free'])  # Default to free tier if unknown
@@ -550,37 +594,16 @@ async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optiona
             "minutes_limit": "no limit"
         }
 
-    # Get current subscription
-    subscription = await get_user_subscription(user_id)
-    # print("Current subscription:", subscription)
-    
-    # If no subscription, they can use free tier
-    if not subscription:
-        subscription = {
-            'price_id': config.STRIPE_FREE_TIER_ID,  # Free tier
-            'plan_name': 'free'
-        }
-    
-    # Extract price ID from subscription items
-    price_id = None
-    if subscription.get('items') and subscription['items'].get('data') and len(subscription['items']['data']) > 0:
-        price_id = subscription['items']['data'][0]['price']['id']
-    else:
-        price_id = subscription.get('price_id', config.STRIPE_FREE_TIER_ID)
-    
-    # Get tier info - default to free tier if not found
-    tier_info = SUBSCRIPTION_TIERS.get(price_id)
-    if not tier_info:
-        logger.warning(f"Unknown subscription tier: {price_id}, defaulting to free tier")
-        tier_info = SUBSCRIPTION_TIERS[config.STRIPE_FREE_TIER_ID]
-    
-    # Calculate current month's usage
-    current_usage = await calculate_monthly_usage(client, user_id)
+    decision = await get_billing_decision(client, user_id, include_usage=True)
+    subscription = decision['subscription'] or {
+        'price_id': config.STRIPE_FREE_TIER_ID,  # Free tier
+        'plan_name': 'free'
+    }
     
     # TODO: also do user's AAL check
     # Check if within limits
-    if current_usage >= tier_info['cost']:
-        return False, f"Monthly limit of {tier_info['cost']} dollars reached. Please upgrade your plan or wait until next month.", subscription
+    if decision['remaining_budget'] <= 0:
+        return False, f"Monthly limit of {decision['cost_limit']} dollars reached. Please upgrade your plan or wait until next month.", subscription
     
     return True, "OK", subscription
 
@@ -1101,7 +1124,7 @@ async def get_subscription(
         # Calculate current usage
         db = DBConnection()
         client = await db.client
-        current_usage = await calculate_monthly_usage(client, current_user_id)
+        current_usage = await get_monthly_usage(client, current_user_id)
 
         if not subscription:
             # Default to free tier status if no active subscription for our product
@@ -1204,6 +1227,20 @@ async def check_status(
         logger.error(f"Error checking billing status: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def invalidate_billing_decision_for_customer(customer_id: str) -> None:
+    """Drop the cached billing decision of the account behind a Stripe customer."""
+    try:
+        db = DBConnection()
+        client = await db.client
+        result = await client.schema('basejump').from_('billing_customers') \
+            .select('account_id') \
+            .eq('id', customer_id) \
+            .execute()
+        for row in result.data or []:
+            await billing_decision_cache.invalidate(row['account_id'])
+    except Exception as e:
+        logger.error(f"Error invalidating billing decision for customer {customer_id}: {str(e)}")
+
 @router.post("/webhook")
 async def stripe_webhook(request: Request):
     """Handle Stripe webhook events."""
@@ -1228,6 +1265,13 @@ async def stripe_webhook(request: Request):
             logger.error(f"Invalid webhook signature: {str(e)}")
             raise HTTPException(status_code=400, detail="Invalid signature")
         
+        # Any event about a customer may change their tier; drop the cached decision.
+        # customer.* events carry the customer itself rather than a reference to it.
+        event_object = event.data.object
+        event_customer_id = event_object.get('id') if event_object.get('object') == 'customer' else event_object.get('customer')
+        if event_customer_id:
+            await invalidate_billing_decision_for_customer(event_customer_id)
+        
         # Handle the event
         if event.type in ['customer.subscription.created', 'customer.subscription.updated', 'customer.subscription.deleted']:
             # Extract the subscription and customer information
@@ -1521,6 +1565,7 @@ async def get_usage_logs_endpoint(
         
         # Get usage logs
         result = await get_usage_logs(client, current_user_id, page, items_per_page)
+        result['total_cost'] = await get_monthly_usage(client, current_user_id)
         
         return result
         
@@ -0,0 +1,91 @@
+"""
+Short-lived cache of billing decisions.
+
+Agent runs check billing before every iteration, and each check used to go to
+Stripe for the account's subscription. The resolved subscription, tier and
+price_id (not usage, which is read fresh from the usage ledger) are kept here
+per account, in process and in Redis, for a short TTL. Stripe
+webhooks invalidate an account's entry as soon as its subscription changes.
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from utils.cache import Cache
+from utils.logger import logger
+
+# How long a decision is shared across processes through Redis
+BILLING_DECISION_TTL_SECONDS = 60
+
+# How long a process trusts its own copy; kept shorter so a webhook
+# invalidation handled by another process is picked up quickly
+BILLING_DECISION_LOCAL_TTL_SECONDS = 15
+
+
+def _redis_key(account_id: str) -> str:
+    return f"billing_decision:{account_id}"
+
+
+class BillingDecisionCache:
+    """Per-account billing decisions with an in-process and a Redis tier."""
+
+    def __init__(self, ttl_seconds: int = BILLING_DECISION_TTL_SECONDS, local_ttl_seconds: int = BILLING_DECISION_LOCAL_TTL_SECONDS):
+        self._local: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._ttl = ttl_seconds
+        self._local_ttl = local_ttl_seconds
+        self._lock = asyncio.Lock()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    async def get(self, account_id: str) -> Optional[Dict[str, Any]]:
+        """Get the cached decision for an account, or None if there is no fresh one."""
+        async with self._lock:
+            entry = self._local.get(account_id)
+            if entry is not None:
+                expires_at, decision = entry
+                if time.monotonic() < expires_at:
+                    self.local_hits += 1
+                    return dict(decision)
+                del self._local[account_id]
+
+        try:
+            decision = await Cache.get(_redis_key(account_id))
+        except Exception as e:
+            logger.warning(f"Failed to read billing decision for {account_id} from Redis: {str(e)}")
+            decision = None
+
+        if decision is None:
+            self.misses += 1
+            return None
+
+        self.redis_hits += 1
+        await self._set_local(account_id, decision)
+        return dict(decision)
+
+    async def set(self, account_id: str, decision: Dict[str, Any]) -> None:
+        """Store a decision for an account in both tiers."""
+        await self._set_local(account_id, decision)
+        try:
+            await Cache.set(_redis_key(account_id), decision, ttl=self._ttl)
+        except Exception as e:
+            logger.warning(f"Failed to write billing decision for {account_id} to Redis: {str(e)}")
+
+    async def _set_local(self, account_id: str, decision: Dict[str, Any]) -> None:
+        async with self._lock:
+            self._local[account_id] = (time.monotonic() + self._local_ttl, dict(decision))
+
+    async def invalidate(self, account_id: str) -> None:
+        """Drop an account's decision from this process and from Redis."""
+        async with self._lock:
+            self._local.pop(account_id, None)
+        try:
+            await Cache.invalidate(_redis_key(account_id))
+            logger.debug(f"Invalidated billing decision for account {account_id}")
+        except Exception as e:
+            logger.warning(f"Failed to invalidate billing decision for {account_id} in Redis: {str(e)}")
+
+
+# Global cache instance
+billing_decision_cache = BillingDecisionCache()
@@ -3,7 +3,7 @@ import os
 from dotenv import load_dotenv
 import asyncio
 from utils.logger import logger
-from typing import List, Any
+from typing import List, Any, Dict, Optional
 from utils.retry import retry
 
 # Redis client and connection pool
@@ -166,6 +166,43 @@ async def lrange(key: str, start: int, end: int) -> List[str]:
     return await redis_client.lrange(key, start, end)
 
 
+async def lpop(key: str) -> Optional[str]:
+    """Remove and return the first element of a list."""
+    redis_client = await get_client()
+    return await redis_client.lpop(key)
+
+
+async def llen(key: str) -> int:
+    """Get the length of a list."""
+    redis_client = await get_client()
+    return await redis_client.llen(key)
+
+
+async def lrem(key: str, count: int, value: str) -> int:
+    """Remove up to ``count`` occurrences of a value from a list."""
+    redis_client = await get_client()
+    return await redis_client.lrem(key, count, value)
+
+
+# Stream operations
+async def xadd(key: str, fields: Dict[str, Any], maxlen: Optional[int] = None):
+    """Append an entry to a stream and return its ID."""
+    redis_client = await get_client()
+    return await redis_client.xadd(key, fields, maxlen=maxlen, approximate=True)
+
+
+async def xrange(key: str, start: str = "-", end: str = "+", count: Optional[int] = None):
+    """Get entries of a stream between two IDs (inclusive)."""
+    redis_client = await get_client()
+    return await redis_client.xrange(key, min=start, max=end, count=count)
+
+
+async def xread(streams: Dict[str, str], count: Optional[int] = None, block: Optional[int] = None):
+    """Read entries newer than the given IDs, blocking up to ``block`` ms for new ones."""
+    redis_client = await get_client()
+    return await redis_client.xread(streams, count=count, block=block)
+
+
 # Key management
 
 
@@ -0,0 +1,143 @@
+"""
+Materialized monthly usage per account.
+
+``usage_ledger`` holds one row per account and calendar month with the running
+token cost. A month is seeded once from a full scan of its
+``assistant_response_end`` messages and from then on incremented as responses
+complete, so billing checks read a single row instead of rescanning.
+
+Both paths go through SQL functions that record each counted message in
+``usage_ledger_entries``, so a response that completes while a month is being
+seeded is counted exactly once, whichever path reaches it first.
+"""
+
+import asyncio
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+from utils.logger import logger
+
+# Thread -> account lookups kept per process (a thread never changes account)
+THREAD_ACCOUNT_CACHE_SIZE = 4096
+
+
+def current_period_start(now: Optional[datetime] = None) -> date:
+    """First day of the current UTC month, the ledger's period key."""
+    now = now or datetime.now(timezone.utc)
+    return date(now.year, now.month, 1)
+
+
+def period_start_for(created_at: Optional[str]) -> date:
+    """Period key of a message, from its ``created_at`` (the current month if unknown)."""
+    if created_at:
+        try:
+            moment = datetime.fromisoformat(created_at)
+            if moment.tzinfo is not None:
+                moment = moment.astimezone(timezone.utc)
+            return current_period_start(moment)
+        except ValueError:
+            pass
+    return current_period_start()
+
+
+class UsageLedger:
+    """Reads and maintains the ``usage_ledger`` table."""
+
+    def __init__(self):
+        self._thread_accounts: "OrderedDict[str, str]" = OrderedDict()
+        self._seed_locks: Dict[str, asyncio.Lock] = {}
+        self.reads = 0
+        self.seeds = 0
+        self.increments = 0
+
+    async def account_for_thread(self, client, thread_id: str) -> Optional[str]:
+        account_id = self._thread_accounts.get(thread_id)
+        if account_id:
+            self._thread_accounts.move_to_end(thread_id)
+            return account_id
+
+        result = await client.table('threads').select('account_id').eq('thread_id', thread_id).limit(1).execute()
+        if not result.data:
+            return None
+        account_id = result.data[0]['account_id']
+
+        self._thread_accounts[thread_id] = account_id
+        while len(self._thread_accounts) > THREAD_ACCOUNT_CACHE_SIZE:
+            self._thread_accounts.popitem(last=False)
+        return account_id
+
+    async def get_monthly_cost(self, client, account_id: str, seed: Callable[[], Awaitable[Dict[str, float]]]) -> float:
+        """Return the account's cost for the current month.
+
+        Args:
+            client: Supabase client
+            account_id: Account to read
+            seed: Full scan of the month as {message_id: cost}, used once when the month is not seeded yet
+
+        Returns:
+            Total cost in dollars
+        """
+        period_start = current_period_start().isoformat()
+        self.reads += 1
+
+        try:
+            total = await self._read(client, account_id, period_start)
+            if total is not None:
+                return total
+
+            lock = self._seed_locks.setdefault(account_id, asyncio.Lock())
+            async with lock:
+                # Another request may have seeded while we waited
+                total = await self._read(client, account_id, period_start)
+                if total is not None:
+                    return total
+
+                scanned = await seed()
+                result = await client.rpc('seed_usage_ledger', {
+                    'p_account_id': account_id,
+                    'p_period_start': period_start,
+                    'p_entries': [{'message_id': message_id, 'cost': cost} for message_id, cost in scanned.items()],
+                }).execute()
+                self.seeds += 1
+                total = float(result.data) if result.data is not None else sum(scanned.values())
+                logger.info(f"Seeded usage ledger for account {account_id} ({period_start}): {len(scanned)} responses, {total}")
+                return total
+        except Exception as e:
+            logger.error(f"Usage ledger read failed for account {account_id}, falling back to full scan: {str(e)}")
+            return sum((await seed()).values())
+        finally:
+            lock = self._seed_locks.get(account_id)
+            if lock is not None and not lock.locked():
+                self._seed_locks.pop(account_id, None)
+
+    async def _read(self, client, account_id: str, period_start: str) -> Optional[float]:
+        result = await client.table('usage_ledger').select('total_cost, seeded')\
+            .eq('account_id', account_id).eq('period_start', period_start).limit(1).execute()
+        # Increments create the row before the month is seeded; only a seeded total is complete
+        if not result.data or not result.data[0].get('seeded'):
+            return None
+        return float(result.data[0]['total_cost'])
+
+    async def record(self, client, account_id: str, message_id: str, cost: float, created_at: Optional[str] = None) -> None:
+        """Add the cost of one completed response to the month it was created in.
+
+        The message is remembered in ``usage_ledger_entries``, so a later (or
+        concurrent) seeding scan that also finds it does not count it again.
+        """
+        if cost <= 0:
+            return
+        try:
+            await client.rpc('increment_usage_ledger', {
+                'p_account_id': account_id,
+                'p_period_start': period_start_for(created_at).isoformat(),
+                'p_message_id': message_id,
+                'p_cost': cost,
+            }).execute()
+            self.increments += 1
+        except Exception as e:
+            logger.error(f"Failed to record usage of {cost} for account {account_id}: {str(e)}")
+
+
+# Global ledger instance
+usage_ledger = UsageLedger()
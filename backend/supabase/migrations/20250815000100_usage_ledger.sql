@@ -0,0 +1,144 @@
+-- Per-account, per-month usage aggregates maintained as assistant responses complete.
+-- Rows are seeded once from a full scan of the month's assistant_response_end messages
+-- and then incremented, so billing checks read a single row instead of rescanning.
+-- Every counted response is recorded in usage_ledger_entries, so a response is added
+-- exactly once whether the seed scan or the increment gets to it first.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS usage_ledger (
+    account_id UUID NOT NULL REFERENCES basejump.accounts(id) ON DELETE CASCADE,
+    period_start DATE NOT NULL,
+    total_cost NUMERIC(20, 8) NOT NULL DEFAULT 0,
+    seeded BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (account_id, period_start)
+);
+
+CREATE TABLE IF NOT EXISTS usage_ledger_entries (
+    message_id UUID PRIMARY KEY,
+    account_id UUID NOT NULL REFERENCES basejump.accounts(id) ON DELETE CASCADE,
+    period_start DATE NOT NULL,
+    cost NUMERIC(20, 8) NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_usage_ledger_entries_account_period ON usage_ledger_entries(account_id, period_start);
+
+ALTER TABLE usage_ledger ENABLE ROW LEVEL SECURITY;
+ALTER TABLE usage_ledger_entries ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS usage_ledger_select_own ON usage_ledger;
+CREATE POLICY usage_ledger_select_own ON usage_ledger
+    FOR SELECT USING (basejump.has_role_on_account(account_id) = true);
+
+-- Seed a month from a full scan. p_entries is a JSON array of {message_id, cost};
+-- responses already counted by increment_usage_ledger are skipped. A month that is
+-- already seeded is returned unchanged, so a concurrent seed is a no-op.
+CREATE OR REPLACE FUNCTION seed_usage_ledger(
+    p_account_id UUID,
+    p_period_start DATE,
+    p_entries JSONB
+)
+RETURNS NUMERIC
+SECURITY DEFINER
+SET search_path = public
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    current_total NUMERIC;
+    is_seeded BOOLEAN;
+    added NUMERIC;
+BEGIN
+    INSERT INTO usage_ledger (account_id, period_start)
+    VALUES (p_account_id, p_period_start)
+    ON CONFLICT (account_id, period_start) DO NOTHING;
+
+    -- Row lock first, like increment_usage_ledger, so the two serialize instead of deadlocking
+    SELECT total_cost, seeded INTO current_total, is_seeded
+    FROM usage_ledger
+    WHERE account_id = p_account_id AND period_start = p_period_start
+    FOR UPDATE;
+
+    IF is_seeded THEN
+        RETURN current_total;
+    END IF;
+
+    WITH inserted AS (
+        INSERT INTO usage_ledger_entries (message_id, account_id, period_start, cost)
+        SELECT (entry->>'message_id')::UUID, p_account_id, p_period_start, (entry->>'cost')::NUMERIC
+        FROM jsonb_array_elements(p_entries) AS entry
+        ON CONFLICT (message_id) DO NOTHING
+        RETURNING cost
+    )
+    SELECT COALESCE(SUM(cost), 0) INTO added FROM inserted;
+
+    UPDATE usage_ledger
+    SET total_cost = total_cost + added,
+        seeded = TRUE,
+        updated_at = NOW()
+    WHERE account_id = p_account_id AND period_start = p_period_start
+    RETURNING total_cost INTO current_total;
+
+    RETURN current_total;
+END;
+$$;
+
+-- Count one response. Responses already counted (by an earlier call or a seed) are
+-- ignored. Returns the month's total, or NULL while the month has not been seeded.
+CREATE OR REPLACE FUNCTION increment_usage_ledger(
+    p_account_id UUID,
+    p_period_start DATE,
+    p_message_id UUID,
+    p_cost NUMERIC
+)
+RETURNS NUMERIC
+SECURITY DEFINER
+SET search_path = public
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    current_total NUMERIC;
+    is_seeded BOOLEAN;
+    inserted INTEGER;
+BEGIN
+    INSERT INTO usage_ledger (account_id, period_start)
+    VALUES (p_account_id, p_period_start)
+    ON CONFLICT (account_id, period_start) DO NOTHING;
+
+    SELECT total_cost, seeded INTO current_total, is_seeded
+    FROM usage_ledger
+    WHERE account_id = p_account_id AND period_start = p_period_start
+    FOR UPDATE;
+
+    INSERT INTO usage_ledger_entries (message_id, account_id, period_start, cost)
+    VALUES (p_message_id, p_account_id, p_period_start, p_cost)
+    ON CONFLICT (message_id) DO NOTHING;
+    GET DIAGNOSTICS inserted = ROW_COUNT;
+
+    IF inserted > 0 THEN
+        UPDATE usage_ledger
+        SET total_cost = total_cost + p_cost,
+            updated_at = NOW()
+        WHERE account_id = p_account_id AND period_start = p_period_start
+        RETURNING total_cost INTO current_total;
+    END IF;
+
+    IF NOT is_seeded THEN
+        RETURN NULL;
+    END IF;
+    RETURN current_total;
+END;
+$$;
+
+GRANT SELECT ON TABLE usage_ledger TO authenticated;
+GRANT ALL PRIVILEGES ON TABLE usage_ledger TO service_role;
+GRANT ALL PRIVILEGES ON TABLE usage_ledger_entries TO service_role;
+GRANT EXECUTE ON FUNCTION seed_usage_ledger(UUID, DATE, JSONB) TO service_role;
+GRANT EXECUTE ON FUNCTION increment_usage_ledger(UUID, DATE, UUID, NUMERIC) TO service_role;
+
+COMMENT ON TABLE usage_ledger IS 'Running monthly token cost per account, updated as assistant responses complete';
+COMMENT ON TABLE usage_ledger_entries IS 'Responses counted in usage_ledger, so each is added exactly once';
+
+COMMIT;
@@ -4,10 +4,11 @@ from datetime import datetime, timezone
 from typing import Dict, Any, Tuple
 
 from services.supabase import DBConnection
-from services import redis
 from utils.logger import logger, structlog
 from utils.config import config
-from run_agent_background import run_agent_background
+from run_agent_background import enqueue_agent_run
+from agent.run_scheduler import LANE_BACKGROUND
+from agent.active_runs import active_run_registry
 from .trigger_service import TriggerEvent, TriggerResult
 from .utils import format_workflow_for_llm
 
@@ -129,10 +130,10 @@ class SessionManager:
         client = await self._db.client
         
         try:
-            from sandbox.sandbox import create_sandbox, delete_sandbox
+            from sandbox.sandbox import delete_sandbox
+            from sandbox.sandbox_pool import acquire_sandbox
             
-            sandbox_pass = str(uuid.uuid4())
-            sandbox = await create_sandbox(sandbox_pass, project_id)
+            sandbox, sandbox_pass = await acquire_sandbox(project_id)
             sandbox_id = sandbox.id
             
             vnc_link = await sandbox.get_preview_link(6080)
@@ -306,7 +307,8 @@ class AgentExecutor:
         
         await self._register_agent_run(agent_run_id)
         
-        run_agent_background.send(
+        await enqueue_agent_run(
+            agent_config.get('account_id'), LANE_BACKGROUND,
             agent_run_id=agent_run_id,
             thread_id=thread_id,
             instance_id="trigger_executor",
@@ -327,8 +329,7 @@ class AgentExecutor:
     
     async def _register_agent_run(self, agent_run_id: str) -> None:
         try:
-            instance_key = f"active_run:trigger_executor:{agent_run_id}"
-            await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
+            await active_run_registry.register(agent_run_id, "trigger_executor")
         except Exception as e:
             logger.warning(f"Failed to register agent run in Redis: {e}")
 
@@ -363,7 +364,7 @@ class WorkflowExecutor:
             await self._create_workflow_message(thread_id, workflow_config, workflow_input)
             
             agent_run_id = await self._start_workflow_agent_execution(
-                thread_id, project_id, enhanced_agent_config
+                thread_id, project_id, account_id, enhanced_agent_config
             )
             
             return {
@@ -458,7 +459,7 @@ class WorkflowExecutor:
         
         tool_mapping = {
             'sb_shell_tool': ['execute_command'],
-            'sb_files_tool': ['create_file', 'str_replace', 'full_file_rewrite', 'delete_file'],
+            'sb_files_tool': ['create_file', 'str_replace', 'full_file_rewrite', 'delete_file', 'create_files', 'rewrite_files', 'delete_files'],
             'sb_browser_tool': ['browser_navigate_to', 'browser_take_screenshot'],
             'sb_vision_tool': ['see_image'],
             'sb_deploy_tool': ['deploy'],
@@ -520,6 +521,7 @@ class WorkflowExecutor:
         self,
         thread_id: str,
         project_id: str,
+        account_id: str,
         agent_config: Dict[str, Any]
     ) -> str:
         client = await self._db.client
@@ -537,7 +539,8 @@ class WorkflowExecutor:
         
         await self._register_workflow_run(agent_run_id)
         
-        run_agent_background.send(
+        await enqueue_agent_run(
+            account_id, LANE_BACKGROUND,
             agent_run_id=agent_run_id,
             thread_id=thread_id,
             instance_id=getattr(config, 'INSTANCE_ID', 'default'),
@@ -559,8 +562,7 @@ class WorkflowExecutor:
     async def _register_workflow_run(self, agent_run_id: str) -> None:
         try:
             instance_id = getattr(config, 'INSTANCE_ID', 'default')
-            instance_key = f"active_run:{instance_id}:{agent_run_id}"
-            await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
+            await active_run_registry.register(agent_run_id, instance_id)
         except Exception as e:
             logger.warning(f"Failed to register workflow run in Redis: {e}")
 
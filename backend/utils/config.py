@@ -270,6 +270,50 @@ class Configuration:
     API_KEY_SECRET: str = "default-secret-key-change-in-production"
     API_KEY_LAST_USED_THROTTLE_SECONDS: int = 900
 
+    # Context compression ("thread_pool" runs it off the event loop, "inline" on it)
+    CONTEXT_COMPRESSION_MODE: str = "thread_pool"
+    CONTEXT_COMPRESSION_MAX_WORKERS: int = 4
+    CONTEXT_COMPRESSION_TIMEOUT_SECONDS: int = 60
+
+    # Agent run response transport: "list" (RPUSH + pub/sub notifications) or "stream" (Redis Streams)
+    AGENT_RESPONSE_TRANSPORT: str = "list"
+
+    # Merge streamed assistant deltas into frames flushed every N ms or M bytes (0 ms disables)
+    AGENT_STREAM_COALESCE_INTERVAL_MS: int = 40
+    AGENT_STREAM_COALESCE_MAX_BYTES: int = 4096
+
+    # SSE fan-out per API process: recent frames kept in memory per run, and how long a run's
+    # feed outlives its last viewer
+    AGENT_STREAM_HUB_BUFFER_FRAMES: int = 4096
+    AGENT_STREAM_HUB_IDLE_SECONDS: int = 30
+
+    # MCP discovery: overall budget for connecting to all of an agent's servers, and tool-list cache TTL
+    MCP_DISCOVERY_TIMEOUT_SECONDS: int = 20
+    MCP_TOOL_CACHE_TTL_SECONDS: int = 3600
+
+    # Pre-warmed sandboxes kept ready per snapshot (0 disables the pool). Pooled sandboxes are
+    # replaced before Daytona's 30 minute auto-stop would catch them idle.
+    SANDBOX_POOL_TARGET_SIZE: int = 0
+    SANDBOX_POOL_MAX_AGE_SECONDS: int = 1200
+    SANDBOX_POOL_CHECK_INTERVAL_SECONDS: int = 30
+    SANDBOX_POOL_REFILL_CONCURRENCY: int = 2
+
+    # How long a looked-up sandbox handle is reused before Daytona is asked again. Keep it well
+    # below Daytona's 30 minute auto-stop, which is the only way sandboxes get stopped.
+    SANDBOX_HANDLE_TTL_SECONDS: int = 120
+
+    # Agent run admission (0 runs per worker sends runs straight to the actor): runs per worker
+    # process, runs per account across workers, waiting runs per account, and slot lease length
+    AGENT_RUN_WORKER_CONCURRENCY: int = 0
+    AGENT_RUN_ACCOUNT_CONCURRENCY: int = 3
+    AGENT_RUN_ACCOUNT_MAX_QUEUED: int = 20
+    AGENT_RUN_LEASE_SECONDS: int = 120
+
+    # Running agent runs are failed once their worker stops renewing them for this long;
+    # the API looks for such runs every REAP_INTERVAL seconds (0 disables)
+    ACTIVE_RUN_LEASE_SECONDS: int = 90
+    ACTIVE_RUN_REAP_INTERVAL_SECONDS: int = 60
+
     @property
     def STRIPE_PRODUCT_ID(self) -> str:
         if self.ENV_MODE == EnvMode.STAGING:
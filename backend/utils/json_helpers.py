@@ -8,6 +8,8 @@ them as proper JSONB objects in the database.
 import json
 from typing import Any, Union, Dict, List
 
+import orjson
+
 
 def ensure_dict(value: Union[str, Dict[str, Any], None], default: Dict[str, Any] = None) -> Dict[str, Any]:
     """
@@ -118,6 +120,25 @@ def safe_json_parse(value: Union[str, Dict, List, Any], default: Any = None) ->
     return value
 
 
+def fast_json_dumps(value: Any) -> str:
+    """
+    Serialize a value to compact JSON with orjson, for the streaming hot path.
+    
+    Non-ASCII characters are written as UTF-8 rather than escaped. Values orjson
+    cannot encode (e.g. integers over 64 bits) fall back to json.dumps.
+    
+    Args:
+        value: The value to serialize
+        
+    Returns:
+        JSON string representation
+    """
+    try:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    except TypeError:
+        return json.dumps(value)
+
+
 def to_json_string(value: Any) -> str:
     """
     Convert a value to a JSON string if needed.
@@ -134,14 +155,15 @@ def to_json_string(value: Any) -> str:
     if isinstance(value, str):
         # If it's already a string, check if it's valid JSON
         try:
+            # json rather than orjson: it also accepts NaN and big integers, which must not be re-encoded
             json.loads(value)
             return value  # It's already a JSON string
         except (json.JSONDecodeError, TypeError):
             # It's a plain string, encode it as JSON
-            return json.dumps(value)
+            return fast_json_dumps(value)
     
     # For all other types, convert to JSON
-    return json.dumps(value)
+    return fast_json_dumps(value)
 
 
 def format_for_yield(message_object: Dict[str, Any]) -> Dict[str, Any]:
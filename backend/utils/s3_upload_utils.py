@@ -8,28 +8,23 @@ from datetime import datetime
 from utils.logger import logger
 from services.supabase import DBConnection
 
-async def upload_base64_image(base64_data: str, bucket_name: str = "browser-screenshots") -> str:
-    """Upload a base64 encoded image to Supabase storage and return the URL.
+async def upload_image_bytes(image_data: bytes, content_type: str = "image/png", bucket_name: str = "browser-screenshots") -> str:
+    """Upload raw image bytes to Supabase storage and return the URL.
     
     Args:
-        base64_data (str): Base64 encoded image data (with or without data URL prefix)
+        image_data (bytes): Encoded image
+        content_type (str): MIME type of the image, also used for the file extension
         bucket_name (str): Name of the storage bucket to upload to
         
     Returns:
         str: Public URL of the uploaded image
     """
     try:
-        # Remove data URL prefix if present
-        if base64_data.startswith('data:'):
-            base64_data = base64_data.split(',')[1]
-        
-        # Decode base64 data
-        image_data = base64.b64decode(base64_data)
-        
         # Generate unique filename
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         unique_id = str(uuid.uuid4())[:8]
-        filename = f"image_{timestamp}_{unique_id}.png"
+        extension = "jpg" if content_type == "image/jpeg" else content_type.split('/')[-1]
+        filename = f"image_{timestamp}_{unique_id}.{extension}"
         
         # Upload to Supabase storage
         db = DBConnection()
@@ -37,7 +32,7 @@ async def upload_base64_image(base64_data: str, bucket_name: str = "browser-scre
         storage_response = await client.storage.from_(bucket_name).upload(
             filename,
             image_data,
-            {"content-type": "image/png"}
+            {"content-type": content_type}
         )
         
         # Get public URL
@@ -46,6 +41,31 @@ async def upload_base64_image(base64_data: str, bucket_name: str = "browser-scre
         logger.debug(f"Successfully uploaded image to {public_url}")
         return public_url
         
+    except Exception as e:
+        logger.error(f"Error uploading image: {e}")
+        raise RuntimeError(f"Failed to upload image: {str(e)}")
+
+async def upload_base64_image(base64_data: str, bucket_name: str = "browser-screenshots") -> str:
+    """Upload a base64 encoded image to Supabase storage and return the URL.
+    
+    Args:
+        base64_data (str): Base64 encoded image data (with or without data URL prefix)
+        bucket_name (str): Name of the storage bucket to upload to
+        
+    Returns:
+        str: Public URL of the uploaded image
+    """
+    try:
+        # Remove data URL prefix if present
+        if base64_data.startswith('data:'):
+            base64_data = base64_data.split(',')[1]
+        
+        # Decode base64 data
+        image_data = base64.b64decode(base64_data)
     except Exception as e:
         logger.error(f"Error uploading base64 image: {e}")
-        raise RuntimeError(f"Failed to upload image: {str(e)}") 
\ No newline at end of file
+        raise RuntimeError(f"Failed to upload image: {str(e)}")
+    
+    # Browser screenshots are JPEG; anything else keeps the PNG label
+    content_type = "image/jpeg" if image_data.startswith(b"\xff\xd8\xff") else "image/png"
+    return await upload_image_bytes(image_data, content_type, bucket_name)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Agent Response Transport Benchmark
+
+Replays a synthetic agent run through Redis and measures how long it takes
+until every viewer has received every response, plus how many Redis commands
+were issued. Compares:
+
+    legacy  - one RPUSH + one PUBLISH per response, viewers LRANGE on every notification
+    list    - ResponseWriter in list mode (batched RPUSH + PUBLISH), same viewers
+    stream  - ResponseWriter in stream mode, viewers use XREAD BLOCK
+
+Usage:
+    REDIS_HOST=localhost python benchmark_response_transport.py
+    REDIS_HOST=localhost python benchmark_response_transport.py --responses 4000 --viewers 3 --size 40
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from pathlib import Path
+
+# Add the backend directory to the path so we can import modules
+backend_dir = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services import redis
+from agent import response_transport
+from agent.response_transport import ResponseWriter, TRANSPORT_LIST, TRANSPORT_STREAM
+
+
+def make_responses(count: int, size: int):
+    chunk = "x" * size
+    responses = [
+        {"type": "assistant", "content": json.dumps({"role": "assistant", "content": chunk}), "metadata": json.dumps({"stream_status": "chunk"})}
+        for _ in range(count)
+    ]
+    responses.append({"type": "status", "status": "completed", "message": "Agent run completed successfully"})
+    return responses
+
+
+async def command_count() -> int:
+    redis_client = await redis.get_client()
+    stats = await redis_client.info("commandstats")
+    return sum(value.get("calls", 0) for value in stats.values() if isinstance(value, dict))
+
+
+async def list_viewer(run_id: str, expected: int) -> None:
+    """Mirror of the list-mode consumer in stream_agent_run."""
+    list_key = response_transport.response_list_key(run_id)
+    pubsub = await redis.create_pubsub()
+    await pubsub.subscribe(response_transport.response_channel(run_id))
+    received = 0
+    try:
+        while received < expected:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if not message:
+                continue
+            new = await redis.lrange(list_key, received, -1)
+            for item in new:
+                response_transport.parse_entry(item)
+            received += len(new)
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.close()
+
+
+async def stream_viewer(run_id: str, expected: int) -> None:
+    """Mirror of the stream-mode consumer in stream_agent_run."""
+    last_id = "0-0"
+    received = 0
+    while received < expected:
+        entries = await response_transport.read_stream(run_id, last_id, block_ms=1000)
+        for entry_id, fields in entries:
+            last_id = entry_id
+            received += 1
+
+
+async def legacy_writer(run_id: str, responses) -> None:
+    list_key = response_transport.response_list_key(run_id)
+    channel = response_transport.response_channel(run_id)
+    pending = []
+    for response in responses:
+        pending.append(asyncio.create_task(redis.rpush(list_key, json.dumps(response))))
+        pending.append(asyncio.create_task(redis.publish(channel, "new")))
+        await asyncio.sleep(0)
+    await asyncio.gather(*pending)
+
+
+async def batched_writer(run_id: str, responses, mode: str) -> None:
+    writer = ResponseWriter(run_id, mode=mode)
+    for response in responses:
+        writer.append(response)
+        await asyncio.sleep(0)
+    await writer.close()
+
+
+async def run_case(name: str, responses, viewers: int) -> dict:
+    run_id = f"bench-{uuid.uuid4().hex[:8]}"
+    expected = len(responses)
+    viewer = stream_viewer if name == "stream" else list_viewer
+
+    before = await command_count()
+    viewer_tasks = [asyncio.create_task(viewer(run_id, expected)) for _ in range(viewers)]
+    await asyncio.sleep(0.2)  # let viewers subscribe
+
+    start = time.perf_counter()
+    if name == "legacy":
+        await legacy_writer(run_id, responses)
+    else:
+        await batched_writer(run_id, responses, TRANSPORT_STREAM if name == "stream" else TRANSPORT_LIST)
+    write_done = time.perf_counter()
+    await asyncio.gather(*viewer_tasks)
+    end = time.perf_counter()
+    after = await command_count()
+
+    await redis.delete(response_transport.response_list_key(run_id))
+    await redis.delete(response_transport.response_stream_key(run_id))
+
+    return {
+        "case": name,
+        "write_ms": (write_done - start) * 1000,
+        "delivered_ms": (end - start) * 1000,
+        "redis_commands": after - before,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark agent response transports against a local Redis")
+    parser.add_argument("--responses", type=int, default=2000, help="Responses per run")
+    parser.add_argument("--viewers", type=int, default=2, help="Concurrent SSE viewers")
+    parser.add_argument("--size", type=int, default=20, help="Characters per assistant delta")
+    parser.add_argument("--cases", default="legacy,list,stream", help="Comma-separated cases to run")
+    args = parser.parse_args()
+
+    await redis.initialize_async()
+    responses = make_responses(args.responses, args.size)
+
+    print(f"📊 {len(responses)} responses, {args.viewers} viewers, {args.size}-char deltas")
+    print(f"{'case':<8} {'write ms':>10} {'delivered ms':>14} {'redis cmds':>12}")
+    try:
+        for name in args.cases.split(","):
+            result = await run_case(name.strip(), responses, args.viewers)
+            print(f"{result['case']:<8} {result['write_ms']:>10.1f} {result['delivered_ms']:>14.1f} {result['redis_commands']:>12}")
+    finally:
+        await redis.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())